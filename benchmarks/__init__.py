@@ -0,0 +1,3 @@
+"""
+Benchmarks of the CNVizard pipeline stages on seeded synthetic data.
+"""
@@ -0,0 +1,104 @@
+"""
+File which contains the comparison of two CNVizard benchmark results
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+
+Usage:
+    python -m benchmarks.compare baseline.json current.json --threshold 0.1
+    python -m benchmarks.compare baseline_memory.json current_memory.json --key rss_peak
+"""
+
+import sys
+import json
+import argparse
+
+# Statistics of the stages of time and memory results (see benchmarks.run)
+TIME_KEYS = ["median", "min"]
+MEMORY_KEYS = ["peak", "retained", "rss_peak", "rss_retained"]
+
+
+def compare_results(
+    baseline: dict, current: dict, threshold: float = 0.1, key: str = "median"
+) -> list:
+    """
+    Function which compares the stages of two benchmark results.
+
+    Args:
+        baseline (dict): Results of run_benchmarks of the baseline.
+        current (dict): Results of run_benchmarks of the compared code.
+        threshold (float): Relative change above which a stage counts as regressed (or improved).
+        key (str): Compared statistic of the stages, one of TIME_KEYS or MEMORY_KEYS matching the mode of the
+            results.
+
+    Returns:
+        list: (stage, baseline value, current value, relative change, status) tuples of the stages
+            present in both results with a value; status is "regressed", "improved" or "".
+    """
+    baseline_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+    rows = []
+    for stage in current["stages"]:
+        if stage["stage"] not in baseline_stages:
+            continue
+        before = baseline_stages[stage["stage"]].get(key)
+        after = stage.get(key)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before > 0 else 0.0
+        status = ""
+        if change > threshold:
+            status = "regressed"
+        elif change < -threshold:
+            status = "improved"
+        rows.append((stage["stage"], before, after, change, status))
+    return rows
+
+
+def main(argv=None) -> int:
+    """
+    Entry point of the benchmark comparison.
+
+    Args:
+        argv (list): Arguments (default: sys.argv[1:]).
+
+    Returns:
+        int: Exit code (1 if a stage regressed).
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare two CNVizard benchmark results."
+    )
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument(
+        "--key",
+        choices=TIME_KEYS + MEMORY_KEYS,
+        default=None,
+        help="Compared statistic (default: median in time mode, peak in memory mode).",
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as baseline, open(args.current) as current:
+        baseline, current = json.load(baseline), json.load(current)
+    mode = current["metadata"].get("mode", "time")
+    key = args.key or ("peak" if mode == "memory" else "median")
+    for name in ["scale", "seed", "mode"]:
+        if baseline["metadata"].get(name) != current["metadata"].get(name):
+            print(
+                f"Warning: {name} differs ({baseline['metadata'].get(name)} vs "
+                f"{current['metadata'].get(name)})",
+                file=sys.stderr,
+            )
+
+    rows = compare_results(baseline, current, args.threshold, key)
+    for stage, before, after, change, status in rows:
+        if key in MEMORY_KEYS:
+            values = f"{before / 2**20:10.1f} MB {after / 2**20:10.1f} MB"
+        else:
+            values = f"{before:10.4f} s {after:10.4f} s"
+        print(f"{stage:40s} {values} {change:+8.1%} {status}")
+    return 1 if any(status == "regressed" for *_, status in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+File which contains the seeded synthetic data generators of the CNVizard benchmarks
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+# Benchmark scales: number of targeted exons/bins per sample, samples per reference run and AnnotSV rows
+SCALES = {
+    "small": {"exons": 5_000, "samples": 4, "svs": 500},
+    "wes": {"exons": 200_000, "samples": 8, "svs": 5_000},
+    "wgs": {"exons": 3_000_000, "samples": 4, "svs": 50_000},
+}
+
+CHROMOSOMES = [f"chr{i}" for i in range(1, 23)] + ["chrX", "chrY"]
+
+# log2 values of the simulated copy number changes (hom. deletion, het. deletion, duplication)
+CNV_LOG2 = [-3.0, -1.0, 0.58]
+
+
+def make_targets(n_exons: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Function which creates the targets (exons or bins) shared by all samples of a benchmark.
+    Genes have a geometrically distributed number of exons (mean 10) and are spread over the chromosomes;
+    1% of the exons also belong to an overlapping antisense gene (GENE_EXON,GENE-AS1_EXON) and 10% are followed
+    by an Antitarget bin.
+
+    Args:
+        n_exons (int): Number of exons/bins.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: Targets with the columns chromosome, start, end, gene (CNVkit GENE_EXON labels).
+    """
+    rng = np.random.default_rng(seed)
+    counts = rng.geometric(0.1, size=n_exons)
+    ends = np.cumsum(counts)
+    n_genes = int(np.searchsorted(ends, n_exons)) + 1
+    counts = counts[:n_genes]
+    counts[-1] -= ends[n_genes - 1] - n_exons
+    genes = np.repeat(np.arange(n_genes), counts)
+    exons = np.arange(n_exons) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+
+    chromosomes = genes * len(CHROMOSOMES) // n_genes
+    first = np.searchsorted(chromosomes, chromosomes)
+    # One slot of 6 kb per exon plus a gap of 20 kb between genes
+    starts = 10_000 + 6_000 * (np.arange(n_exons) - first)
+    starts += 20_000 * (genes - genes[first])
+
+    labels = pd.Series(genes).map("GENE{}".format) + "_" + pd.Series(exons).astype(str)
+    antisense = rng.random(n_exons) < 0.01
+    labels[antisense] = (
+        labels[antisense]
+        + ","
+        + pd.Series(genes[antisense]).map("GENE{}-AS1".format).to_numpy()
+        + "_"
+        + exons[antisense].astype(str)
+    )
+    targets = pd.DataFrame(
+        {
+            "chromosome": np.array(CHROMOSOMES)[chromosomes],
+            "start": starts,
+            "end": starts + 150,
+            "gene": labels,
+        }
+    )
+    antitargets = targets[rng.random(n_exons) < 0.1].assign(gene="Antitarget")
+    antitargets["start"] += 500
+    antitargets["end"] = antitargets["start"] + 5_000
+    return pd.concat([targets, antitargets]).sort_index(kind="stable")
+
+
+def make_cnr(targets: pd.DataFrame, seed: int = 0, cnv_fraction: float = 0.02):
+    """
+    Function which creates the .cnr table of one sample.
+    Runs of a few exons in cnv_fraction of the rows carry a deletion or duplication.
+
+    Args:
+        targets (pd.DataFrame): Targets created by make_targets.
+        seed (int): Seed of the random generator (one per sample).
+        cnv_fraction (float): Fraction of the rows starting a copy number change.
+
+    Returns:
+        pd.DataFrame: .cnr table (chromosome, start, end, gene, depth, log2, weight).
+    """
+    rng = np.random.default_rng(seed)
+    n = len(targets)
+    log2 = rng.normal(0, 0.2, n)
+    run_starts = np.flatnonzero(rng.random(n) < cnv_fraction / 5)
+    run_lengths = rng.integers(1, 10, len(run_starts))
+    run_log2 = rng.choice(CNV_LOG2, len(run_starts), p=[0.1, 0.5, 0.4])
+    for start, length, value in zip(run_starts, run_lengths, run_log2):
+        noise = rng.normal(0, 0.1, min(length, n - start))
+        log2[start : start + length] = value + noise
+    cnr = targets.copy()
+    cnr["depth"] = rng.gamma(5, 40, n) * 2.0 ** np.minimum(log2, 1)
+    cnr["log2"] = log2
+    cnr["weight"] = rng.random(n)
+    return cnr
+
+
+def make_bintest(targets: pd.DataFrame, seed: int = 0, fraction: float = 0.05):
+    """
+    Function which creates the bintest table of one sample: a fraction of the targeted exons with a significant
+    copy number change.
+
+    Args:
+        targets (pd.DataFrame): Targets created by make_targets.
+        seed (int): Seed of the random generator (one per sample).
+        fraction (float): Fraction of the exons reported by the bintest.
+
+    Returns:
+        pd.DataFrame: bintest table (chromosome, start, end, gene, depth, log2, weight, probes, p_bintest).
+    """
+    rng = np.random.default_rng(seed)
+    exons = targets[targets["gene"] != "Antitarget"]
+    bintest = make_cnr(exons, seed)[rng.random(len(exons)) < fraction].copy()
+    bintest["log2"] = rng.choice(CNV_LOG2, len(bintest)) + rng.normal(
+        0, 0.1, len(bintest)
+    )
+    bintest["probes"] = 1
+    bintest["p_bintest"] = rng.random(len(bintest)) * 1e-3
+    return bintest
+
+
+def make_omim(targets: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
+    """
+    Function which creates an OMIM annotation table (omim.txt) for a quarter of the genes of the targets.
+
+    Args:
+        targets (pd.DataFrame): Targets created by make_targets.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: OMIM table (gene, OMIMG, Disease, OMIMP, Inheritance).
+    """
+    rng = np.random.default_rng(seed)
+    genes = targets["gene"].str.split("_").str[0].unique()
+    genes = genes[genes != "Antitarget"]
+    genes = genes[rng.random(len(genes)) < 0.25]
+    # Like the OMIM export, genes without a phenotype have empty Disease/OMIMP/Inheritance fields
+    # and genes with several phenotypes list them separated by "; "
+    phenotypes = rng.integers(100_000, 700_000, len(genes)).astype(str).astype(object)
+    several = rng.random(len(genes)) < 0.1
+    phenotypes[several] = phenotypes[several] + "; " + phenotypes[several]
+    with_phenotype = rng.random(len(genes)) < 0.5
+    return pd.DataFrame(
+        {
+            "gene": genes,
+            "OMIMG": rng.integers(100_000, 700_000, len(genes)),
+            "Disease": np.where(with_phenotype, "Synthetic disease", ""),
+            "OMIMP": np.where(with_phenotype, phenotypes, ""),
+            "Inheritance": np.where(
+                with_phenotype, rng.choice(["AD", "AR", "XL"], len(genes)), ""
+            ),
+        }
+    )
+
+
+def make_annotsv(targets: pd.DataFrame, n_svs: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Function which creates an AnnotSV table of structural variants placed on the targets.
+    A fifth of the ACMG classes uses the "full=<class>" notation of newer AnnotSV versions.
+
+    Args:
+        targets (pd.DataFrame): Targets created by make_targets.
+        n_svs (int): Number of structural variants.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: AnnotSV table with the columns of resources/annotsv_format.txt.
+    """
+    rng = np.random.default_rng(seed)
+    exons = targets[targets["gene"] != "Antitarget"]
+    anchors = exons.iloc[rng.integers(0, len(exons), n_svs)]
+    lengths = rng.integers(1_000, 500_000, n_svs)
+    acmg = rng.integers(1, 6, n_svs).astype(str).astype(object)
+    full = rng.random(n_svs) < 0.2
+    acmg[full] = "full=" + acmg[full]
+    return pd.DataFrame(
+        {
+            "SV_chrom": anchors["chromosome"].str.removeprefix("chr").to_numpy(),
+            "SV_start": anchors["start"].to_numpy(),
+            "SV_end": anchors["start"].to_numpy() + lengths,
+            "SV_length": lengths,
+            "SV_type": rng.choice(["DEL", "DUP"], n_svs),
+            "AnnotSV_ranking_score": rng.normal(0, 0.5, n_svs).round(2),
+            "ACMG_class": acmg,
+            "P_gain_phen": ".",
+            "P_loss_phen": ".",
+            "P_gain_hpo": ".",
+            "P_loss_hpo": ".",
+            "OMIM_ID": rng.integers(100_000, 700_000, n_svs),
+            "OMIM_inheritance": rng.choice(["AD", "AR", "."], n_svs),
+            "LOEUF_bin": rng.integers(0, 10, n_svs),
+            "GnomAD_pLI": rng.random(n_svs).round(3),
+            "CytoBand": "p11.1",
+            "AnnotSV_ranking_criteria": ".",
+            "Gene_name": anchors["gene"].str.split("_").str[0].to_numpy(),
+        }
+    )
+
+
+def write_dataset(directory: str, scale: str, seed: int = 0) -> dict:
+    """
+    Function which writes the synthetic dataset of a scale, unless it was already written:
+    a run directory laid out like a WES run (<run>/<sample>/results/CNV/<sample>.cnr and <sample>_bintest.tsv),
+    an index sample, its parents (.cnr files for the trio), omim.txt and an AnnotSV table.
+
+    Args:
+        directory (str): Directory of the dataset.
+        scale (str): Benchmark scale (see SCALES).
+        seed (int): Seed of the generators.
+
+    Returns:
+        dict: Paths of the dataset (run, cnr, bintest, father, mother, omim, annotsv) and the number of exons.
+    """
+    config = SCALES[scale]
+    directory = os.path.join(directory, f"{scale}_{seed}")
+    paths = {
+        "run": os.path.join(directory, "run"),
+        "cnr": os.path.join(directory, "index.cnr"),
+        "bintest": os.path.join(directory, "index_bintest.tsv"),
+        "father": os.path.join(directory, "father.cnr"),
+        "mother": os.path.join(directory, "mother.cnr"),
+        "omim": os.path.join(directory, "omim.txt"),
+        "annotsv": os.path.join(directory, "annotsv.tsv"),
+        "exons": config["exons"],
+    }
+    # The AnnotSV table is written last, so it marks a complete dataset
+    # (datasets written before the parents were added lack the parental files)
+    if os.path.exists(paths["annotsv"]) and os.path.exists(paths["mother"]):
+        return paths
+
+    targets = make_targets(config["exons"], seed)
+    for sample in range(config["samples"]):
+        name = f"S{sample}"
+        sample_dir = os.path.join(paths["run"], name, "results", "CNV")
+        os.makedirs(sample_dir, exist_ok=True)
+        make_cnr(targets, seed + 1 + sample).to_csv(
+            os.path.join(sample_dir, f"{name}.cnr"), sep="\t", index=False
+        )
+        make_bintest(targets, seed + 1 + sample).to_csv(
+            os.path.join(sample_dir, f"{name}_bintest.tsv"), sep="\t", index=False
+        )
+    make_cnr(targets, seed).to_csv(paths["cnr"], sep="\t", index=False)
+    make_bintest(targets, seed).to_csv(paths["bintest"], sep="\t", index=False)
+    for number, parent in enumerate(["father", "mother"]):
+        make_cnr(targets, seed + 1_000 + number).to_csv(
+            paths[parent], sep="\t", index=False
+        )
+    make_omim(targets, seed).to_csv(paths["omim"], sep="\t", index=False)
+    make_annotsv(targets, config["svs"], seed).to_csv(
+        paths["annotsv"], sep="\t", index=False
+    )
+    return paths
@@ -0,0 +1,678 @@
+"""
+File which contains the benchmark runner of the CNVizard pipeline stages
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+
+Usage:
+    python -m benchmarks.run --scale wes --output wes.json
+    python -m benchmarks.run --scale wes --mode memory --output wes_memory.json
+"""
+
+import gc
+import os
+import ctypes
+import sys
+import json
+import time
+import threading
+import tracemalloc
+import platform
+import argparse
+import datetime
+import itertools
+import statistics
+import subprocess
+import tempfile
+import warnings
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from cnvizard import (
+    CNVExporter,
+    CNVPlotter,
+    CNVVisualizer,
+    CNVViews,
+    VIEW_NAMES,
+    create_reference_files,
+    merge_reference_files,
+    read_cnvkit_table,
+    load_reference_df,
+    load_gene_index,
+    filter_tsv,
+    prepare_sample,
+    format_table,
+    merge_trio,
+    publish_reference,
+    load_shared_reference,
+    process_sample,
+    EXPORT_FORMATS,
+)
+from cnvizard.reference_store import clear_reference_cache
+from .generators import SCALES, CHROMOSOMES, write_dataset
+
+
+class BenchmarkPlotter(CNVPlotter):
+    """
+    Plotter which keeps the constructed figures instead of passing them to Streamlit,
+    so only the figure construction is measured.
+    """
+
+    def show_figure(self, fig, number_of_exons: int):
+        self.figure = fig
+
+
+def _stages(context: dict) -> list:
+    """
+    Function which defines the benchmarked stages in pipeline order.
+    Every stage is a (name, number of input rows, function) tuple; the result of a function is stored
+    in the context under the name of the stage, so later stages can use it.
+
+    Args:
+        context (dict): Paths of the dataset and the working directories.
+
+    Returns:
+        list: Stages.
+    """
+    paths = context["paths"]
+    work = context["work"]
+    exons = paths["exons"]
+    exporter = CNVExporter()
+    publications = itertools.count()
+
+    def visualizer():
+        cnr_df, bintest_df = context["read_cnvkit_table"]
+        return CNVVisualizer(None, cnr_df, bintest_df)
+
+    def create(reference_type):
+        output = os.path.join(work, reference_type)
+        os.makedirs(output, exist_ok=True)
+        create_reference_files(
+            paths["run"],
+            "WES",
+            output,
+            os.path.dirname(paths["omim"]),
+            reference_type,
+            "S",
+            n_workers=context["workers"],
+        )
+
+    def merge():
+        output = os.path.join(work, "merged")
+        os.makedirs(output, exist_ok=True)
+        merge_reference_files(
+            os.path.join(work, "normal"),
+            output,
+            os.path.join(work, "bintest"),
+            gene_indexed=True,
+        )
+        return (
+            os.path.join(output, "cnv_reference.parquet"),
+            os.path.join(output, "cnv_reference_bintest.parquet"),
+        )
+
+    def load_reference():
+        # Measures the first load of the reference by a server process
+        clear_reference_cache()
+        return load_reference_df(context["merge_reference_files"][0])
+
+    def publish():
+        # A new directory per call, so every call writes the published files
+        directory = os.path.join(work, f"published_{next(publications)}")
+        return [
+            load_shared_reference(publish_reference(path, directory))
+            for path in context["merge_reference_files"]
+        ]
+
+    def merge_frequencies():
+        reference, reference_bintest = context["publish_reference"]
+        return prepare_sample(
+            visualizer(), reference, reference_bintest, paths["omim"], None
+        )
+
+    def apply_filters():
+        return visualizer().apply_filters(
+            context["prepare_sample"][1],
+            "1",
+            "50000000",
+            "20",
+            "0.1",
+            CHROMOSOMES[:5],
+            [0, 1, 3],
+            "",
+            [],
+            CHROMOSOMES,
+            [0, 1, 2, 3],
+            [],
+            "0.5",
+            "",
+            "",
+        )
+
+    def plot(kind):
+        cnr_db = context["prepare_sample"][1]
+        gene = cnr_db["gene"].value_counts().index[0]
+        reference_path = context["merge_reference_files"][0]
+        plotter = BenchmarkPlotter()
+        plot_function = (
+            plotter.plot_log2_for_gene_precomputed
+            if kind == "log2"
+            else plotter.plot_depth_for_gene_precomputed
+        )
+        plot_function(
+            gene,
+            cnr_db,
+            load_reference_df(reference_path),
+            "index",
+            load_gene_index(reference_path),
+        )
+        return plotter.figure
+
+    def views():
+        candidate_df, cnr_db, bintest_db = context["prepare_sample"]
+        cnv_views = CNVViews(
+            visualizer(),
+            {},
+            "index",
+            candidate_df,
+            {
+                "candidate": None,
+                "del_size": "2",
+                "dup_size": "2",
+                "across_genes": False,
+            },
+        )
+        cnv_views.add_base("total_all", "", lambda: cnr_db)
+        cnv_views.add_base("bintest", "", lambda: format_table(bintest_db))
+        return [cnv_views.get(name, unfiltered=True) for name in VIEW_NAMES]
+
+    def parents():
+        return [
+            visualizer().prepare_parent_cnv(read_cnvkit_table(paths[parent]))
+            for parent in ["father", "mother"]
+        ]
+
+    def annotsv():
+        # filter_tsv alters its input
+        return filter_tsv(
+            context["read_annotsv"].copy(),
+            [str(i) for i in range(1, 23)] + ["X", "Y"],
+            ["DEL", "DUP"],
+            [1, 2, 3, 4, 5],
+            [],
+            [],
+            [],
+        )
+
+    def export(export_format):
+        return exporter.save_tables_as_excel(
+            *context["views"],
+            output_path=os.path.join(work, f"all{EXPORT_FORMATS[export_format]}"),
+            export_format=export_format,
+        )
+
+    def run_sample():
+        reference_path, reference_bintest_path = context["merge_reference_files"]
+        # The first call publishes the references into the default directory
+        return process_sample(
+            "index",
+            paths["cnr"],
+            paths["bintest"],
+            work,
+            reference_path,
+            reference_bintest_path,
+            paths["omim"],
+        )
+
+    samples = SCALES[context["scale"]]["samples"]
+    svs = SCALES[context["scale"]]["svs"]
+    stages = [
+        ("create_reference_files[normal]", samples * exons, lambda: create("normal")),
+        (
+            "create_reference_files[bintest]",
+            samples * exons,
+            lambda: create("bintest"),
+        ),
+        ("merge_reference_files", samples * exons, merge),
+        ("load_reference_df", exons, load_reference),
+        ("publish_reference", exons, publish),
+        (
+            "read_cnvkit_table",
+            exons,
+            lambda: (
+                read_cnvkit_table(paths["cnr"]),
+                read_cnvkit_table(paths["bintest"]),
+            ),
+        ),
+        ("format_df", exons, lambda: visualizer().format_df(paths["omim"], None)),
+        ("prepare_sample", exons, merge_frequencies),
+        ("apply_filters", exons, apply_filters),
+        (
+            "filter_for_consecutive_cnvs[del]",
+            exons,
+            lambda: visualizer().filter_for_consecutive_cnvs(
+                context["prepare_sample"][1], "del", "2", "2"
+            ),
+        ),
+        (
+            "filter_for_consecutive_cnvs[dup]",
+            exons,
+            lambda: visualizer().filter_for_consecutive_cnvs(
+                context["prepare_sample"][1], "dup", "2", "2"
+            ),
+        ),
+        ("plot_log2_for_gene_precomputed", exons, lambda: plot("log2")),
+        ("plot_depth_for_gene_precomputed", exons, lambda: plot("depth")),
+        ("views", exons, views),
+        ("prepare_parent_cnv", 2 * exons, parents),
+        (
+            "merge_trio",
+            exons,
+            lambda: merge_trio(
+                context["prepare_sample"][1], *context["prepare_parent_cnv"]
+            ),
+        ),
+        (
+            "read_annotsv",
+            svs,
+            lambda: pd.read_csv(paths["annotsv"], delimiter="\t"),
+        ),
+        ("filter_tsv", svs, annotsv),
+    ]
+    stages += [
+        (
+            f"save_tables_as_excel[{export_format}]",
+            exons,
+            lambda export_format=export_format: export(export_format),
+        )
+        for export_format in EXPORT_FORMATS
+    ]
+    stages += [
+        (
+            "save_filtered_table_as_excel",
+            exons,
+            lambda: exporter.save_filtered_table_as_excel(
+                context["apply_filters"],
+                "total",
+                output_path=os.path.join(work, "filtered.xlsx"),
+            ),
+        ),
+        (
+            "save_tables_as_excel_tsv",
+            svs,
+            lambda: exporter.save_tables_as_excel_tsv(
+                context["filter_tsv"], output_path=os.path.join(work, "annotsv.xlsx")
+            ),
+        ),
+        ("process_sample", exons, run_sample),
+    ]
+    return stages
+
+
+def measure_time(function, repeat: int):
+    """
+    Function which calls a function repeat times and measures the wall time of each call.
+
+    Args:
+        function (callable): Function without arguments.
+        repeat (int): Number of calls.
+
+    Returns:
+        tuple: Result of the last call and the list of wall times in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, times
+
+
+def _rss() -> int:
+    """
+    Function which returns the resident set size of the process.
+
+    Returns:
+        int: Resident set size in bytes (None where /proc is not available).
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _release_memory():
+    """
+    Function which returns the freed heap memory of the process to the operating system (glibc only),
+    so memory freed by an earlier stage does not hide the RSS growth of the next one.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Function which resets the peak resident set size (VmHWM) of the process.
+
+    Returns:
+        bool: True if the peak was reset (Linux only).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int:
+    """
+    Function which returns the peak resident set size (VmHWM) of the process.
+
+    Returns:
+        int: Peak resident set size in bytes (None where /proc is not available).
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RSSSampler(threading.Thread):
+    """
+    Thread which samples the resident set size of the process until it is stopped and keeps the maximum.
+    Sampling misses peaks shorter than the interval (and while the GIL is held),
+    so measure_memory also reads the kernel's peak where it can be reset.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Constructor of the class RSSSampler.
+
+        Args:
+            interval (float): Sampling interval in seconds.
+        """
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _rss()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def stop(self) -> int:
+        """
+        Function which stops the sampling.
+
+        Returns:
+            int: Maximal sampled resident set size in bytes.
+        """
+        self._stopped.set()
+        self.join()
+        self.peak = max(self.peak, _rss())
+        return self.peak
+
+
+def measure_memory(function):
+    """
+    Function which calls a function once and measures its memory use:
+    the peak and retained (still allocated after the call, including the result) Python/NumPy allocations
+    traced by tracemalloc, and the peak and retained growth of the resident set size, which also covers
+    allocations tracemalloc does not see (Arrow buffers, memory-mapped pages) but also the traces of tracemalloc.
+
+    Args:
+        function (callable): Function without arguments.
+
+    Returns:
+        tuple: Result of the call and a dict with the keys peak, retained, rss_peak and rss_retained (bytes,
+            the RSS values are None where /proc is not available).
+    """
+    _release_memory()
+    rss_before = _rss()
+    hwm_reset = rss_before is not None and _reset_peak_rss()
+    sampler = RSSSampler() if rss_before is not None else None
+    if sampler is not None:
+        sampler.start()
+    tracemalloc.start()
+    try:
+        result = function()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        rss_peak = sampler.stop() if sampler is not None else None
+    if rss_before is None:
+        return result, {
+            "peak": peak,
+            "retained": retained,
+            "rss_peak": None,
+            "rss_retained": None,
+        }
+    if hwm_reset:
+        rss_peak = max(rss_peak, _peak_rss() or 0)
+    _release_memory()
+    return result, {
+        "peak": peak,
+        "retained": retained,
+        "rss_peak": rss_peak - rss_before,
+        "rss_retained": _rss() - rss_before,
+    }
+
+
+def _summarize_warnings(caught: list) -> list:
+    """
+    Function which groups the warnings recorded during a stage by category, message and location.
+
+    Args:
+        caught (list): warnings.WarningMessage objects recorded by warnings.catch_warnings.
+
+    Returns:
+        list: Dicts with the keys category, message, location and count, in the order the warnings first occurred.
+    """
+    summary = {}
+    for warning in caught:
+        lines = [line.strip() for line in str(warning.message).splitlines()]
+        key = (
+            warning.category.__name__,
+            next((line for line in lines if line), ""),
+            f"{warning.filename}:{warning.lineno}",
+        )
+        summary[key] = summary.get(key, 0) + 1
+    return [
+        {"category": category, "message": message, "location": location, "count": count}
+        for (category, message, location), count in summary.items()
+    ]
+
+
+def _metadata(scale: str, seed: int, repeat: int, mode: str) -> dict:
+    """
+    Function which describes the benchmarked code and machine, so results can be compared across commits.
+
+    Args:
+        scale (str): Benchmark scale.
+        seed (int): Seed of the generators.
+        repeat (int): Number of calls per stage.
+        mode (str): time or memory.
+
+    Returns:
+        dict: Metadata of the benchmark run.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "scale": scale,
+        "seed": seed,
+        "repeat": repeat,
+        "mode": mode,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "pyarrow": pa.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(
+    scale: str,
+    seed: int = 0,
+    repeat: int = 3,
+    data_dir: str = None,
+    work_dir: str = None,
+    stages: list = None,
+    workers: int = 1,
+    mode: str = "time",
+) -> dict:
+    """
+    Function which generates (or reuses) the synthetic dataset of a scale and benchmarks the pipeline stages.
+    In time mode, every stage is called repeat times and its wall times are reported. In memory mode, every
+    stage is called once under tracemalloc and RSS sampling (see measure_memory) and its peak and retained
+    memory are reported, also per input row.
+
+    Args:
+        scale (str): Benchmark scale (see SCALES).
+        seed (int): Seed of the generators.
+        repeat (int): Number of calls per stage (the minimum and median are reported).
+        data_dir (str): Directory of the generated datasets (default: <tmp>/cnvizard-benchmarks).
+        work_dir (str): Directory of the stage outputs (default: a temporary directory).
+        stages (list): Names of the reported stages (default: all). Stages whose results are needed by a
+            reported stage are run once without being reported (nor their warnings).
+        workers (int): Number of worker processes of create_reference_files.
+        mode (str): time or memory.
+
+    Returns:
+        dict: Benchmark results with the keys metadata and stages. Every stage lists the warnings raised
+            by it (see _summarize_warnings), e.g. deprecations of pandas.
+    """
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), "cnvizard-benchmarks")
+    work_dir = work_dir or tempfile.mkdtemp(prefix="cnvizard-benchmark-")
+    context = {
+        "paths": write_dataset(data_dir, scale, seed),
+        "work": work_dir,
+        "scale": scale,
+        "workers": workers,
+    }
+    results = []
+    for name, rows, function in _stages(context):
+        # Warnings are recorded per stage instead of interleaving with the results
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            if stages is not None and name not in stages:
+                context[name], _ = measure_time(function, 1)
+                continue
+            if mode == "memory":
+                context[name], memory = measure_memory(function)
+                result = {
+                    "stage": name,
+                    "rows": rows,
+                    **memory,
+                    "peak_per_row": memory["peak"] / rows,
+                    "rss_peak_per_row": (
+                        memory["rss_peak"] / rows
+                        if memory["rss_peak"] is not None
+                        else None
+                    ),
+                }
+            else:
+                context[name], times = measure_time(function, repeat)
+                result = {
+                    "stage": name,
+                    "rows": rows,
+                    "times": times,
+                    "min": min(times),
+                    "median": statistics.median(times),
+                    "rows_per_second": (
+                        rows / min(times) if min(times) > 0 else None
+                    ),
+                }
+        result["warnings"] = _summarize_warnings(caught)
+        results.append(result)
+
+        if mode == "memory":
+            rss_peak = (memory["rss_peak"] or 0) / 2**20
+            print(
+                f"{name:40s} {memory['peak'] / 2**20:10.1f} MB traced "
+                f"{rss_peak:10.1f} MB RSS",
+                file=sys.stderr,
+            )
+        else:
+            print(f"{name:40s} {min(times):10.4f} s", file=sys.stderr)
+        for warning in result["warnings"]:
+            print(
+                f"    {warning['count']} x {warning['category']} "
+                f"({warning['location']}): {warning['message']}",
+                file=sys.stderr,
+            )
+    if mode == "memory":
+        repeat = 1
+    return {"metadata": _metadata(scale, seed, repeat, mode), "stages": results}
+
+
+def main(argv=None) -> int:
+    """
+    Entry point of the benchmark runner.
+
+    Args:
+        argv (list): Arguments (default: sys.argv[1:]).
+
+    Returns:
+        int: Exit code.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the CNVizard pipeline stages on synthetic data."
+    )
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--mode",
+        choices=["time", "memory"],
+        default="time",
+        help="Measure wall times or peak/retained memory (one call per stage).",
+    )
+    parser.add_argument("--stage", action="append", dest="stages", default=None)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--output", default=None, help="JSON file (default: stdout).")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        args.scale,
+        args.seed,
+        args.repeat,
+        args.data_dir,
+        args.work_dir,
+        args.stages,
+        args.workers,
+        args.mode,
+    )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
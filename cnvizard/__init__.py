@@ -7,10 +7,39 @@ from .reference_processing import (
     prepare_cnv_table,
     explode_cnv_table,
     merge_reference_files,
+    update_reference_files,
     create_reference_files,
 )
 from .styler import make_pretty
-from .exporter import CNVExporter
+from .exporter import CNVExporter, EXPORT_FORMATS
 from .plotter import CNVPlotter
 from .helpers import filter_tsv
 from .visualizer import CNVVisualizer
+from .reference_store import (
+    load_reference_df,
+    load_reference_table,
+    load_gene_index,
+    select_reference_gene,
+    read_reference_gene,
+    publish_reference,
+    load_shared_reference,
+    SharedReference,
+)
+from .schema import apply_schema, widen_floats, SAMPLE_DTYPES, REFERENCE_DTYPES
+from .readers import read_cnvkit_table
+from .annotation import annotate_cnv_table, classify_calls
+from .views import CNVViews, VIEW_NAMES, make_key, memoize
+from .filters import CNVFilterEngine
+from .intervals import IntervalIndex, parse_regions
+from .segments import find_segments, select_segments, segment_rows
+from .jobs import ExportJob, ExportJobManager, get_export_manager
+from .table import sort_order, page_count, get_page, PAGE_SIZES
+from .pipeline import (
+    prepare_sample,
+    format_table,
+    merge_trio,
+    find_samples,
+    process_sample,
+    run_batch,
+)
+from .timing import span, timed, set_timing, timing_enabled, record_spans
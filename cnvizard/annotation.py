@@ -0,0 +1,91 @@
+"""
+File which contains the CNV annotation kernel shared by the reference, sample and parent paths of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from .readers import split_gene_field
+
+# Upper log2 bounds of the calls 0 (hom. deletion), 1 (het. deletion) and 2 (wild type), larger values are called 3 (duplication)
+CALL_THRESHOLDS = np.array([-1.1, -0.4, 0.3])
+
+# Call of missing log2 values, which match none of the call classes
+NO_CALL = -1
+
+# Leading columns of an annotated table, all further columns keep their order and the copy number comes last
+LEADING_COLUMNS = [
+    "chromosome",
+    "start",
+    "end",
+    "gene",
+    "exon",
+    "log2",
+    "weight",
+    "call",
+    "depth",
+]
+
+
+def classify_calls(log2) -> np.ndarray:
+    """
+    Function which translates log2 values into calls with a single binned lookup.
+    0: homozygous deletion, 1: heterozygous deletion, 2: wild type, 3: duplication,
+    NO_CALL (-1): missing log2 value.
+
+    Args:
+        log2 (array-like): log2 values.
+
+    Returns:
+        np.ndarray: int8 array containing the calls.
+    """
+    log2 = np.asarray(log2, dtype=np.float64)
+    calls = np.digitize(log2, CALL_THRESHOLDS, right=True).astype(np.int8)
+    # np.digitize sorts NaN after every threshold, which would call it a duplication
+    calls[np.isnan(log2)] = NO_CALL
+    return calls
+
+
+def annotate_cnv_table(
+    df: pd.DataFrame, copy_number_column: str = "CN"
+) -> pd.DataFrame:
+    """
+    Function which annotates an exploded .cnr/bintest DataFrame.
+    1. Drop antitarget entries and split gene and exon (skipped for tables read by read_cnvkit_table).
+    2. Translate the log2 values into calls.
+    3. Add the copy number (2 ** log2).
+    4. Order the columns by name: chromosome, start, end, gene, exon, log2, weight, call, depth,
+       further columns, copy number.
+
+    Args:
+        df (pd.DataFrame): Exploded .cnr/bintest DataFrame.
+        copy_number_column (str): Name of the copy number column (CN or squaredvalue).
+
+    Returns:
+        pd.DataFrame: Annotated DataFrame.
+    """
+    columns = {}
+    if "exon" in df.columns:
+        gene, exon = df["gene"], df["exon"]
+    else:
+        is_target, gene, exon = split_gene_field(pa.array(df["gene"], pa.string()))
+        df = df[is_target.to_numpy(zero_copy_only=False)]
+        gene = gene.to_pandas()
+        exon = exon.to_pandas()
+    log2 = df["log2"].to_numpy()
+    columns["gene"] = gene.array
+    columns["exon"] = exon.array
+    columns["call"] = classify_calls(log2)
+    for name in df.columns:
+        if name not in columns:
+            columns[name] = df[name].array
+    columns[copy_number_column] = 2**log2
+
+    order = [name for name in LEADING_COLUMNS if name in columns]
+    order += [name for name in columns if name not in order]
+    order.remove(copy_number_column)
+    order.append(copy_number_column)
+    return pd.DataFrame({name: columns[name] for name in order}, index=df.index)
@@ -6,6 +6,7 @@ File which is used to run the CNVizard app
 """
 
 import os
+import time
 import dotenv
 import argparse
 import cnvlib
@@ -19,6 +20,29 @@ from cnvizard import (
     CNVVisualizer,
     prepare_cnv_table,
     explode_cnv_table,
+    load_reference_df,
+    load_gene_index,
+    read_cnvkit_table,
+    CNVViews,
+    VIEW_NAMES,
+    make_key,
+    memoize,
+    CNVFilterEngine,
+    get_export_manager,
+    EXPORT_FORMATS,
+    sort_order,
+    page_count,
+    get_page,
+    PAGE_SIZES,
+    prepare_sample,
+    format_table,
+    merge_trio,
+    publish_reference,
+    load_shared_reference,
+    span,
+    set_timing,
+    timing_enabled,
+    record_spans,
 )
 from pathlib import Path
 
@@ -161,22 +185,140 @@ def load_and_select_env():
     return None
 
 
-def prepare_filter_for_consecutive_cnvs(self, df: pd.DataFrame) -> pd.DataFrame:
+def show_export_job(
+    job, message_column, button_column, label: str, file_name: str
+):
     """
-    Function which is used to filter for consecutively deleted/duplicated exons.
+    Shows the state of an export job: a download button once it is finished, its progress while it is running.
+    A running job is polled by a fragment, which reruns the app when the job is finished.
 
     Args:
-        df (pd.DataFrame): .cnr DataFrame
+        job (ExportJob): Export job or None if no export was requested.
+        message_column: Container for messages and the progress bar.
+        button_column: Container for the download button.
+        label (str): Label of the download button.
+        file_name (str): File name of the download.
+    """
+    if job is None:
+        message_column.write("Click button to prepare download")
+        return
+    if job.done():
+        if job.error() is not None:
+            message_column.error(f"Export failed: {job.error()}")
+            return
+        try:
+            # The file is only read while the button is created, it is not kept in memory by the job
+            with open(job.result(), "rb") as exported_file:
+                button_column.download_button(
+                    label=label, data=exported_file, file_name=file_name
+                )
+        except FileNotFoundError:
+            message_column.warning("The export expired, please prepare it again.")
+        return
+
+    @st.experimental_fragment(run_every=1)
+    def show_progress():
+        if job.done():
+            st.rerun()
+        st.progress(
+            job.progress,
+            text=f"Exporting ({job.done_steps}/{job.total_steps} sheets)",
+        )
 
-    Returns:
-        pd.DataFrame: .cnr DataFrame filtered for consecutively deleted/duplicated exons.
+    with message_column:
+        show_progress()
+
+
+def show_paged_table(df: pd.DataFrame, view_key, styled: bool = True):
+    """
+    Shows one page of a table, sorted on the server side. The sort order is cached per view and column,
+    and the styler is only applied to the rows of the shown page, so a page renders in constant time.
+
+    Args:
+        df (pd.DataFrame): Displayed table (cached view, not altered).
+        view_key: Cache key of the displayed view.
+        styled (bool): Apply make_pretty to the shown page.
+    """
+    controls = st.columns(4)
+    sort_column = controls[0].selectbox("Sort by", [None, *df.columns])
+    ascending = controls[1].radio(
+        "Order", ["ascending", "descending"], horizontal=True
+    )
+    page_size = controls[2].selectbox("Rows per page", PAGE_SIZES, index=1)
+    number_of_pages = page_count(len(df), page_size)
+    # Jump back to the last page if the table shrank (e.g. after filtering)
+    if st.session_state.get("cnvizard_page", 1) > number_of_pages:
+        st.session_state["cnvizard_page"] = number_of_pages
+    page = controls[3].number_input(
+        f"Page (of {number_of_pages})",
+        min_value=1,
+        max_value=number_of_pages,
+        step=1,
+        key="cnvizard_page",
+    )
+
+    with span("sort table", rows=len(df)):
+        order = memoize(
+            st.session_state.setdefault("cnvizard_tables", {}),
+            (view_key, sort_column, ascending),
+            lambda: sort_order(df, sort_column, ascending == "ascending"),
+            max_entries=8,
+        )
+    page_df = get_page(df, order, page, page_size)
+    with span("style and show page", rows=len(page_df)):
+        st.dataframe(page_df.style.pipe(make_pretty) if styled else page_df)
+    if len(page_df):
+        first_row = (page - 1) * page_size
+        st.caption(f"Rows {first_row + 1}-{first_row + len(page_df)} of {len(df)}")
+
+
+def show_timing(records: list, total_ms: float):
     """
-    df = df.copy()  # Create a copy to avoid SettingWithCopyWarning
-    df["difference_previous"] = df.groupby("gene")["exon"].diff()
-    df["difference_previous"] = df["difference_previous"].fillna(method="bfill")
-    df["difference_next"] = df.groupby("gene")["exon"].diff(periods=-1)
-    df["difference_next"] = df["difference_next"].fillna(method="ffill")
-    return df
+    Shows the timing breakdown of the script run in the sidebar: one row per span, indented by nesting depth.
+
+    Args:
+        records (list): Span records of the script run (see record_spans).
+        total_ms (float): Wall time of the script run in milliseconds.
+    """
+    with st.sidebar.expander("Timing", expanded=True):
+        st.caption(f"Script run: {total_ms:.0f} ms")
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "stage": [
+                        "\u2003" * record["depth"] + record["name"]
+                        for record in records
+                    ],
+                    "ms": [record["duration_ms"] for record in records],
+                    "share": [
+                        (record["duration_ms"] or 0) / total_ms if total_ms else 0
+                        for record in records
+                    ],
+                }
+            ),
+            hide_index=True,
+            column_config={
+                "ms": st.column_config.NumberColumn(format="%.1f"),
+                "share": st.column_config.ProgressColumn(min_value=0, max_value=1),
+            },
+        )
+
+
+def run(env_file_path):
+    """
+    Runs one script run of the app. When timing is enabled (CNVIZARD_TIMING, see cnvizard.timing),
+    the spans of the run are recorded and shown in the sidebar, also if the run was stopped early.
+
+    Args:
+        env_file_path (str): Path to the .env file (None to select one).
+    """
+    start = time.perf_counter()
+    with record_spans() as records:
+        try:
+            main(env_file_path)
+        finally:
+            if timing_enabled() and records:
+                show_timing(records, (time.perf_counter() - start) * 1000)
 
 
 def main(env_file_path):
@@ -187,6 +329,7 @@ def main(env_file_path):
 
     # Load environment variables
     dotenv.load_dotenv(env_file_path)
+    set_timing()
     igv_string = os.getenv("APPSETTING_IGV_OUTLINK")
 
     # Load paths from environment variables
@@ -246,14 +389,25 @@ def main(env_file_path):
         else "exome_cnv_reference_bintest_large.parquet"
     )
 
+    # Parsed uploads and computed views are cached across reruns of this session
+    view_cache = st.session_state.setdefault("cnvizard_views", {})
     sample_name = ""
+    sample_key = None
+    # Set by the sample block, which only runs once the references are published
+    cnv_visualizer_instance = None
+    cnr_db = None
     reference_df = None
+    reference_gene_index = None
     cnr_df = None
     bintest_df = None
     if entered_cnr:
         sample_name = entered_cnr.name.split(".")[0]
         try:
-            cnr_df = pd.read_csv(entered_cnr, delimiter="\t")
+            cnr_key = make_key("cnr", entered_cnr.getvalue())
+            with span("read .cnr"):
+                cnr_df = memoize(
+                    view_cache, cnr_key, lambda: read_cnvkit_table(entered_cnr)
+                )
         except Exception as e:
             st.error(f"Error reading .cnr file: {e}")
             cnr_df = None
@@ -261,34 +415,51 @@ def main(env_file_path):
             igv_string = igv_string.replace("samplename", sample_name)
     if entered_bintest:
         try:
-            bintest_df = pd.read_csv(entered_bintest, delimiter="\t")
+            bintest_key = make_key("bintest", entered_bintest.getvalue())
+            with span("read bintest"):
+                bintest_df = memoize(
+                    view_cache,
+                    bintest_key,
+                    lambda: read_cnvkit_table(entered_bintest),
+                )
         except Exception as e:
             st.error(f"Error reading bintest file: {e}")
             bintest_df = None
     if reference_path.exists():
         try:
-            reference_df = pd.read_parquet(reference_path)
+            with span("load reference"):
+                reference_df = load_reference_df(reference_path)
+                reference_gene_index = load_gene_index(reference_path)
         except Exception as e:
             st.error(f"Error reading reference file: {e}")
             reference_df = None
     try:
-        reference_bintest_df = (
-            pd.read_parquet(reference_bintest_path)
-            if reference_bintest_path.exists()
-            else pd.DataFrame()
-        )
+        # The per-sample merges look up the frequencies in the published references
+        with span("publish references"):
+            reference_shared = (
+                load_shared_reference(publish_reference(reference_path))
+                if reference_df is not None
+                else None
+            )
+            reference_bintest_shared = (
+                load_shared_reference(publish_reference(reference_bintest_path))
+                if reference_bintest_path.exists()
+                else None
+            )
     except Exception as e:
-        st.error(f"Error reading reference bintest file: {e}")
-        reference_bintest_df = pd.DataFrame()
+        st.error(f"Error publishing reference files: {e}")
+        reference_shared = None
+        reference_bintest_shared = None
 
     st.subheader("Configurations")
     st.markdown(
         "Provide a sample name and define the number of consecutive exons to display (default value = 2)."
     )
 
-    cols2 = st.columns(2)
+    cols2 = st.columns(3)
     entered_del_size = cols2[0].text_input("deletion_size", value="2")
     entered_dup_size = cols2[1].text_input("duplication_size", value="2")
+    entered_across_genes = cols2[2].checkbox("consecutive across genes", value=False)
 
     # Sidebar configuration
     st.sidebar.title("About")
@@ -325,118 +496,130 @@ def main(env_file_path):
         cols7 = st.columns(3)
         hom_del_selection = cols7[0].text_input("max_hom_del_freq", value="")
         dup_selection = cols7[1].text_input("max_dup_freq", value="")
+        region_selection = cols7[2].text_input(
+            "regions", value="", placeholder="chr1:1000-2000; chr2"
+        )
 
-    list_of_possible_dataframes = [
-        "total",
-        "bintest",
-        "hom_del",
-        "total_candidate",
-        "bintest_candidate",
-        "consecutive_del",
-        "consecutive_dup",
-    ]
-    df_to_be_displayed = st.selectbox(
-        "Select dataframe to display", list_of_possible_dataframes
-    )
+    df_to_be_displayed = st.selectbox("Select dataframe to display", VIEW_NAMES)
+
+    filter_engine = None
 
-    if reference_df is not None and cnr_df is not None and bintest_df is not None:
+    if (
+        reference_shared is not None
+        and cnr_df is not None
+        and bintest_df is not None
+    ):
         cnv_visualizer_instance = CNVVisualizer(reference_df, cnr_df, bintest_df)
-        omim_df, candidate_df, cnr_db, bintest_db = cnv_visualizer_instance.format_df(
-            omim_annotation_file,
-            (
-                os.path.join(candidate_list_dir, selected_candidate)
-                if candidate_list_dir.exists()
-                else None
-            ),
+        candidate_path = (
+            os.path.join(candidate_list_dir, selected_candidate)
+            if candidate_list_dir.exists()
+            else None
         )
-
-        call_df = reference_df[
-            ["gene", "exon", "het_del_frequency", "hom_del_frequency", "dup_frequency"]
-        ]
-        bintest_inhouse_df = (
-            reference_bintest_df if not reference_bintest_df.empty else pd.DataFrame()
+        sample_key = make_key(
+            cnr_key,
+            bintest_key,
+            [
+                (str(path), path.stat().st_mtime_ns)
+                for path in [reference_path, reference_bintest_path]
+                if path.exists()
+            ],
+            candidate_path,
         )
 
-        cnr_db = pd.merge(cnr_db, call_df, on=["gene", "exon"], how="left")
-        if not bintest_inhouse_df.empty:
-            bintest_db = pd.merge(
-                bintest_db, bintest_inhouse_df, on=["gene", "exon"], how="left"
-            )
-            bintest_db = bintest_db.infer_objects().fillna(0)
-
-        cnr_db_filtered = cnv_visualizer_instance.apply_filters(
-            cnr_db,
-            start_selection,
-            end_selection,
-            depth_selection,
-            weight_selection,
-            chrom_selection,
-            call_selection,
-            log2_selection,
-            gene_selection,
-            chrom_list,
-            call_list,
-            gene_list,
-            het_del_selection,
-            hom_del_selection,
-            dup_selection,
-        )
+        try:
+            with span("prepare sample"):
+                candidate_df, cnr_db, bintest_db = memoize(
+                    view_cache,
+                    (sample_key, "sample"),
+                    lambda: prepare_sample(
+                        cnv_visualizer_instance,
+                        reference_shared,
+                        reference_bintest_shared,
+                        omim_annotation_file,
+                        candidate_path,
+                    ),
+                )
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
 
-        cnr_db_filtered.rename(columns={"chromosome": "chr"}, inplace=True)
-        cnr_db_filtered = cnr_db_filtered.round(2)
-        bintest_db.rename(columns={"chromosome": "chr"}, inplace=True)
-        bintest_db = bintest_db.round(2)
+        # One engine per sample, it keeps the mask of every filter across reruns
+        filter_engine = memoize(
+            view_cache,
+            (sample_key, "filter_engine"),
+            lambda: CNVFilterEngine(cnr_db),
+        )
 
-        if igv_string:
-            cnr_db_filtered["IGV_outlink"] = (
-                igv_string
-                + cnr_db_filtered["chr"]
-                + ":"
-                + cnr_db_filtered["start"].astype(str)
-            )
-            bintest_db["IGV_outlink"] = (
-                igv_string + bintest_db["chr"] + ":" + bintest_db["start"].astype(str)
+        def filter_total():
+            cnr_db_filtered = cnv_visualizer_instance.apply_filters(
+                cnr_db,
+                start_selection,
+                end_selection,
+                depth_selection,
+                weight_selection,
+                chrom_selection,
+                call_selection,
+                log2_selection,
+                gene_selection,
+                chrom_list,
+                call_list,
+                gene_list,
+                het_del_selection,
+                hom_del_selection,
+                dup_selection,
+                filter_engine=filter_engine,
+                region_selection=region_selection,
+                warn=st.warning,
             )
-
-        # Dataframe display logic
-        display_mapping = {
-            "total": cnr_db_filtered,
-            "bintest": bintest_db,
-            "hom_del": cnv_visualizer_instance.filter_for_deletions_hom(
-                cnr_db_filtered
-            ),
-            "total_candidate": cnv_visualizer_instance.filter_for_candi_cnvs(
-                cnr_db_filtered, candidate_df
-            ),
-            "bintest_candidate": cnv_visualizer_instance.filter_for_candi_cnvs(
-                bintest_db, candidate_df
-            ),
-            "consecutive_del": cnv_visualizer_instance.filter_for_consecutive_cnvs(
-                cnv_visualizer_instance.prepare_filter_for_consecutive_cnvs(
-                    cnv_visualizer_instance.filter_for_deletions(cnr_db_filtered)
-                ),
-                "del",
-                entered_del_size,
-                entered_dup_size,
-            ),
-            "consecutive_dup": cnv_visualizer_instance.filter_for_consecutive_cnvs(
-                cnv_visualizer_instance.prepare_filter_for_consecutive_cnvs(
-                    cnv_visualizer_instance.filter_for_duplications(cnr_db_filtered)
-                ),
-                "dup",
-                entered_del_size,
-                entered_dup_size,
+            return format_table(cnr_db_filtered, igv_string)
+
+        def format_bintest():
+            return format_table(bintest_db, igv_string)
+
+        # Views are only computed when they are displayed or exported
+        cnv_views = CNVViews(
+            cnv_visualizer_instance,
+            view_cache,
+            sample_key,
+            candidate_df,
+            {
+                "candidate": candidate_path,
+                "del_size": entered_del_size,
+                "dup_size": entered_dup_size,
+                "across_genes": entered_across_genes,
+            },
+        )
+        cnv_views.add_base(
+            "total",
+            make_key(
+                start_selection,
+                end_selection,
+                depth_selection,
+                weight_selection,
+                chrom_selection,
+                call_selection,
+                log2_selection,
+                gene_selection,
+                het_del_selection,
+                hom_del_selection,
+                dup_selection,
+                region_selection,
+                igv_string,
             ),
-        }
-
-        download_filter = display_mapping[df_to_be_displayed]
-        st.dataframe(
-            display_mapping[df_to_be_displayed].style.pipe(make_pretty)
-            if df_to_be_displayed != "total"
-            else display_mapping[df_to_be_displayed]
+            filter_total,
         )
+        cnv_views.add_base("total_all", "", lambda: cnr_db)
+        cnv_views.add_base("bintest", make_key(igv_string), format_bintest)
+
+        with span("compute view", view=df_to_be_displayed):
+            download_filter = cnv_views.get(df_to_be_displayed)
+        show_paged_table(download_filter, cnv_views.key(df_to_be_displayed))
 
         # Download buttons
+        export_format = st.radio(
+            "Export format", list(EXPORT_FORMATS), horizontal=True
+        )
+        export_extension = EXPORT_FORMATS[export_format]
         download_columns = st.columns(2)
         download_preparator_all = download_columns[0].button(
             "Prepare for download (all)"
@@ -448,68 +631,94 @@ def main(env_file_path):
         download_message_columns = st.columns(2)
         download_button_columns = st.columns(2)
 
+        # Exports run as background jobs, their results are offered for download once they are finished
+        export_manager = get_export_manager()
+        export_all_key = make_key(
+            "all",
+            export_format,
+            [cnv_views.key(name, unfiltered=True) for name in VIEW_NAMES],
+        )
+        export_filtered_key = make_key(
+            "filtered", export_format, cnv_views.key(df_to_be_displayed)
+        )
+
         if download_preparator_all:
             tables_to_export = [
-                cnr_db,
-                bintest_db,
-                cnv_visualizer_instance.filter_for_deletions_hom(cnr_db),
-                cnv_visualizer_instance.filter_for_candi_cnvs(cnr_db, candidate_df),
-                cnv_visualizer_instance.filter_for_candi_cnvs(bintest_db, candidate_df),
-                cnv_visualizer_instance.filter_for_consecutive_cnvs(
-                    cnv_visualizer_instance.prepare_filter_for_consecutive_cnvs(
-                        cnv_visualizer_instance.filter_for_deletions(cnr_db)
-                    ),
-                    "del",
-                    entered_del_size,
-                    entered_dup_size,
-                ),
-                cnv_visualizer_instance.filter_for_consecutive_cnvs(
-                    cnv_visualizer_instance.prepare_filter_for_consecutive_cnvs(
-                        cnv_visualizer_instance.filter_for_duplications(cnr_db)
-                    ),
-                    "dup",
-                    entered_del_size,
-                    entered_dup_size,
-                ),
+                cnv_views.get(name, unfiltered=True) for name in VIEW_NAMES
             ]
-            table_exporter = CNVExporter()
-            export_data = table_exporter.save_tables_as_excel(*tables_to_export)
-            download_button_columns[0].download_button(
-                label="Download", data=export_data, file_name=f"{sample_name}_df.xlsx"
-            )
-        else:
-            download_message_columns[0].write("Click button to prepare download")
+            if (
+                export_manager.submit(
+                    export_all_key,
+                    lambda progress, output_path: CNVExporter().save_tables_as_excel(
+                        *tables_to_export,
+                        output_path=output_path,
+                        progress=progress,
+                        export_format=export_format,
+                    ),
+                    len(tables_to_export),
+                    export_extension,
+                )
+                is None
+            ):
+                st.warning("Too many exports are running, please try again later.")
 
         if download_preparator_filtered:
-            table_exporter = CNVExporter()
-            export_data_filtered = table_exporter.save_filtered_table_as_excel(
-                download_filter, df_to_be_displayed
-            )
-            download_button_columns[1].download_button(
-                label="Download filtered",
-                data=export_data_filtered,
-                file_name=f"{sample_name}_filtered_df.xlsx",
-            )
-        else:
-            download_message_columns[1].write("Click button to prepare download")
+            if (
+                export_manager.submit(
+                    export_filtered_key,
+                    lambda progress, output_path: (
+                        CNVExporter().save_filtered_table_as_excel(
+                            download_filter,
+                            df_to_be_displayed,
+                            output_path=output_path,
+                            progress=progress,
+                            export_format=export_format,
+                        )
+                    ),
+                    1,
+                    export_extension,
+                )
+                is None
+            ):
+                st.warning("Too many exports are running, please try again later.")
+
+        show_export_job(
+            export_manager.get(export_all_key),
+            download_message_columns[0],
+            download_button_columns[0],
+            "Download",
+            f"{sample_name}_df{export_extension}",
+        )
+        show_export_job(
+            export_manager.get(export_filtered_key),
+            download_message_columns[1],
+            download_button_columns[1],
+            "Download filtered",
+            f"{sample_name}_filtered_df{export_extension}",
+        )
 
     st.subheader("Plot log2 and depth for selected genes")
     entered_gene = st.multiselect("gene", gene_list, max_selections=1)
     entered_gene = entered_gene[0].upper() if entered_gene else None
 
-    if (
-        reference_df is not None
-        and cnr_df is not None
-        and bintest_df is not None
-        and entered_gene
-    ):
-        gene_plotter = CNVPlotter()
-        gene_plotter.plot_log2_for_gene_precomputed(
-            entered_gene, cnr_db, reference_df, sample_name
-        )
-        gene_plotter.plot_depth_for_gene_precomputed(
-            entered_gene, cnr_db, reference_df, sample_name
-        )
+    if reference_df is not None and cnr_db is not None and entered_gene:
+        with span("gene plots", gene=entered_gene):
+            gene_plotter = CNVPlotter()
+            # Plot payloads of the recently plotted genes of this sample/reference pair
+            payload = memoize(
+                st.session_state.setdefault("cnvizard_plots", {}),
+                (sample_key, entered_gene),
+                lambda: gene_plotter.gene_payload(
+                    entered_gene, cnr_db, reference_df, reference_gene_index
+                ),
+                max_entries=CNVPlotter.PAYLOAD_CACHE_SIZE,
+            )
+            gene_plotter.plot_log2_for_gene_precomputed(
+                entered_gene, cnr_db, reference_df, sample_name, payload=payload
+            )
+            gene_plotter.plot_depth_for_gene_precomputed(
+                entered_gene, cnr_db, reference_df, sample_name, payload=payload
+            )
 
     st.subheader("Load additional .cnr files from the index patient's parents")
     with st.expander("Filter for Trio"):
@@ -528,71 +737,28 @@ def main(env_file_path):
     father_cnr = cols_trio[0].file_uploader("Father .cnr", type=["txt", "cnr"])
     mother_cnr = cols_trio[1].file_uploader("Mother .cnr", type=["txt", "cnr"])
 
-    if (
-        reference_df is not None
-        and cnr_df is not None
-        and bintest_df is not None
-        and father_cnr
-        and mother_cnr
-    ):
-        try:
-            father_cnr_df = cnv_visualizer_instance.prepare_parent_cnv(
-                pd.read_csv(father_cnr, delimiter="\t")
-            )
-            mother_cnr_df = cnv_visualizer_instance.prepare_parent_cnv(
-                pd.read_csv(mother_cnr, delimiter="\t")
+    if cnr_db is not None and father_cnr and mother_cnr:
+        with span("trio"):
+            try:
+                father_cnr_df = cnv_visualizer_instance.prepare_parent_cnv(
+                    read_cnvkit_table(father_cnr)
+                )
+                mother_cnr_df = cnv_visualizer_instance.prepare_parent_cnv(
+                    read_cnvkit_table(mother_cnr)
+                )
+            except Exception as e:
+                st.error(f"Error reading parent .cnr files: {e}")
+                st.stop()
+
+            trio_cnr_df = merge_trio(cnr_db, father_cnr_df, mother_cnr_df)
+            trio_cnr_df_filtered = cnv_visualizer_instance.apply_trio_filters(
+                trio_cnr_df,
+                call_selection_index,
+                call_selection_father,
+                call_selection_mother,
+                call_list,
             )
-        except Exception as e:
-            st.error(f"Error reading parent .cnr files: {e}")
-            st.stop()
-
-        father_cnr_df = father_cnr_df.drop(["chromosome", "start", "end"], axis=1)
-        father_cnr_df = father_cnr_df.rename(
-            columns={
-                "gene": "gene_f",
-                "exon": "exon_f",
-                "depth": "depth_f",
-                "weight": "weight_f",
-                "call": "call_f",
-                "log2": "log2_f",
-                "squaredvalue": "squaredvalue_f",
-            }
-        )
-        mother_cnr_df = mother_cnr_df.drop(["chromosome", "start", "end"], axis=1)
-        mother_cnr_df = mother_cnr_df.rename(
-            columns={
-                "gene": "gene_m",
-                "exon": "exon_m",
-                "depth": "depth_m",
-                "weight": "weight_m",
-                "call": "call_m",
-                "log2": "log2_m",
-                "squaredvalue": "squaredvalue_m",
-            }
-        )
-
-        trio_cnr_df = cnr_db.merge(
-            father_cnr_df,
-            left_on=["gene", "exon"],
-            right_on=["gene_f", "exon_f"],
-            how="left",
-        ).merge(
-            mother_cnr_df,
-            left_on=["gene", "exon"],
-            right_on=["gene_m", "exon_m"],
-            how="left",
-        )
-
-        trio_cnr_df.rename(columns={"chromosome": "chr"}, inplace=True)
-        trio_cnr_df = trio_cnr_df.round(2)
-        trio_cnr_df_filtered = cnv_visualizer_instance.apply_trio_filters(
-            trio_cnr_df,
-            call_selection_index,
-            call_selection_father,
-            call_selection_mother,
-            call_list,
-        )
-        st.dataframe(trio_cnr_df_filtered)
+            st.dataframe(trio_cnr_df_filtered)
 
     st.subheader("Plot genome-wide or chromosome-wide scatter plot")
     cols_cns_upload = st.columns(3)
@@ -604,17 +770,18 @@ def main(env_file_path):
         selected_scatter = st.radio("Select chromosome or all", scatter_options)
 
     if entered_cns and entered_cnr_new:
-        input_cnr = cnvlib.read(entered_cnr_new)
-        input_cns = cnvlib.read(entered_cns)
-        fig_scatter = cnvlib.do_scatter(
-            input_cnr,
-            segments=input_cns,
-            y_min=-2,
-            y_max=2,
-            show_range=None if selected_scatter == "All" else selected_scatter,
-        )
-        fig_scatter.set_figwidth(12)
-        st.pyplot(fig_scatter)
+        with span("scatter plot"):
+            input_cnr = cnvlib.read(entered_cnr_new)
+            input_cns = cnvlib.read(entered_cns)
+            fig_scatter = cnvlib.do_scatter(
+                input_cnr,
+                segments=input_cns,
+                y_min=-2,
+                y_max=2,
+                show_range=None if selected_scatter == "All" else selected_scatter,
+            )
+            fig_scatter.set_figwidth(12)
+            st.pyplot(fig_scatter)
 
     chromosome_list_cnv = [str(i) for i in range(1, 23)] + ["X", "Y"]
     cnv_type = ["DEL", "DUP"]
@@ -629,44 +796,56 @@ def main(env_file_path):
         entered_acmg_class = cols6[2].multiselect("ACMG_Class", acmg_class)
 
     if entered_tsv_file:
-        try:
-            tsv_df = pd.read_csv(entered_tsv_file, delimiter="\t")
-        except Exception as e:
-            st.error(f"Error reading .tsv file: {e}")
-            st.stop()
-
-        with open(annotsv_format_path, "r") as column_file:
-            columns_to_keep = [line.strip() for line in column_file]
-
-        tsv_df = tsv_df[columns_to_keep]
-
-        # Fix ValueErrors and ensure ACMG_class is treated as int
-        # tsv_df["ACMG_class"] = tsv_df["ACMG_class"].apply(
-        #    lambda x: int(x.split('=')[-1]) if isinstance(x, str) and 'full=' in x else (
-        #        int(x) if isinstance(x, str) and x.isdigit() else -1
-        #    )
-        # )
-
-        # Convert AnnotSV_ranking_score to numeric, handle errors by converting invalid values to NaN
-        # tsv_df["AnnotSV_ranking_score"] = tsv_df["AnnotSV_ranking_score"].apply(
-        #    lambda x: pd.to_numeric(x, errors='coerce') if isinstance(x, str) else float('nan') if x == '.' else x
-        # )
-
-        filtered_tsv = filter_tsv(
-            tsv_df,
-            chromosome_list_cnv,
-            cnv_type,
-            acmg_class,
-            entered_cnv_chrom,
-            entered_cnv_type,
-            entered_acmg_class,
-        )
-        filtered_tsv["SV_chrom"] = "chr" + filtered_tsv["SV_chrom"]
-        filtered_tsv["SV_chrom"] = pd.Categorical(filtered_tsv["SV_chrom"], chrom_list)
-        filtered_tsv = filtered_tsv.sort_values("SV_chrom")
+        with span("AnnotSV"):
+            try:
+                tsv_df = pd.read_csv(entered_tsv_file, delimiter="\t")
+            except Exception as e:
+                st.error(f"Error reading .tsv file: {e}")
+                st.stop()
+
+            with open(annotsv_format_path, "r") as column_file:
+                columns_to_keep = [line.strip() for line in column_file]
+
+            tsv_df = tsv_df[columns_to_keep]
+
+            # Fix ValueErrors and ensure ACMG_class is treated as int
+            # tsv_df["ACMG_class"] = tsv_df["ACMG_class"].apply(
+            #    lambda x: int(x.split('=')[-1]) if isinstance(x, str) and 'full=' in x else (
+            #        int(x) if isinstance(x, str) and x.isdigit() else -1
+            #    )
+            # )
+
+            # Convert AnnotSV_ranking_score to numeric, handle errors by converting invalid values to NaN
+            # tsv_df["AnnotSV_ranking_score"] = tsv_df["AnnotSV_ranking_score"].apply(
+            #    lambda x: pd.to_numeric(x, errors='coerce') if isinstance(x, str) else float('nan') if x == '.' else x
+            # )
+
+            filtered_tsv = filter_tsv(
+                tsv_df,
+                chromosome_list_cnv,
+                cnv_type,
+                acmg_class,
+                entered_cnv_chrom,
+                entered_cnv_type,
+                entered_acmg_class,
+            )
+            filtered_tsv["SV_chrom"] = "chr" + filtered_tsv["SV_chrom"]
+            filtered_tsv["SV_chrom"] = pd.Categorical(
+                filtered_tsv["SV_chrom"], chrom_list
+            )
+            filtered_tsv = filtered_tsv.sort_values("SV_chrom")
+            if filter_engine is not None:
+                # Positional link to the loaded sample: number of its exons/bins overlapping each SV
+                filtered_tsv["overlapping_bins"] = (
+                    filter_engine.intervals.count_overlaps(
+                        filtered_tsv["SV_chrom"],
+                        filtered_tsv["SV_start"],
+                        filtered_tsv["SV_end"],
+                    )
+                )
 
-        st.write("Filtered AnnotSV DataFrame:")
-        st.write(filtered_tsv)
+            st.write("Filtered AnnotSV DataFrame:")
+            st.write(filtered_tsv)
 
         if st.button("Prepare for download of annotated tsv data"):
             table_exporter = CNVExporter()
@@ -689,8 +868,8 @@ if __name__ == "__main__":
     st.set_page_config(layout="wide", page_title="CNVizard", page_icon="CNVizard.png")
 
     if args.env:
-        main(args.env)
+        run(args.env)
     else:
         env_file_path = str(current_working_dir) + "default.env"
         if env_file_path:
-            main(env_file_path)
+            run(env_file_path)
@@ -0,0 +1,154 @@
+"""
+File which contains the batch command line interface of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import os
+import sys
+import argparse
+import logging
+import dotenv
+from pathlib import Path
+from .exporter import EXPORT_FORMATS
+from .pipeline import find_samples, run_batch
+
+logger = logging.getLogger("cnvizard")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """
+    Function which parses the arguments of the batch command line interface.
+
+    Args:
+        argv (list): Arguments (default: sys.argv[1:]).
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="cnvizard",
+        description="Process a directory of .cnr/bintest files with the CNVizard pipeline "
+        "and write one export per sample.",
+    )
+    parser.add_argument(
+        "input_dir", help="Directory searched for <sample>.cnr/<sample>_bintest.tsv."
+    )
+    parser.add_argument(
+        "-o", "--output-dir", default=".", help="Directory of the exports."
+    )
+    parser.add_argument(
+        "--env",
+        default=None,
+        help="Path to the .env file (OMIM_ANNOTATION_PATH, CANDIDATE_LIST_DIR, "
+        "REFERENCE_FILES_DIR, APPSETTING_IGV_OUTLINK).",
+    )
+    parser.add_argument("--ngs-type", choices=["WES", "WGS"], default="WES")
+    parser.add_argument(
+        "--candidate-list",
+        default=None,
+        help="Candidate gene list (file name in CANDIDATE_LIST_DIR or path).",
+    )
+    parser.add_argument("--del-size", default="2")
+    parser.add_argument("--dup-size", default="2")
+    parser.add_argument(
+        "--across-genes",
+        action="store_true",
+        help="Let consecutive deletions/duplications continue across genes.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=list(EXPORT_FORMATS),
+        default="xlsx",
+        dest="export_format",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs).",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    """
+    Entry point of the cnvizard command: runs the pipeline over all samples of a directory.
+
+    Args:
+        argv (list): Arguments (default: sys.argv[1:]).
+
+    Returns:
+        int: Exit code (1 if a sample failed or no sample was found).
+    """
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.env:
+        dotenv.load_dotenv(args.env)
+
+    # Same defaults as the app
+    omim_path = Path(os.getenv("OMIM_ANNOTATION_PATH", "./resources/omim.txt"))
+    candidate_list_dir = Path(
+        os.getenv("CANDIDATE_LIST_DIR", "./resources/candidate_lists")
+    )
+    reference_files_dir = Path(
+        os.getenv("REFERENCE_FILES_DIR", "./resources/references")
+    )
+    prefix = "genome" if args.ngs_type == "WGS" else "exome"
+    reference_path = reference_files_dir / f"{prefix}_cnv_reference_large.parquet"
+    reference_bintest_path = (
+        reference_files_dir / f"{prefix}_cnv_reference_bintest_large.parquet"
+    )
+    candidate_path = None
+    if args.candidate_list:
+        candidate_path = Path(args.candidate_list)
+        if not candidate_path.exists():
+            candidate_path = candidate_list_dir / args.candidate_list
+
+    for path in [omim_path, reference_path, candidate_path]:
+        if path is not None and not path.exists():
+            logger.error("File not found: %s", path)
+            return 1
+
+    samples = []
+    for sample_name, cnr_path, bintest_path in find_samples(args.input_dir):
+        if bintest_path is None:
+            logger.warning(
+                "Skipping %s: no bintest file next to %s", sample_name, cnr_path
+            )
+            continue
+        samples.append((sample_name, cnr_path, bintest_path))
+    if not samples:
+        logger.error("No samples found in %s", args.input_dir)
+        return 1
+    logger.info("Processing %d samples", len(samples))
+
+    failed = 0
+    for sample_name, result in run_batch(
+        samples,
+        args.output_dir,
+        n_workers=args.workers,
+        reference_path=reference_path,
+        reference_bintest_path=(
+            reference_bintest_path if reference_bintest_path.exists() else None
+        ),
+        omim_path=omim_path,
+        candidate_path=candidate_path,
+        del_size=args.del_size,
+        dup_size=args.dup_size,
+        across_genes=args.across_genes,
+        export_format=args.export_format,
+        igv_string=os.getenv("APPSETTING_IGV_OUTLINK"),
+    ):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error("%s failed: %s", sample_name, result)
+        else:
+            logger.info("%s written to %s", sample_name, result)
+    logger.info("%d of %d samples processed", len(samples) - failed, len(samples))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,14 +5,38 @@ File which contains export functions of the CNVizard
 @mail: jerkrause@ukaachen.de
 """
 
+import gzip
+import io
+import os
+import tempfile
+import zipfile
 import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
 import xlsxwriter
-from io import BytesIO
+from .schema import widen_floats
+from .timing import timed
+
+# Number of rows converted to Python values at once while a sheet is streamed
+EXPORT_CHUNK_ROWS = 10000
+# Maximal number of rows of an excel sheet (including the header row)
+EXCEL_MAX_ROWS = 1_048_576
+# Number of rows converted at once (and rows per row group/record batch) for the columnar formats
+COLUMNAR_CHUNK_ROWS = 100000
+
+# Export format -> file extension. Except for xlsx, every view is a member of a zip file:
+# zstd compressed Parquet, zstd compressed Arrow IPC file or gzipped TSV.
+EXPORT_FORMATS = {"xlsx": ".xlsx", "parquet": ".zip", "arrow": ".zip", "tsv": ".zip"}
 
 
 class CNVExporter:
     """
     Class used to export the filtered dataframe as excel tables.
+    The sheets are streamed row by row with the constant memory mode of xlsxwriter,
+    the formats are shared by all sheets and the rows are banded by a single conditional format.
+    The same views can be exported in columnar formats (see EXPORT_FORMATS), which are streamed in chunks
+    and have no row limit.
     """
 
     def __init__(self):
@@ -20,60 +44,18 @@ class CNVExporter:
         Constructor of the class CNVExporter.
         """
 
-    def save_tables_as_excel(
-        self,
-        total_df: pd.DataFrame,
-        bintest_df: pd.DataFrame,
-        hom_del_df: pd.DataFrame,
-        total_candi_df: pd.DataFrame,
-        bintest_candi_df: pd.DataFrame,
-        consecutive_del_df: pd.DataFrame,
-        consecutive_dup_df: pd.DataFrame,
-    ) -> bytes:
+    def _add_formats(self, workbook: xlsxwriter.Workbook) -> dict:
         """
-        Function which writes the preset DataFrames to an excel file.
-
-        Each preset represents an excel sheet.
+        Function which creates the formats shared by all sheets of a workbook.
 
         Args:
-            total_df (pd.DataFrame): .cnr DataFrame
-            bintest_df (pd.DataFrame): bintest DataFrame
-            hom_del_df (pd.DataFrame): .cnr DataFrame filtered for homozygous deletions
-            total_candi_df (pd.DataFrame): .cnr DataFrame filtered for candigenes
-            bintest_candi_df (pd.DataFrame): bintest DataFrame filtered for candigenes
-            consecutive_del_df (pd.DataFrame): .cnr DataFrame filtered for consecutive deletions
-            consecutive_dup_df (pd.DataFrame): .cnr DataFrame filtered for consecutive duplications
+            workbook (xlsxwriter.Workbook): Workbook the formats belong to.
 
         Returns:
-            bytes: Processed data to be passed to the streamlit download button object.
+            dict: Formats (header, yellow, red, band).
         """
-        output = BytesIO()
-        writer = pd.ExcelWriter(output, engine="xlsxwriter")
-        list_of_saved_results = [
-            "total",
-            "bintest",
-            "hom_del",
-            "total_candi",
-            "bintest_candi",
-            "consecutive_del",
-            "consecutive_dup",
-        ]
-        list_of_selections = [
-            total_df,
-            bintest_df,
-            hom_del_df,
-            total_candi_df,
-            bintest_candi_df,
-            consecutive_del_df,
-            consecutive_dup_df,
-        ]
-
-        for name, df in zip(list_of_saved_results, list_of_selections):
-            df.to_excel(writer, sheet_name=name, header=False, index=False, startrow=1)
-            num_columns = len(df.columns.tolist())
-            workbook = writer.book
-            worksheet = writer.sheets[name]
-            header_format = workbook.add_format(
+        return {
+            "header": workbook.add_format(
                 {
                     "bold": True,
                     "text_wrap": True,
@@ -81,10 +63,37 @@ class CNVExporter:
                     "fg_color": "#D7E4BC",
                     "border": 1,
                 }
-            )
-            format_yellow = workbook.add_format({"bg_color": "#FFFF00"})
-            format_red = workbook.add_format({"bg_color": "#ff0000"})
-            worksheet.set_column(1, num_columns, 11)
+            ),
+            "yellow": workbook.add_format({"bg_color": "#FFFF00"}),
+            "red": workbook.add_format({"bg_color": "#ff0000"}),
+            "band": workbook.add_format({"bg_color": "#EEEEEE"}),
+        }
+
+    def _write_sheet(
+        self,
+        workbook: xlsxwriter.Workbook,
+        formats: dict,
+        name: str,
+        df: pd.DataFrame,
+        highlight: bool = True,
+    ):
+        """
+        Function which streams a DataFrame into a new sheet.
+
+        Args:
+            workbook (xlsxwriter.Workbook): Workbook (in constant memory mode).
+            formats (dict): Shared formats created by _add_formats.
+            name (str): Name of the sheet.
+            df (pd.DataFrame): DataFrame to be written.
+            highlight (bool): Highlight the weight, log2 and depth columns of .cnr/bintest DataFrames.
+
+        Raises:
+            ValueError: If xlsxwriter could not write a row (e.g. a truncated string).
+        """
+        worksheet = workbook.add_worksheet(name)
+        num_columns = len(df.columns)
+        worksheet.set_column(1, num_columns, 11)
+        if highlight:
             worksheet.conditional_format(
                 "G1:G1048576",
                 {
@@ -103,152 +112,320 @@ class CNVExporter:
                     "type": "cell",
                     "criteria": "less than or equal to",
                     "value": -0.65,
-                    "format": format_yellow,
+                    "format": formats["yellow"],
                 },
             )
-            column_length = str(len(df))
-            area_to_color = "F1:" + "F" + column_length
             worksheet.conditional_format(
-                area_to_color,
+                "F1:F" + str(len(df)),
                 {
                     "type": "cell",
                     "criteria": "equal to",
                     "value": 0,
-                    "format": format_red,
+                    "format": formats["red"],
+                },
+            )
+        # Zebra striping of every second row, added last so the highlights take precedence
+        if num_columns and len(df):
+            worksheet.conditional_format(
+                1,
+                0,
+                len(df),
+                num_columns - 1,
+                {
+                    "type": "formula",
+                    "criteria": "=MOD(ROW(),2)=1",
+                    "format": formats["band"],
                 },
             )
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            bg_format1 = workbook.add_format({"bg_color": "#EEEEEE"})
-            bg_format2 = workbook.add_format({"bg_color": "#FFFFFF"})
-            for rn in range(len(df)):
-                worksheet.set_row(
-                    rn, cell_format=(bg_format1 if rn % 2 == 0 else bg_format2)
-                )
 
-        writer.close()
-        processed_data = output.getvalue()
-        return processed_data
+        # Rows have to be written in order in constant memory mode
+        worksheet.write_row(
+            0, 0, [str(column) for column in df.columns], formats["header"]
+        )
+        for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+            chunk = widen_floats(df.iloc[start : start + EXPORT_CHUNK_ROWS])
+            values = chunk.to_numpy(dtype=object)
+            values[pd.isna(chunk).to_numpy()] = None
+            for row_number, row in enumerate(values, start=start + 1):
+                # xlsxwriter returns an error code instead of raising for cells it cannot write
+                # (-1: outside of the sheet, -2: string truncated) and skips the rest of the row
+                error = worksheet.write_row(row_number, 0, row)
+                if error:
+                    raise ValueError(
+                        f"Row {row_number} of sheet {name} could not be written "
+                        f"to the excel file (xlsxwriter error {error})."
+                    )
 
-    def save_filtered_table_as_excel(
-        self, filtered_df: pd.DataFrame, filtered_name: str
-    ) -> bytes:
+    def _check_sheet_size(self, name: str, df: pd.DataFrame):
         """
-        Function which writes the filtered DataFrame to an excel file.
+        Function which checks that a DataFrame fits into an excel sheet (header row included).
 
         Args:
-            filtered_df (pd.DataFrame): CNV DataFrame which was filtered with the filter criteria provided by the user.
-            filtered_name (str): Name which will be used to name the excel sheet.
+            name (str): Name of the sheet.
+            df (pd.DataFrame): DataFrame to be written.
 
-        Returns:
-            bytes: Processed data to be passed to the streamlit download button object.
-        """
-        output = BytesIO()
-        writer = pd.ExcelWriter(output, engine="xlsxwriter")
-        list_of_saved_results = [filtered_name]
-        list_of_selections = [filtered_df]
-
-        for name, df in zip(list_of_saved_results, list_of_selections):
-            df.to_excel(writer, sheet_name=name, header=False, index=False, startrow=1)
-            num_columns = len(df.columns.tolist())
-            workbook = writer.book
-            worksheet = writer.sheets[name]
-            header_format = workbook.add_format(
-                {
-                    "bold": True,
-                    "text_wrap": True,
-                    "valign": "top",
-                    "fg_color": "#D7E4BC",
-                    "border": 1,
-                }
-            )
-            format_yellow = workbook.add_format({"bg_color": "#FFFF00"})
-            format_red = workbook.add_format({"bg_color": "#ff0000"})
-            worksheet.set_column(1, num_columns, 11)
-            worksheet.conditional_format(
-                "G1:G1048576",
-                {
-                    "type": "3_color_scale",
-                    "min_type": "num",
-                    "min_value": 0,
-                    "mid_type": "num",
-                    "mid_value": 0.5,
-                    "max_type": "num",
-                    "max_value": 1,
-                },
+        Raises:
+            ValueError: If the DataFrame has more rows than an excel sheet.
+        """
+        if len(df) + 1 > EXCEL_MAX_ROWS:
+            raise ValueError(
+                f"Sheet {name} has {len(df)} rows, more than an excel sheet can hold "
+                f"({EXCEL_MAX_ROWS - 1} rows below the header). "
+                "Export it as parquet, arrow or tsv instead."
             )
-            worksheet.conditional_format(
-                "I1:I1048576",
-                {
-                    "type": "cell",
-                    "criteria": "less than or equal to",
-                    "value": -0.65,
-                    "format": format_yellow,
-                },
+
+    @timed
+    def write_workbook(self, sheets: list, target, progress=None):
+        """
+        Function which writes DataFrames as sheets of an excel file.
+
+        Args:
+            sheets (list): List of (sheet name, DataFrame, highlight) tuples.
+            target (str | file-like): Path or file object the excel file is written to.
+            progress (callable): Called with the number of written sheets, the number of sheets and the
+                sheet name after each sheet (optional).
+
+        Raises:
+            ValueError: If a DataFrame does not fit into a sheet.
+        """
+        # Checked before anything is written, so an oversized view does not leave a partial file
+        for name, df, _ in sheets:
+            self._check_sheet_size(name, df)
+        workbook = xlsxwriter.Workbook(
+            target, {"constant_memory": True, "nan_inf_to_errors": True}
+        )
+        formats = self._add_formats(workbook)
+        for number, (name, df, highlight) in enumerate(sheets, start=1):
+            self._write_sheet(workbook, formats, name, df, highlight)
+            if progress is not None:
+                progress(number, len(sheets), name)
+        workbook.close()
+
+    def _write_columnar(self, stream, df: pd.DataFrame, export_format: str):
+        """
+        Function which streams a DataFrame as Parquet, Arrow IPC file or gzipped TSV.
+
+        Args:
+            stream (file-like): Writable binary stream.
+            df (pd.DataFrame): DataFrame to be written.
+            export_format (str): parquet, arrow or tsv.
+        """
+        chunks = (
+            df.iloc[start : start + COLUMNAR_CHUNK_ROWS]
+            for start in range(0, max(len(df), 1), COLUMNAR_CHUNK_ROWS)
+        )
+        if export_format == "tsv":
+            with gzip.GzipFile(
+                fileobj=stream, mode="wb", compresslevel=6
+            ) as gzip_file, io.TextIOWrapper(
+                gzip_file, encoding="utf-8", newline=""
+            ) as text:
+                for number, chunk in enumerate(chunks):
+                    chunk.to_csv(text, sep="\t", index=False, header=number == 0)
+            return
+        # Object columns mixing strings and numbers (e.g. OMIM columns of the bintest DataFrame filled with 0)
+        # have no Arrow type, they are written as strings
+        mixed = [
+            column
+            for column in df.columns
+            if df[column].dtype == object
+            and pd.api.types.infer_dtype(df[column], skipna=True).startswith("mixed")
+        ]
+        if mixed:
+            df = df.assign(
+                **{
+                    column: df[column].where(df[column].isna(), df[column].astype(str))
+                    for column in mixed
+                }
             )
-            column_length = str(len(df))
-            area_to_color = "F1:" + "F" + column_length
-            worksheet.conditional_format(
-                area_to_color,
-                {
-                    "type": "cell",
-                    "criteria": "equal to",
-                    "value": 0,
-                    "format": format_red,
-                },
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        if export_format == "parquet":
+            writer = pq.ParquetWriter(stream, schema, compression="zstd")
+        else:
+            writer = ipc.new_file(
+                stream, schema, options=ipc.IpcWriteOptions(compression="zstd")
             )
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            bg_format1 = workbook.add_format({"bg_color": "#EEEEEE"})
-            bg_format2 = workbook.add_format({"bg_color": "#FFFFFF"})
-            for rn in range(len(df)):
-                worksheet.set_row(
-                    rn, cell_format=(bg_format1 if rn % 2 == 0 else bg_format2)
+        with writer:
+            for chunk in chunks:
+                writer.write_table(
+                    pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
                 )
 
-        writer.close()
-        processed_data = output.getvalue()
-        return processed_data
+    @timed
+    def write_bundle(
+        self, sheets: list, target, export_format: str, progress=None
+    ):
+        """
+        Function which writes DataFrames as members (one per view) of a zip file in a columnar format.
+
+        Args:
+            sheets (list): List of (view name, DataFrame, highlight) tuples, highlight is ignored.
+            target (str | file-like): Path or file object the zip file is written to.
+            export_format (str): parquet, arrow or tsv.
+            progress (callable): Progress callback, see write_workbook (optional).
+        """
+        extension = {"parquet": ".parquet", "arrow": ".arrow", "tsv": ".tsv.gz"}
+        # The members are compressed already
+        with zipfile.ZipFile(target, "w", zipfile.ZIP_STORED) as bundle:
+            for number, (name, df, _) in enumerate(sheets, start=1):
+                # The size of a streamed member is unknown up front, members beyond 2 GiB need zip64
+                with bundle.open(
+                    name + extension[export_format], "w", force_zip64=True
+                ) as stream:
+                    self._write_columnar(stream, df, export_format)
+                if progress is not None:
+                    progress(number, len(sheets), name)
+
+    def _export(
+        self,
+        sheets: list,
+        output_path: str = None,
+        progress=None,
+        export_format: str = "xlsx",
+    ):
+        """
+        Function which writes the sheets to output_path or, if no path is given, to a temporary file
+        whose content is returned.
+
+        Args:
+            sheets (list): List of (sheet name, DataFrame, highlight) tuples.
+            output_path (str): Path of the exported file (optional).
+            progress (callable): Progress callback, see write_workbook (optional).
+            export_format (str): Export format (see EXPORT_FORMATS).
+
+        Returns:
+            bytes | str: Content of the exported file, or output_path if given.
+        """
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+
+        def write(target):
+            if export_format == "xlsx":
+                self.write_workbook(sheets, target, progress)
+            else:
+                self.write_bundle(sheets, target, export_format, progress)
+
+        if output_path is not None:
+            write(output_path)
+            return output_path
+        handle, path = tempfile.mkstemp(suffix=EXPORT_FORMATS[export_format])
+        os.close(handle)
+        try:
+            write(path)
+            with open(path, "rb") as excel_file:
+                return excel_file.read()
+        finally:
+            os.remove(path)
 
-    def save_tables_as_excel_tsv(self, filtered_tsv: pd.DataFrame) -> bytes:
+    @timed
+    def save_tables_as_excel(
+        self,
+        total_df: pd.DataFrame,
+        bintest_df: pd.DataFrame,
+        hom_del_df: pd.DataFrame,
+        total_candi_df: pd.DataFrame,
+        bintest_candi_df: pd.DataFrame,
+        consecutive_del_df: pd.DataFrame,
+        consecutive_dup_df: pd.DataFrame,
+        del_segments_df: pd.DataFrame = None,
+        dup_segments_df: pd.DataFrame = None,
+        output_path: str = None,
+        progress=None,
+        export_format: str = "xlsx",
+    ):
+        """
+        Function which writes the preset DataFrames to an excel file (or a zip file of another export format).
+
+        Each preset represents an excel sheet.
+
+        Args:
+            total_df (pd.DataFrame): .cnr DataFrame
+            bintest_df (pd.DataFrame): bintest DataFrame
+            hom_del_df (pd.DataFrame): .cnr DataFrame filtered for homozygous deletions
+            total_candi_df (pd.DataFrame): .cnr DataFrame filtered for candigenes
+            bintest_candi_df (pd.DataFrame): bintest DataFrame filtered for candigenes
+            consecutive_del_df (pd.DataFrame): .cnr DataFrame filtered for consecutive deletions
+            consecutive_dup_df (pd.DataFrame): .cnr DataFrame filtered for consecutive duplications
+            del_segments_df (pd.DataFrame): Segment table of the consecutive deletions (sheet omitted if None)
+            dup_segments_df (pd.DataFrame): Segment table of the consecutive duplications (sheet omitted if None)
+            output_path (str): Write the excel file to this path instead of returning its content (optional)
+            progress (callable): Called after each written sheet, see write_workbook (optional)
+            export_format (str): Export format, see EXPORT_FORMATS (default xlsx)
+
+        Returns:
+            bytes: Processed data to be passed to the streamlit download button object (output_path if given).
+        """
+        list_of_saved_results = [
+            "total",
+            "bintest",
+            "hom_del",
+            "total_candi",
+            "bintest_candi",
+            "consecutive_del",
+            "consecutive_dup",
+        ]
+        list_of_selections = [
+            total_df,
+            bintest_df,
+            hom_del_df,
+            total_candi_df,
+            bintest_candi_df,
+            consecutive_del_df,
+            consecutive_dup_df,
+        ]
+        sheets = [
+            (name, df, True)
+            for name, df in zip(list_of_saved_results, list_of_selections)
+        ]
+        for name, df in [
+            ("del_segments", del_segments_df),
+            ("dup_segments", dup_segments_df),
+        ]:
+            if df is not None:
+                sheets.append((name, df, False))
+        return self._export(sheets, output_path, progress, export_format)
+
+    @timed
+    def save_filtered_table_as_excel(
+        self,
+        filtered_df: pd.DataFrame,
+        filtered_name: str,
+        output_path: str = None,
+        progress=None,
+        export_format: str = "xlsx",
+    ):
+        """
+        Function which writes the filtered DataFrame to an excel file (or a zip file of another export format).
+
+        Args:
+            filtered_df (pd.DataFrame): CNV DataFrame which was filtered with the filter criteria provided by the user.
+            filtered_name (str): Name which will be used to name the excel sheet.
+            output_path (str): Write the excel file to this path instead of returning its content (optional)
+            progress (callable): Called after the sheet was written, see write_workbook (optional)
+            export_format (str): Export format, see EXPORT_FORMATS (default xlsx)
+
+        Returns:
+            bytes: Processed data to be passed to the streamlit download button object (output_path if given).
+        """
+        return self._export(
+            [(filtered_name, filtered_df, True)],
+            output_path,
+            progress,
+            export_format,
+        )
+
+    @timed
+    def save_tables_as_excel_tsv(
+        self, filtered_tsv: pd.DataFrame, output_path: str = None
+    ):
         """
         Function which writes the preset DataFrames to an excel file. Each preset represents an excel sheet.
 
         Args:
             filtered_tsv (pd.DataFrame): .tsv file annotated by AnnotSV, subsequently filtered and formatted.
+            output_path (str): Write the excel file to this path instead of returning its content (optional)
 
         Returns:
-            bytes: Processed data to be passed to the streamlit download button object.
-        """
-        output = BytesIO()
-        writer = pd.ExcelWriter(output, engine="xlsxwriter")
-        list_of_saved_results = ["filtered"]
-        list_of_selections = [filtered_tsv]
-
-        for name, df in zip(list_of_saved_results, list_of_selections):
-            df.to_excel(writer, sheet_name=name, header=False, index=False, startrow=1)
-            num_columns = len(df.columns.tolist())
-            workbook = writer.book
-            worksheet = writer.sheets[name]
-            header_format = workbook.add_format(
-                {
-                    "bold": True,
-                    "text_wrap": True,
-                    "valign": "top",
-                    "fg_color": "#D7E4BC",
-                    "border": 1,
-                }
-            )
-            worksheet.set_column(1, num_columns, 11)
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            bg_format1 = workbook.add_format({"bg_color": "#EEEEEE"})
-            bg_format2 = workbook.add_format({"bg_color": "#FFFFFF"})
-            for rn in range(len(df)):
-                worksheet.set_row(
-                    rn, cell_format=(bg_format1 if rn % 2 == 0 else bg_format2)
-                )
-
-        writer.close()
-        processed_data = output.getvalue()
-        return processed_data
+            bytes: Processed data to be passed to the streamlit download button object (output_path if given).
+        """
+        return self._export([("filtered", filtered_tsv, False)], output_path)
@@ -0,0 +1,113 @@
+"""
+File which contains the filter engine for the .cnr DataFrame of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import numpy as np
+import pandas as pd
+from .intervals import IntervalIndex
+
+# Predicate name -> (column, comparison) of the single column predicates.
+# A predicate whose value is None (or an empty selection) is left at its default and not evaluated.
+PREDICATES = {
+    "chromosome": ("chromosome", "isin"),
+    "call": ("call", "isin"),
+    "gene": ("gene", "isin"),
+    "depth": ("depth", "min"),
+    "weight": ("weight", "min"),
+    "log2": ("log2", "min"),
+    "het_del_frequency": ("het_del_frequency", "max"),
+    "hom_del_frequency": ("hom_del_frequency", "max"),
+    "dup_frequency": ("dup_frequency", "max"),
+}
+
+
+class CNVFilterEngine:
+    """
+    Class used to filter a .cnr DataFrame with a set of predicates.
+    Every predicate is evaluated into a boolean mask, which is cached together with the value it was computed for,
+    so changing one filter only recomputes the mask of that filter. Only the masks of active predicates are combined.
+    The DataFrame is expected to use the compact schema established at load time and must not be altered.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        """
+        Constructor of the class CNVFilterEngine.
+
+        Args:
+            df (pd.DataFrame): .cnr DataFrame which is filtered.
+        """
+        self.df = df
+        self.masks = {}
+        self._intervals = None
+
+    @property
+    def intervals(self) -> IntervalIndex:
+        """
+        Interval index over the coordinates of the DataFrame, built on first use.
+
+        Returns:
+            IntervalIndex: Interval index of the DataFrame.
+        """
+        if self._intervals is None:
+            self._intervals = IntervalIndex(self.df)
+        return self._intervals
+
+    def _evaluate(self, name: str, value) -> np.ndarray:
+        """
+        Function which evaluates a predicate into a boolean mask.
+
+        Args:
+            name (str): Name of the predicate (see PREDICATES, or region).
+            value: Value of the predicate (a tuple of (chromosome, start, end) tuples for region).
+
+        Returns:
+            np.ndarray: Boolean mask of the rows fulfilling the predicate.
+        """
+        if name == "region":
+            return self.intervals.mask(value, how="contained")
+        column, comparison = PREDICATES[name]
+        if comparison == "isin":
+            return self.df[column].isin(value).to_numpy()
+        values = self.df[column].to_numpy()
+        if comparison == "min":
+            return values >= value
+        return values <= value
+
+    def mask(self, name: str, value) -> np.ndarray:
+        """
+        Function which returns the (cached) mask of a predicate.
+
+        Args:
+            name (str): Name of the predicate.
+            value: Value of the predicate (hashable, e.g. a tuple for selections).
+
+        Returns:
+            np.ndarray: Boolean mask of the rows fulfilling the predicate.
+        """
+        cached = self.masks.get(name)
+        if cached is None or cached[0] != value:
+            cached = (value, self._evaluate(name, value))
+            self.masks[name] = cached
+        return cached[1]
+
+    def apply(self, selection: dict) -> pd.DataFrame:
+        """
+        Function which filters the DataFrame with the active predicates.
+
+        Args:
+            selection (dict): Predicate name -> value, predicates with the value None or an empty selection are skipped.
+
+        Returns:
+            pd.DataFrame: Filtered DataFrame (a new frame, even if no predicate is active).
+        """
+        masks = [
+            self.mask(name, value)
+            for name, value in selection.items()
+            if value is not None and (not isinstance(value, tuple) or value)
+        ]
+        if not masks:
+            return self.df.copy(deep=False)
+        return self.df[np.logical_and.reduce(masks)]
@@ -0,0 +1,169 @@
+"""
+File which contains the interval index used for region queries on the exon/bin tables of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+_REGION_PATTERN = re.compile(r"^([^:]+)(?::([\d,]+)-([\d,]+))?$")
+
+
+def parse_regions(text: str) -> list:
+    """
+    Function which parses a region selection such as "chr1:1,000-2,000; chr2:5000-6000 chrX".
+    Regions are separated by semicolons or whitespace, a chromosome without coordinates selects the whole chromosome.
+
+    Args:
+        text (str): Region selection entered by the user.
+
+    Returns:
+        list: List of (chromosome, start, end) tuples, start and end are None for whole chromosomes.
+
+    Raises:
+        ValueError: If a region cannot be parsed or its start is larger than its end.
+    """
+    regions = []
+    for token in re.split(r"[;\s]+", text.strip()):
+        if not token:
+            continue
+        match = _REGION_PATTERN.match(token)
+        if match is None:
+            raise ValueError(f"Invalid region: {token}")
+        chromosome, start, end = match.groups()
+        if start is None:
+            regions.append((chromosome, None, None))
+            continue
+        start, end = int(start.replace(",", "")), int(end.replace(",", ""))
+        if start > end:
+            raise ValueError(f"Invalid region: {token}")
+        regions.append((chromosome, start, end))
+    return regions
+
+
+class IntervalIndex:
+    """
+    Class used to answer region queries on a table of intervals (exons or bins) by binary search.
+    The intervals of each chromosome are sorted by start, together with the running maximum of their ends,
+    so the candidates of a query are found in logarithmic time, even if intervals are nested.
+    Queries return row positions of the indexed table.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        chromosome_column: str = "chromosome",
+        start_column: str = "start",
+        end_column: str = "end",
+    ):
+        """
+        Constructor of the class IntervalIndex.
+
+        Args:
+            df (pd.DataFrame): Table of intervals (e.g. the .cnr DataFrame).
+            chromosome_column (str): Name of the chromosome column.
+            start_column (str): Name of the start column.
+            end_column (str): Name of the end column.
+        """
+        self.size = len(df)
+        codes, chromosomes = pd.factorize(df[chromosome_column])
+        starts = df[start_column].to_numpy()
+        ends = df[end_column].to_numpy()
+        # Rows without chromosome (code -1) are sorted first and never selected
+        order = np.lexsort((starts, codes))
+        bounds = np.searchsorted(codes[order], np.arange(len(chromosomes) + 1))
+        self.chromosomes = {}
+        for code, chromosome in enumerate(chromosomes):
+            positions = order[bounds[code] : bounds[code + 1]]
+            self.chromosomes[str(chromosome)] = (
+                positions,
+                starts[positions],
+                ends[positions],
+                np.maximum.accumulate(ends[positions]),
+            )
+
+    def _query_region(self, chromosome: str, start, end, how: str) -> np.ndarray:
+        """
+        Function which returns the row positions of the intervals matching one region.
+
+        Args:
+            chromosome (str): Chromosome of the region.
+            start (int): Start of the region (None for the whole chromosome).
+            end (int): End of the region (None for the whole chromosome).
+            how (str): overlap (intervals overlapping the region) or contained (intervals within the region).
+
+        Returns:
+            np.ndarray: Row positions, ordered by start.
+        """
+        entry = self.chromosomes.get(str(chromosome))
+        if entry is None:
+            return np.empty(0, dtype=np.intp)
+        positions, starts, ends, max_ends = entry
+        if start is None:
+            return positions
+        # Candidates start at or before the end of the region ...
+        upper = np.searchsorted(starts, end, side="right")
+        if how == "overlap":
+            # ... and are preceded by an interval reaching into the region
+            lower = np.searchsorted(max_ends, start, side="left")
+            keep = ends[lower:upper] >= start
+        elif how == "contained":
+            lower = np.searchsorted(starts, start, side="left")
+            keep = ends[lower:upper] <= end
+        else:
+            raise ValueError(f"Unknown query type: {how}")
+        return positions[lower:upper][keep]
+
+    def query(self, regions: list, how: str = "overlap") -> np.ndarray:
+        """
+        Function which returns the row positions of the intervals matching any of the regions.
+
+        Args:
+            regions (list): List of (chromosome, start, end) tuples, start and end may be None for whole chromosomes.
+            how (str): overlap (intervals overlapping a region) or contained (intervals within a region).
+
+        Returns:
+            np.ndarray: Sorted unique row positions.
+        """
+        hits = [self._query_region(*region, how) for region in regions]
+        if not hits:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(hits))
+
+    def mask(self, regions: list, how: str = "overlap") -> np.ndarray:
+        """
+        Function which returns a boolean mask of the intervals matching any of the regions.
+
+        Args:
+            regions (list): List of (chromosome, start, end) tuples.
+            how (str): overlap or contained.
+
+        Returns:
+            np.ndarray: Boolean mask over the rows of the indexed table.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.query(regions, how)] = True
+        return mask
+
+    def count_overlaps(self, chromosomes, starts, ends) -> np.ndarray:
+        """
+        Function which counts the intervals overlapping each of the given regions (e.g. the SVs of an AnnotSV table).
+
+        Args:
+            chromosomes (array-like): Chromosomes of the regions.
+            starts (array-like): Starts of the regions.
+            ends (array-like): Ends of the regions.
+
+        Returns:
+            np.ndarray: Number of overlapping intervals per region.
+        """
+        return np.array(
+            [
+                len(self._query_region(chromosome, start, end, "overlap"))
+                for chromosome, start, end in zip(chromosomes, starts, ends)
+            ],
+            dtype=np.int64,
+        )
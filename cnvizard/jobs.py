@@ -0,0 +1,212 @@
+"""
+File which contains the background export jobs of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import os
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _remove_file(path: str):
+    """
+    Function which removes a file if it exists.
+
+    Args:
+        path (str): Path to the file.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ExportJob:
+    """
+    Class used to track an export running in the background.
+    The export reports its progress (e.g. one step per excel sheet) through the report function
+    and writes its result to the temporary file of the job, which is removed when the job is discarded
+    or garbage collected.
+    """
+
+    def __init__(self, key: str, total_steps: int, suffix: str = ""):
+        """
+        Constructor of the class ExportJob.
+
+        Args:
+            key (str): Key of the exported data (sample and view/filter state).
+            total_steps (int): Number of steps (sheets) of the export.
+            suffix (str): Suffix of the temporary file (e.g. ".xlsx").
+        """
+        self.key = key
+        self.total_steps = max(total_steps, 1)
+        self.done_steps = 0
+        self.current_step = None
+        self.future = None
+        handle, self.path = tempfile.mkstemp(prefix="cnvizard-export-", suffix=suffix)
+        os.close(handle)
+        self._remove = weakref.finalize(self, _remove_file, self.path)
+
+    def report(self, done_steps: int, total_steps: int, current_step: str = None):
+        """
+        Function which is called by the export to report its progress.
+
+        Args:
+            done_steps (int): Number of finished steps.
+            total_steps (int): Number of steps.
+            current_step (str): Name of the last finished step (e.g. the sheet name).
+        """
+        self.total_steps = max(total_steps, 1)
+        self.done_steps = done_steps
+        self.current_step = current_step
+
+    @property
+    def progress(self) -> float:
+        """
+        Fraction of the finished steps.
+
+        Returns:
+            float: Progress between 0 and 1.
+        """
+        return min(self.done_steps / self.total_steps, 1.0)
+
+    def done(self) -> bool:
+        """
+        Function which checks whether the export finished (successfully or not).
+
+        Returns:
+            bool: True if the export finished.
+        """
+        return self.future.done()
+
+    def error(self):
+        """
+        Function which returns the exception raised by a finished export.
+
+        Returns:
+            BaseException: Exception of the export or None.
+        """
+        return self.future.exception() if self.future.done() else None
+
+    def result(self) -> str:
+        """
+        Function which returns the path to the file written by a finished export.
+
+        Returns:
+            str: Path to the exported file.
+        """
+        self.future.result()
+        return self.path
+
+    def discard(self):
+        """
+        Function which removes the exported file of the job.
+        """
+        self._remove()
+
+
+class ExportJobManager:
+    """
+    Class used to run exports on a worker pool outside of the Streamlit script run.
+    The number of unfinished jobs is bounded and finished jobs are kept as a cache of their exported files,
+    keyed on the exported data, so a job survives reruns and is not repeated for the same data.
+    The exports are written to temporary files, which are removed when their job is evicted.
+    """
+
+    def __init__(
+        self, max_workers: int = 1, max_pending: int = 4, max_results: int = 8
+    ):
+        """
+        Constructor of the class ExportJobManager.
+
+        Args:
+            max_workers (int): Number of worker threads.
+            max_pending (int): Maximal number of submitted but unfinished jobs.
+            max_results (int): Maximal number of finished jobs whose files are kept.
+        """
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="cnvizard-export"
+        )
+        self.max_pending = max_pending
+        self.max_results = max_results
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> ExportJob:
+        """
+        Function which returns the job of a key.
+
+        Args:
+            key (str): Key of the exported data.
+
+        Returns:
+            ExportJob: Job of the key or None.
+        """
+        with self.lock:
+            return self.jobs.get(key)
+
+    def submit(
+        self, key: str, export, total_steps: int, suffix: str = ""
+    ) -> ExportJob:
+        """
+        Function which submits an export, unless a running or successful job of the same key exists.
+        A replaced failed job and the finished jobs evicted from the cache have their files removed.
+
+        Args:
+            key (str): Key of the exported data.
+            export (callable): Function writing the export, called with the report function of the job
+                and the path of the file to write.
+            total_steps (int): Number of steps (sheets) of the export.
+            suffix (str): Suffix of the exported file (e.g. ".xlsx").
+
+        Returns:
+            ExportJob: Submitted or existing job, None if too many jobs are pending.
+        """
+        with self.lock:
+            job = self.jobs.get(key)
+            # A finished job whose file was removed (e.g. by a cleanup of the temporary directory) is repeated
+            if (
+                job is not None
+                and job.error() is None
+                and (not job.done() or os.path.exists(job.path))
+            ):
+                # Mark the job as most recently used
+                self.jobs[key] = self.jobs.pop(key)
+                return job
+            pending = sum(not other.done() for other in self.jobs.values())
+            if pending >= self.max_pending:
+                return None
+            job = ExportJob(key, total_steps, suffix)
+            job.future = self.executor.submit(export, job.report, job.path)
+            failed = self.jobs.pop(key, None)
+            if failed is not None:
+                failed.discard()
+            self.jobs[key] = job
+            finished = [
+                other_key for other_key, other in self.jobs.items() if other.done()
+            ]
+            for other_key in finished[: max(len(finished) - self.max_results, 0)]:
+                self.jobs.pop(other_key).discard()
+            return job
+
+
+_export_manager = None
+_export_manager_lock = threading.Lock()
+
+
+def get_export_manager() -> ExportJobManager:
+    """
+    Function which returns the export job manager shared by all sessions of the app.
+
+    Returns:
+        ExportJobManager: Export job manager.
+    """
+    global _export_manager
+    with _export_manager_lock:
+        if _export_manager is None:
+            _export_manager = ExportJobManager()
+        return _export_manager
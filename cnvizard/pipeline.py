@@ -0,0 +1,261 @@
+"""
+File which contains the sample pipeline of the CNVizard (annotation, reference frequencies, views and export),
+shared by the Streamlit app and the batch command line interface
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+from .exporter import CNVExporter, EXPORT_FORMATS
+from .readers import read_cnvkit_table
+from .reference_store import (
+    publish_reference,
+    load_shared_reference,
+    SharedReference,
+)
+from .schema import apply_schema, widen_floats, SAMPLE_DTYPES
+from .views import CNVViews, VIEW_NAMES
+from .visualizer import CNVVisualizer
+
+# Reference frequencies merged into the .cnr DataFrame of a sample
+FREQUENCY_COLUMNS = [
+    "het_del_frequency",
+    "hom_del_frequency",
+    "dup_frequency",
+]
+
+# Columns of the parental .cnr DataFrames which get the suffix _f (father) or _m (mother) in the trio DataFrame
+PARENT_COLUMNS = ["gene", "exon", "depth", "weight", "call", "log2", "squaredvalue"]
+
+
+def prepare_sample(
+    visualizer: CNVVisualizer,
+    reference: SharedReference,
+    reference_bintest: SharedReference,
+    omim_path,
+    candidate_path,
+):
+    """
+    Function which annotates the .cnr and bintest DataFrame of a sample and merges the reference frequencies.
+    The frequencies are looked up in the shared (memory-mapped) references, keeping the order of the sample rows.
+
+    Args:
+        visualizer (CNVVisualizer): Visualizer holding the .cnr and bintest DataFrame of the sample.
+        reference (SharedReference): Published reference.
+        reference_bintest (SharedReference): Published bintest reference (None if there is none).
+        omim_path (str | Path): Path to omim.txt file.
+        candidate_path (str | Path): Path to the candidate gene list (None for an empty list).
+
+    Returns:
+        tuple: candidate_df (pd.DataFrame), cnr_db (pd.DataFrame), bintest_db (pd.DataFrame)
+    """
+    omim_df, candidate_df, cnr_db, bintest_db = visualizer.format_df(
+        omim_path, candidate_path
+    )
+
+    # The dtypes of the merged frame are established once, the filters rely on them
+    cnr_db = apply_schema(reference.merge(cnr_db, FREQUENCY_COLUMNS), SAMPLE_DTYPES)
+    if reference_bintest is not None:
+        bintest_db = reference_bintest.merge(bintest_db).infer_objects()
+        bintest_db = bintest_db.fillna(
+            {
+                column: 0
+                for column in bintest_db.columns
+                if bintest_db[column].dtype != "category"
+            }
+        )
+    return candidate_df, cnr_db, bintest_db
+
+
+def merge_trio(
+    cnr_db: pd.DataFrame, father_df: pd.DataFrame, mother_df: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Function which merges the parental .cnr DataFrames into the .cnr DataFrame of the index patient
+    by gene and exon and formats the trio DataFrame for display.
+
+    Args:
+        cnr_db (pd.DataFrame): .cnr DataFrame of the index patient (see prepare_sample).
+        father_df (pd.DataFrame): .cnr DataFrame of the father (see CNVVisualizer.prepare_parent_cnv).
+        mother_df (pd.DataFrame): .cnr DataFrame of the mother (see CNVVisualizer.prepare_parent_cnv).
+
+    Returns:
+        pd.DataFrame: Trio DataFrame.
+    """
+    trio_df = cnr_db
+    for parent_df, suffix in [(father_df, "_f"), (mother_df, "_m")]:
+        parent_df = parent_df.drop(["chromosome", "start", "end"], axis=1).rename(
+            columns={column: column + suffix for column in PARENT_COLUMNS}
+        )
+        trio_df = trio_df.merge(
+            parent_df,
+            left_on=["gene", "exon"],
+            right_on=["gene" + suffix, "exon" + suffix],
+            how="left",
+        )
+    return widen_floats(trio_df.rename(columns={"chromosome": "chr"}), decimals=2)
+
+
+def format_table(df: pd.DataFrame, igv_string: str = None) -> pd.DataFrame:
+    """
+    Function which formats a .cnr/bintest DataFrame for display and export:
+    renames chromosome to chr, widens the float columns and adds the IGV outlink.
+
+    Args:
+        df (pd.DataFrame): .cnr/bintest DataFrame (not altered).
+        igv_string (str): IGV outlink prefix of the sample (no outlink if empty).
+
+    Returns:
+        pd.DataFrame: Formatted DataFrame.
+    """
+    df = widen_floats(df.rename(columns={"chromosome": "chr"}), decimals=2)
+    if igv_string:
+        df["IGV_outlink"] = (
+            igv_string + df["chr"].astype(str) + ":" + df["start"].astype(str)
+        )
+    return df
+
+
+def find_samples(input_dir) -> list:
+    """
+    Function which finds the .cnr files below a directory and their bintest files.
+    The bintest file of <sample>.cnr is <sample>_bintest.tsv in the same directory.
+
+    Args:
+        input_dir (str | Path): Directory searched recursively.
+
+    Returns:
+        list: (sample name, .cnr path, bintest path or None) tuples sorted by path.
+    """
+    samples = []
+    for cnr_path in sorted(Path(input_dir).rglob("*.cnr")):
+        sample_name = cnr_path.name.split(".")[0]
+        bintest_path = cnr_path.with_name(f"{sample_name}_bintest.tsv")
+        samples.append(
+            (sample_name, cnr_path, bintest_path if bintest_path.exists() else None)
+        )
+    return samples
+
+
+def process_sample(
+    sample_name: str,
+    cnr_path,
+    bintest_path,
+    output_dir,
+    reference_path,
+    reference_bintest_path=None,
+    omim_path=None,
+    candidate_path=None,
+    del_size: str = "2",
+    dup_size: str = "2",
+    across_genes: bool = False,
+    export_format: str = "xlsx",
+    igv_string: str = None,
+) -> Path:
+    """
+    Function which runs the pipeline of one sample and exports the unfiltered views (one sheet/file per view),
+    like "Prepare for download (all)" of the app.
+    The references are published once (see publish_reference) and memory-mapped by every process using them.
+
+    Args:
+        sample_name (str): Name of the sample (prefix of the export file).
+        cnr_path (str | Path): Path to the .cnr file.
+        bintest_path (str | Path): Path to the bintest file.
+        output_dir (str | Path): Directory of the export file.
+        reference_path (str | Path): Path to the reference parquet file.
+        reference_bintest_path (str | Path): Path to the bintest reference parquet file (optional).
+        omim_path (str | Path): Path to omim.txt file.
+        candidate_path (str | Path): Path to the candidate gene list (optional).
+        del_size (str): Minimal number of consecutive deleted exons.
+        dup_size (str): Minimal number of consecutive duplicated exons.
+        across_genes (bool): Let consecutive runs continue across gene boundaries.
+        export_format (str): Export format, see EXPORT_FORMATS.
+        igv_string (str): IGV outlink, "samplename" is replaced by the sample name (optional).
+
+    Returns:
+        Path: Path to the export file.
+    """
+    reference = load_shared_reference(publish_reference(reference_path))
+    reference_bintest = (
+        load_shared_reference(publish_reference(reference_bintest_path))
+        if reference_bintest_path
+        else None
+    )
+    visualizer = CNVVisualizer(
+        None, read_cnvkit_table(cnr_path), read_cnvkit_table(bintest_path)
+    )
+    candidate_df, cnr_db, bintest_db = prepare_sample(
+        visualizer, reference, reference_bintest, omim_path, candidate_path
+    )
+    if igv_string:
+        igv_string = igv_string.replace("samplename", sample_name)
+
+    views = CNVViews(
+        visualizer,
+        {},
+        sample_name,
+        candidate_df,
+        {
+            "candidate": candidate_path,
+            "del_size": del_size,
+            "dup_size": dup_size,
+            "across_genes": across_genes,
+        },
+    )
+    # The exported views are derived from the unfiltered .cnr DataFrame (total_all)
+    views.add_base("total_all", "", lambda: cnr_db)
+    views.add_base("bintest", "", lambda: format_table(bintest_db, igv_string))
+
+    extension = EXPORT_FORMATS[export_format]
+    output_path = Path(output_dir) / f"{sample_name}_df{extension}"
+    CNVExporter().save_tables_as_excel(
+        *[views.get(name, unfiltered=True) for name in VIEW_NAMES],
+        output_path=output_path,
+        export_format=export_format,
+    )
+    return output_path
+
+
+def run_batch(samples: list, output_dir, n_workers: int = None, **settings):
+    """
+    Function which processes samples in a pool of worker processes, one export file per sample.
+    The references are published before the pool is started; the workers memory-map the published files,
+    so the reference pages are shared by all workers instead of being copied into each of them.
+
+    Args:
+        samples (list): (sample name, .cnr path, bintest path) tuples, see find_samples.
+        output_dir (str | Path): Directory of the export files (created if missing).
+        n_workers (int): Number of worker processes (default: number of CPUs, 1 processes the samples sequentially).
+        **settings: Keyword arguments of process_sample (reference_path, omim_path, ...).
+
+    Yields:
+        tuple: Sample name and the path to its export file or the exception raised while processing it,
+            in the order the samples finish.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    publish_reference(settings["reference_path"])
+    if settings.get("reference_bintest_path"):
+        publish_reference(settings["reference_bintest_path"])
+    process = partial(process_sample, output_dir=output_dir, **settings)
+
+    n_workers = min(n_workers or os.cpu_count() or 1, max(len(samples), 1))
+    if n_workers == 1:
+        for sample_name, cnr_path, bintest_path in samples:
+            try:
+                yield sample_name, process(sample_name, cnr_path, bintest_path)
+            except Exception as e:
+                yield sample_name, e
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(process, sample_name, cnr_path, bintest_path): sample_name
+            for sample_name, cnr_path, bintest_path in samples
+        }
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], future.result() if error is None else error
@@ -5,9 +5,12 @@ File which contains plotting functions of the CNVizard
 @mail: jerkrause@ukaachen.de
 """
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.graph_objects as go
+from .reference_store import select_reference_gene
+from .timing import timed
 
 
 class CNVPlotter:
@@ -15,53 +18,152 @@ class CNVPlotter:
     Class containing functions for plotting CNV data.
     """
 
+    # Number of index values above which the markers are rendered with WebGL
+    WEBGL_MIN_POINTS = 500
+    # Number of gene payloads kept per session (see gene_payload)
+    PAYLOAD_CACHE_SIZE = 64
+
     def __init__(self):
         """
         Constructor of the Class CNVPlotter.
         """
 
-    def df_to_list(self, df: pd.DataFrame):
+    def index_gene_values(self, df: pd.DataFrame, selected_gene: str):
         """
-        Function which transforms the log2 and depth columns to lists, used for plotting.
+        Function used to extract the exons and the log2 and depth values of a specific gene from the index .cnr DataFrame.
 
         Args:
-            df (pd.DataFrame): .cnr DataFrame
+            df (pd.DataFrame): Index .cnr DataFrame
+            selected_gene (str): Gene for which to filter
 
         Returns:
-            list: List containing the log2 values
-            list: List containing the depth values
+            np.ndarray: Exon of each index value, sorted by exon
+            np.ndarray: log2 values from index for selected gene
+            np.ndarray: depth values from index for selected gene
         """
-        col_of_log2 = df.groupby("exon")["log2"].apply(list)
-        col_of_depth = df.groupby("exon")["depth"].apply(list)
-        list_of_log2 = col_of_log2.tolist()
-        list_of_depth = col_of_depth.tolist()
-        return list_of_log2, list_of_depth
+        index_gene_df = df[df["gene"] == selected_gene]
+        order = np.argsort(index_gene_df["exon"].to_numpy(), kind="stable")
+        return (
+            index_gene_df["exon"].to_numpy()[order],
+            index_gene_df["log2"].to_numpy()[order],
+            index_gene_df["depth"].to_numpy()[order],
+        )
 
-    def index_ref_processor(self, df: pd.DataFrame, selected_gene: str):
+    def add_index_trace(self, fig: go.Figure, exons, values, value_name: str):
         """
-        Function used to extract the log2 and depth values from the index .cnr DataFrame for a specific gene.
+        Function used to overlay the index values as a single marker trace.
+        Above WEBGL_MIN_POINTS values the trace is rendered with WebGL (Scattergl).
 
         Args:
-            df (pd.DataFrame): Index .cnr DataFrame
-            selected_gene (str): Gene for which to filter
+            fig (go.Figure): Figure containing the reference boxplot
+            exons (np.ndarray): Exon of each index value
+            values (np.ndarray): Index values (log2 or depth)
+            value_name (str): Name of the values shown on hover
+        """
+        trace = go.Scattergl if len(values) > self.WEBGL_MIN_POINTS else go.Scatter
+        fig.add_trace(
+            trace(
+                x=exons,
+                y=values,
+                mode="markers",
+                marker=dict(color="red"),
+                showlegend=False,
+                name="index",
+                hovertemplate=(
+                    f"exon %{{x}}<br>{value_name} %{{y:.2f}}<extra></extra>"
+                ),
+            )
+        )
+
+    @timed
+    def gene_payload(
+        self,
+        gene: str,
+        df_total: pd.DataFrame,
+        reference_df: pd.DataFrame,
+        gene_index: dict = None,
+    ) -> dict:
+        """
+        Function used to collect everything the log2 and depth plots of a gene need as NumPy arrays.
+        The payload only depends on the gene, the index sample and the reference, so it can be cached.
+
+        Args:
+            gene (str): Selected gene
+            df_total (pd.DataFrame): Index .cnr DataFrame
+            reference_df (pd.DataFrame): DataFrame containing the precomputed statistics, created by reference_builder
+            gene_index (dict): Gene -> row range index of the reference DataFrame (optional)
 
         Returns:
-            list: List of log2 values from index for selected gene
-            list: List of exons from index for selected gene
-            list: List of depth values from index for selected gene
+            dict: Reference exons (exon), index exons (index_exon), number of index exons (number_of_exons) and
+                for log2 and depth the reference statistics (q1, median, q3, lowerfence, upperfence, mean)
+                and the index values (index).
         """
-        index_gene_df = df[df["gene"] == selected_gene]
-        index_gene_df = index_gene_df.sort_values(by=["exon"], ascending=True)
-        list_of_log2_index, list_of_depth_index = self.df_to_list(index_gene_df)
-        exon_list = index_gene_df["exon"].unique().tolist()
-        return list_of_log2_index, exon_list, list_of_depth_index
+        selected_gene = select_reference_gene(reference_df, gene, gene_index)
+        exons, log2_values, depth_values = self.index_gene_values(df_total, gene)
+        payload = {
+            "exon": selected_gene["exon"].to_numpy(),
+            "index_exon": exons,
+            "number_of_exons": len(np.unique(exons)),
+        }
+        for value, index_values in [("log2", log2_values), ("depth", depth_values)]:
+            payload[value] = {
+                "q1": selected_gene[f"q1_{value}"].to_numpy(),
+                "median": selected_gene[f"median_{value}"].to_numpy(),
+                "q3": selected_gene[f"q3_{value}"].to_numpy(),
+                "lowerfence": selected_gene[f"actual_minimum_{value}"].to_numpy(),
+                "upperfence": selected_gene[f"actual_maximum_{value}"].to_numpy(),
+                "mean": selected_gene[f"mean_{value}"].to_numpy(),
+                "index": index_values,
+            }
+        return payload
+
+    def add_reference_box(self, fig: go.Figure, payload: dict, value: str):
+        """
+        Function used to draw the precomputed reference statistics of a gene as boxplot.
+
+        Args:
+            fig (go.Figure): Figure of the gene plot
+            payload (dict): Payload of the gene created by gene_payload
+            value (str): log2 or depth
+        """
+        statistics = payload[value]
+        fig.add_trace(
+            go.Box(
+                q1=statistics["q1"],
+                median=statistics["median"],
+                q3=statistics["q3"],
+                lowerfence=statistics["lowerfence"],
+                upperfence=statistics["upperfence"],
+                mean=statistics["mean"],
+                x=payload["exon"],
+                showlegend=False,
+                fillcolor="white",
+                line={"color": "black"},
+            )
+        )
 
+    def show_figure(self, fig: go.Figure, number_of_exons: int):
+        """
+        Function used to display a gene plot, plots of genes with more than 30 exons use the container width.
+
+        Args:
+            fig (go.Figure): Gene plot
+            number_of_exons (int): Number of exons of the gene
+        """
+        if number_of_exons > 30:
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.plotly_chart(fig)
+
+    @timed
     def plot_log2_for_gene_precomputed(
         self,
         gene: str,
         df_total: pd.DataFrame,
         reference_df: pd.DataFrame,
         sample_name: str,
+        gene_index: dict = None,
+        payload: dict = None,
     ):
         """
         Function used to create boxplot for log2 values, extracted from the reference DataFrame.
@@ -73,53 +175,20 @@ class CNVPlotter:
             df_total (pd.DataFrame): Index .cnr DataFrame
             reference_df (pd.DataFrame): DataFrame containing the precomputed statistics, created by reference_builder
             sample_name (str): Index sample name, automatically extracted after uploading the index cnr file
+            gene_index (dict): Gene -> row range index of the reference DataFrame, used to select the gene without a full scan (optional)
+            payload (dict): Cached payload of the gene created by gene_payload (optional)
         """
+        if payload is None:
+            payload = self.gene_payload(gene, df_total, reference_df, gene_index)
         fig = go.Figure()
-        selected_gene = reference_df[reference_df["gene"] == gene]
-        listed_q1 = selected_gene["q1_log2"].tolist()
-        listed_median = selected_gene["median_log2"].tolist()
-        listed_q3 = selected_gene["q3_log2"].tolist()
-        listed_min = selected_gene["actual_minimum_log2"].tolist()
-        listed_max = selected_gene["actual_maximum_log2"].tolist()
-        listed_mean = selected_gene["mean_log2"].tolist()
-        listed_std = selected_gene["std_log2"].tolist()
-        listed_exons = selected_gene["exon"].tolist()
-
-        fig.add_trace(
-            go.Box(
-                q1=listed_q1,
-                median=listed_median,
-                q3=listed_q3,
-                lowerfence=listed_min,
-                upperfence=listed_max,
-                mean=listed_mean,
-                x=listed_exons,
-                showlegend=False,
-                fillcolor="white",
-                line={"color": "black"},
-            )
-        )
+        self.add_reference_box(fig, payload, "log2")
         fig.update_layout(title=f"log2-plot-{gene}-{sample_name}")
         fig.update_xaxes(title_text="Exons", tickmode="linear")
         fig.update_yaxes(title_text="log-2 value", range=[-2, 2])
-        list_of_log2_index, exon_list, list_of_depth_index = self.index_ref_processor(
-            df_total, gene
+        self.add_index_trace(
+            fig, payload["index_exon"], payload["log2"]["index"], "log2"
         )
 
-        for log2_value, exon_name in zip(list_of_log2_index, listed_exons):
-            for value in log2_value:
-                y_list = [exon_name]
-                x_list = [value]
-                fig.add_trace(
-                    go.Scatter(
-                        y=x_list,
-                        x=y_list,
-                        mode="markers",
-                        marker=dict(color="red"),
-                        showlegend=False,
-                    )
-                )
-
         fig.add_hline(
             y=0.3,
             line_width=1,
@@ -150,17 +219,17 @@ class CNVPlotter:
             )
         )
 
-        if len(exon_list) > 30:
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.plotly_chart(fig)
+        self.show_figure(fig, payload["number_of_exons"])
 
+    @timed
     def plot_depth_for_gene_precomputed(
         self,
         gene: str,
         df_total: pd.DataFrame,
         reference_df: pd.DataFrame,
         sample_name: str,
+        gene_index: dict = None,
+        payload: dict = None,
     ):
         """
         Function used to create boxplot for depth values, extracted from the reference DataFrame.
@@ -172,54 +241,17 @@ class CNVPlotter:
             df_total (pd.DataFrame): Index .cnr DataFrame
             reference_df (pd.DataFrame): DataFrame containing the precomputed statistics, created by reference_builder
             sample_name (str): Index sample name, automatically extracted after uploading the index cnr file
+            gene_index (dict): Gene -> row range index of the reference DataFrame, used to select the gene without a full scan (optional)
+            payload (dict): Cached payload of the gene created by gene_payload (optional)
         """
+        if payload is None:
+            payload = self.gene_payload(gene, df_total, reference_df, gene_index)
         fig = go.Figure()
-        selected_gene = reference_df[reference_df["gene"] == gene]
-        listed_q1 = selected_gene["q1_depth"].tolist()
-        listed_median = selected_gene["median_depth"].tolist()
-        listed_q3 = selected_gene["q3_depth"].tolist()
-        listed_min = selected_gene["actual_minimum_depth"].tolist()
-        listed_max = selected_gene["actual_maximum_depth"].tolist()
-        listed_mean = selected_gene["mean_depth"].tolist()
-        listed_std = selected_gene["std_depth"].tolist()
-        listed_exons = selected_gene["exon"].tolist()
-
-        fig.add_trace(
-            go.Box(
-                q1=listed_q1,
-                median=listed_median,
-                q3=listed_q3,
-                lowerfence=listed_min,
-                upperfence=listed_max,
-                mean=listed_mean,
-                x=listed_exons,
-                showlegend=False,
-                fillcolor="white",
-                line={"color": "black"},
-            )
-        )
+        self.add_reference_box(fig, payload, "depth")
         fig.update_layout(title=f"depth-plot-{gene}-{sample_name}")
         fig.update_xaxes(title_text="Exons", tickmode="linear")
         fig.update_yaxes(title_text="Depth value")
-        list_of_log2_index, exon_list, list_of_depth_index = self.index_ref_processor(
-            df_total, gene
+        self.add_index_trace(
+            fig, payload["index_exon"], payload["depth"]["index"], "depth"
         )
-
-        for depth_value, exon_name in zip(list_of_depth_index, listed_exons):
-            for value in depth_value:
-                y_list = [exon_name]
-                x_list = [value]
-                fig.add_trace(
-                    go.Scatter(
-                        y=x_list,
-                        x=y_list,
-                        mode="markers",
-                        marker=dict(color="red"),
-                        showlegend=False,
-                    )
-                )
-
-        if len(exon_list) > 30:
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.plotly_chart(fig)
+        self.show_figure(fig, payload["number_of_exons"])
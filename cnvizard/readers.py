@@ -0,0 +1,97 @@
+"""
+File which contains the readers for the CNVkit output files (.cnr/bintest) of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+# Fixed types of the CNVkit columns, further columns (e.g. probes, p_bintest) are inferred.
+# The values are read with full precision, the calls are derived from them before the compact schema is applied.
+CNVKIT_COLUMN_TYPES = {
+    "chromosome": pa.string(),
+    "start": pa.int64(),
+    "end": pa.int64(),
+    "gene": pa.string(),
+    "depth": pa.float64(),
+    "log2": pa.float64(),
+    "weight": pa.float64(),
+}
+
+
+def split_gene_field(entries: pa.Array):
+    """
+    Function which splits GENE_EXON entries into gene and exon and flags the Antitarget entries.
+
+    Args:
+        entries (pa.Array): String array of GENE_EXON entries (one exon per entry).
+
+    Returns:
+        pa.Array: Boolean mask of the target (non-Antitarget) entries.
+        pa.Array: Genes of the target entries.
+        pa.Array: int32 exons of the target entries.
+    """
+    is_target = pc.invert(pc.match_substring(entries, "Antitarget"))
+    gene_exon = pc.split_pattern(
+        entries.filter(is_target), "_", max_splits=1, reverse=True
+    )
+    return (
+        is_target,
+        pc.list_element(gene_exon, 0),
+        pc.cast(pc.list_element(gene_exon, 1), pa.int32()),
+    )
+
+
+def _split_gene_exon(table: pa.Table) -> pa.Table:
+    """
+    Function which splits the GENE_EXON[,GENE_EXON] field of a CNVkit table into gene and exon columns.
+    Rows listing several exons are repeated once per exon and Antitarget entries are dropped.
+
+    Args:
+        table (pa.Table): CNVkit table containing a gene column.
+
+    Returns:
+        pa.Table: Table with one row per exon, the gene column and an appended exon column.
+    """
+    entries = pc.split_pattern(table.column("gene"), ",")
+    table = table.take(pc.list_parent_indices(entries))
+    is_target, gene, exon = split_gene_field(pc.list_flatten(entries))
+    table = table.filter(is_target)
+    table = table.set_column(table.column_names.index("gene"), "gene", gene)
+    return table.append_column("exon", exon)
+
+
+def read_cnvkit_table(source, categorical: bool = True) -> pd.DataFrame:
+    """
+    Function which reads a .cnr or bintest file created by CNVkit with the multithreaded Arrow CSV reader.
+    The gene field is split into gene and exon columns in a single vectorized pass and Antitarget entries are dropped,
+    so the result corresponds to the exploded table used by CNVVisualizer.prepare_cnv_table.
+
+    Args:
+        source (str | file-like): Path to the file or uploaded file object.
+        categorical (bool): Return the chromosome and gene columns as categoricals.
+
+    Returns:
+        pd.DataFrame: Table with the original CNVkit columns (gene without exon) and an appended exon column.
+    """
+    table = pv.read_csv(
+        source,
+        read_options=pv.ReadOptions(use_threads=True),
+        parse_options=pv.ParseOptions(delimiter="\t"),
+        convert_options=pv.ConvertOptions(column_types=CNVKIT_COLUMN_TYPES),
+    )
+    if "gene" in table.column_names:
+        table = _split_gene_exon(table)
+    if categorical:
+        for name in ["chromosome", "gene"]:
+            if name in table.column_names:
+                table = table.set_column(
+                    table.column_names.index(name),
+                    name,
+                    pc.dictionary_encode(table.column(name)),
+                )
+    return table.to_pandas()
@@ -7,7 +7,27 @@ Email: jerkrause@ukaachen.de
 
 import pandas as pd
 import os
+import json
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from .reference_store import build_gene_index, gene_index_path
+from .schema import apply_schema, REFERENCE_DTYPES
+from .readers import read_cnvkit_table
+from .annotation import annotate_cnv_table
+from .reference_statistics import (
+    aggregate_exon_statistics,
+    aggregate_call_counts,
+    aggregate_sufficient_statistics,
+    merge_sufficient_statistics,
+    histogram_quantiles,
+    HISTOGRAM_EDGES,
+)
 
 
 def prepare_cnv_table(df: pd.DataFrame, df2: pd.DataFrame) -> pd.DataFrame:
@@ -21,18 +41,21 @@ def prepare_cnv_table(df: pd.DataFrame, df2: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: Reordered and formatted DataFrame
     """
-    df = df[~df["gene"].str.contains("Antitarget")]
-    df["squaredvalue"] = 2 ** df["log2"]
-    df[["gene", "exon"]] = df["gene"].str.split("_", expand=True)
-    df["exon"] = df["exon"].astype(int)
-    cols = df.columns.tolist()
-    cols = cols[:4] + cols[-1:] + cols[5:6] + cols[6:7] + cols[4:5] + cols[7:-1]
-    df = df[cols]
-    df.insert(loc=7, column="call", value="")
-    df.loc[df["log2"] <= -1.1, "call"] = 0
-    df.loc[(df["log2"] <= -0.4) & (df["log2"] > -1.1), "call"] = 1
-    df.loc[(df["log2"] <= 0.3) & (df["log2"] > -0.4), "call"] = 2
-    df.loc[df["log2"] > 0.3, "call"] = 3
+    df = annotate_cnv_table(df, "squaredvalue")
+    return _add_omim_annotation(df, df2)
+
+
+def _add_omim_annotation(df: pd.DataFrame, df2: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merge the OMIM annotation into the annotated .cnr DataFrame and fill None entries.
+
+    Parameters:
+        df (pd.DataFrame): Annotated .cnr DataFrame
+        df2 (pd.DataFrame): OMIM DataFrame
+
+    Returns:
+        pd.DataFrame: DataFrame containing the OMIM annotation
+    """
     df = pd.merge(df, df2, on="gene", how="left")
     df.fillna("-", inplace=True)
     df["comments"] = "."
@@ -54,71 +77,390 @@ def explode_cnv_table(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def _get_call_counts(call: list) -> list:
+class _ReferenceWriter:
+    """
+    Class used to write a merged reference, which is sorted by gene, in consecutive chunks.
+    A gene-indexed reference gets row groups cut at gene boundaries and a gene -> row range index sidecar.
+    """
+
+    def __init__(self, path: str, gene_indexed: bool, row_group_size: int):
+        """
+        Constructor of the class _ReferenceWriter.
+
+        Parameters:
+            path (str): Path of the parquet file to be written.
+            gene_indexed (bool): Write row groups cut at gene boundaries plus a gene index sidecar.
+            row_group_size (int): Minimal number of rows per row group (a row group never splits a gene).
+        """
+        self.path = path
+        self.gene_indexed = gene_indexed
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.num_rows = 0
+        self.index_rows = []
+
+    def write(self, df: pd.DataFrame):
+        """
+        Append the next chunk of the reference. No gene may span two chunks.
+
+        Parameters:
+            df (pd.DataFrame): Chunk of the reference.
+        """
+        df = apply_schema(df, REFERENCE_DTYPES, categorical=False)
+        if self.writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.Table.from_pandas(
+                df, schema=self.writer.schema, preserve_index=False
+            )
+        if not self.gene_indexed:
+            self.writer.write_table(table)
+            self.num_rows += table.num_rows
+            return
+
+        gene_index = build_gene_index(df["gene"].to_numpy())
+        group_start = 0
+        for stop in sorted(stop for _, stop in gene_index.values()):
+            if stop - group_start >= self.row_group_size or stop == table.num_rows:
+                self.writer.write_table(
+                    table.slice(group_start, stop - group_start),
+                    row_group_size=stop - group_start,
+                )
+                group_start = stop
+        self.index_rows.extend(
+            (gene, self.num_rows + start, self.num_rows + stop)
+            for gene, (start, stop) in gene_index.items()
+        )
+        self.num_rows += table.num_rows
+
+    def close(self):
+        """
+        Close the parquet file and write the gene index sidecar.
+        """
+        if self.writer is not None:
+            self.writer.close()
+        if self.gene_indexed:
+            # Write the sidecar after the reference, so it is never older than the reference
+            index_df = pd.DataFrame(self.index_rows, columns=["gene", "start", "stop"])
+            index_df.to_parquet(gene_index_path(self.path), index=False)
+
+
+def _write_gene_indexed_parquet(df: pd.DataFrame, path: str, row_group_size: int):
+    """
+    Write a reference DataFrame sorted by gene, with row groups cut at gene boundaries,
+    together with a gene -> row range index sidecar.
+
+    Parameters:
+        df (pd.DataFrame): Reference DataFrame containing a gene and an exon column.
+        path (str): Path of the parquet file to be written.
+        row_group_size (int): Minimal number of rows per row group (a row group never splits a gene).
+    """
+    writer = _ReferenceWriter(path, True, row_group_size)
+    writer.write(df.sort_values(["gene", "exon"], kind="stable", ignore_index=True))
+    writer.close()
+
+
+def _write_reference(
+    df: pd.DataFrame, path: str, gene_indexed: bool, row_group_size: int
+):
+    """
+    Write a merged reference DataFrame to a parquet file.
+
+    Parameters:
+        df (pd.DataFrame): Merged reference DataFrame.
+        path (str): Path of the parquet file to be written.
+        gene_indexed (bool): Write the reference sorted and row-grouped by gene, plus a gene index sidecar.
+        row_group_size (int): Minimal number of rows per row group of a gene-indexed reference.
+    """
+    if gene_indexed:
+        _write_gene_indexed_parquet(df, path, row_group_size)
+    else:
+        apply_schema(df, REFERENCE_DTYPES, categorical=False).to_parquet(path)
+
+
+def _format_reference(statistics: pd.DataFrame) -> pd.DataFrame:
     """
-    Calculate the amount of deletions, duplications, wild types from a call list.
+    Build the merged reference from the per-exon call counts and statistics.
 
     Parameters:
-        call (list): List inside a pandas DataFrame column which stores all calls (per exon) inside the reference DataFrame.
+        statistics (pd.DataFrame): Per-exon call counts, mean, median, quartiles and standard deviation of log2 and depth.
 
     Returns:
-        list: List inside a pandas DataFrame column which stores the sums of all call-types (per exon) inside the reference DataFrame.
-    """
-    dels_het, dels_hom, dups, wt = 0, 0, 0, 0
-    for x in call:
-        if x == 1:
-            dels_het += 1
-        elif x == 0:
-            dels_hom += 1
-        elif x == 2:
-            wt += 1
-        else:
-            dups += 1
-    all_calls = dels_het + dels_hom + wt + dups
-    return [dels_het, dels_hom, dups, wt, all_calls]
+        pd.DataFrame: Merged reference containing frequencies, statistics and boxplot fences per exon.
+    """
+    reference_df = statistics[["gene", "exon"]].copy()
 
+    # Calculate frequencies
+    reference_df["het_del_frequency"] = statistics["del_het"] / statistics["total"]
+    reference_df["hom_del_frequency"] = statistics["del_hom"] / statistics["total"]
+    reference_df["dup_frequency"] = statistics["dup"] / statistics["total"]
 
-def _get_frequency(call_counts: list, position1: int, position2: int) -> float:
+    # Calculate additional statistics
+    for column in [
+        "mean_depth",
+        "mean_log2",
+        "median_depth",
+        "median_log2",
+        "q1_depth",
+        "q1_log2",
+        "q3_depth",
+        "q3_log2",
+        "std_depth",
+        "std_log2",
+    ]:
+        reference_df[column] = statistics[column]
+    box_size = (reference_df["q3_log2"] - reference_df["q1_log2"]) * 1.5
+    reference_df["actual_minimum_log2"] = reference_df["q1_log2"] - box_size
+    reference_df["actual_maximum_log2"] = reference_df["q3_log2"] + box_size
+    box_size_depth = (reference_df["q3_depth"] - reference_df["q1_depth"]) * 1.5
+    reference_df["actual_minimum_depth"] = reference_df["q1_depth"] - box_size_depth
+    reference_df["actual_maximum_depth"] = reference_df["q3_depth"] + box_size_depth
+    return reference_df
+
+
+def _format_bintest(call_counts: pd.DataFrame, ref_counts: pd.DataFrame) -> pd.DataFrame:
     """
-    Calculate the frequency of different call types inside the reference DataFrame.
+    Derive the bintest frequencies from the bintest call counts and the number of individuals per exon
+    inside the "normal" reference.
 
     Parameters:
-        call_counts (list): List which contains the previously calculated sums for each call-types.
-        position1 (int): This position selects the call-type for which the frequency is to be calculated.
-        position2 (int): This position selects the total sum of individuals inside the reference DataFrame.
+        call_counts (pd.DataFrame): Bintest call counts per exon (see aggregate_call_counts).
+        ref_counts (pd.DataFrame): gene, exon and total columns of the "normal" reference.
 
     Returns:
-        float: Frequency of a CNV-type per exon inside the reference DataFrame.
+        pd.DataFrame: Bintest reference DataFrame with the het./hom. deletion and duplication frequencies.
+    """
+    bintest_df = call_counts.merge(
+        ref_counts, on=["gene", "exon"], how="left", suffixes=("", "_ref")
+    )
+    number_of_individuals = bintest_df["total_ref"]
+    return pd.DataFrame(
+        {
+            "gene": bintest_df["gene"],
+            "exon": bintest_df["exon"],
+            "het_del_frequency": bintest_df["del_het"] / number_of_individuals,
+            "hom_del_frequency": bintest_df["del_hom"] / number_of_individuals,
+            "dup_frequency": bintest_df["dup"] / number_of_individuals,
+        }
+    )
+
+
+# Estimated peak memory per reference row while a partition is aggregated
+# (pandas columns plus the sort order, group codes and value copies of the statistics engine)
+_BYTES_PER_PARTITION_ROW = 200
+
+
+def _iter_reference_batches(files: list, columns: list, batch_size: int):
+    """
+    Stream the rows of individual reference files as Arrow record batches.
+
+    Parameters:
+        files (list): Paths to the individual reference files.
+        columns (list): Columns to be read.
+        batch_size (int): Maximal number of rows per batch.
+
+    Yields:
+        pa.RecordBatch: Next batch of rows.
+    """
+    for file in files:
+        yield from pq.ParquetFile(file).iter_batches(
+            batch_size=batch_size, columns=columns
+        )
+
+
+def _partition_genes(files: list, rows_per_partition: int, batch_size: int):
     """
-    number_of_cnvs = call_counts[position1]
-    number_of_individuals = call_counts[position2]
-    frequency = number_of_cnvs / number_of_individuals
-    return frequency
+    Split the genes of the individual reference files into sorted, contiguous ranges of
+    at most rows_per_partition rows (a gene with more rows gets its own partition).
 
+    Parameters:
+        files (list): Paths to the individual reference files.
+        rows_per_partition (int): Maximal number of rows per partition.
+        batch_size (int): Maximal number of rows per streamed batch.
 
-def _get_frequency_bintest(
-    call_counts: list, position1: int, position2: int, call_counts_ref: list
-) -> float:
+    Returns:
+        pa.Array: Sorted array of all genes.
+        np.ndarray: Partition of every gene in the sorted array.
     """
-    Calculate the frequency of different call types inside the reference DataFrame for bintest.
+    gene_counts = pd.Series(dtype=np.int64)
+    for batch in _iter_reference_batches(files, ["gene"], batch_size):
+        counts = pc.value_counts(batch.column("gene").cast(pa.string()))
+        gene_counts = gene_counts.add(
+            pd.Series(
+                counts.field("counts").to_numpy(),
+                index=counts.field("values").to_pylist(),
+            ),
+            fill_value=0,
+        )
+    gene_counts = gene_counts.sort_index()
+
+    partitions = np.empty(len(gene_counts), dtype=np.int64)
+    partition, rows_in_partition = 0, 0
+    for position, count in enumerate(gene_counts.to_numpy()):
+        if rows_in_partition and rows_in_partition + count > rows_per_partition:
+            partition += 1
+            rows_in_partition = 0
+        partitions[position] = partition
+        rows_in_partition += count
+    return pa.array(gene_counts.index.tolist(), type=pa.string()), partitions
+
+
+def _spill_partitions(
+    files: list,
+    columns: list,
+    genes: pa.Array,
+    partitions: np.ndarray,
+    path_to_spill: str,
+    batch_size: int,
+) -> list:
+    """
+    Stream the rows of the individual reference files into one parquet file per gene partition.
+    The rows keep their original order inside each partition.
 
     Parameters:
-        call_counts (list): List which contains the previously calculated sums for each call-types.
-        position1 (int): This position selects the call-type for which the frequency is to be calculated.
-        position2 (int): This position selects the total sum of individuals inside the reference DataFrame.
-        call_counts_ref (list): List which contains the previously calculated sums for each call-types (from the "normal" reference).
+        files (list): Paths to the individual reference files.
+        columns (list): Columns to be kept.
+        genes (pa.Array): Sorted array of all genes.
+        partitions (np.ndarray): Partition of every gene in the sorted array.
+        path_to_spill (str): Directory for the partition files.
+        batch_size (int): Maximal number of rows per streamed batch.
 
     Returns:
-        float: Frequency of a CNV-type per exon inside the reference DataFrame.
+        list: Paths to the partition files, in gene order.
+    """
+    n_partitions = int(partitions.max()) + 1 if len(partitions) else 0
+    partition_files = [
+        os.path.join(path_to_spill, f"partition_{i}.parquet") for i in range(n_partitions)
+    ]
+    writers = [None] * n_partitions
+    try:
+        for batch in _iter_reference_batches(files, columns, batch_size):
+            gene_position = pc.index_in(
+                batch.column("gene").cast(pa.string()), value_set=genes
+            )
+            valid = pc.is_valid(gene_position)
+            batch = batch.filter(valid)
+            batch_partitions = partitions[
+                gene_position.filter(valid).to_numpy(zero_copy_only=False)
+            ]
+            for partition in np.unique(batch_partitions):
+                part = pa.Table.from_batches(
+                    [batch.filter(pa.array(batch_partitions == partition))]
+                )
+                if writers[partition] is None:
+                    writers[partition] = pq.ParquetWriter(
+                        partition_files[partition], part.schema
+                    )
+                # Individual reference files of older versions may use wider column types
+                writers[partition].write_table(
+                    part.cast(writers[partition].schema)
+                )
+    finally:
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+    return partition_files
+
+
+def _merge_reference_files_out_of_core(
+    path_to_input: str,
+    path_to_output: str,
+    path_to_bintest: str,
+    gene_indexed: bool,
+    row_group_size: int,
+    memory_limit_mb: int,
+):
+    """
+    Out-of-core variant of merge_reference_files.
+    The individual reference files are streamed into gene partitions on disk, which are aggregated one at a time
+    and appended to the merged references, so the peak memory depends on memory_limit_mb instead of the cohort size.
+
+    Parameters:
+        path_to_input (str): Path to the input directory containing the individual reference files.
+        path_to_output (str): Path to the output directory where the merged reference file will be saved.
+        path_to_bintest (str): Path to the directory containing the bintest reference files.
+        gene_indexed (bool): Write the references sorted and row-grouped by gene, plus a gene index sidecar.
+        row_group_size (int): Minimal number of rows per row group of a gene-indexed reference.
+        memory_limit_mb (int): Approximate memory budget for a single partition in MB.
     """
-    number_of_cnvs = call_counts[position1]
-    number_of_individuals = call_counts_ref[position2]
-    frequency = number_of_cnvs / number_of_individuals
-    return frequency
+    rows_per_partition = max(
+        1, memory_limit_mb * 1024 * 1024 // _BYTES_PER_PARTITION_ROW
+    )
+    batch_size = min(rows_per_partition, 1_000_000)
+
+    with tempfile.TemporaryDirectory(dir=path_to_output) as path_to_spill:
+        # Aggregate the "normal" reference one partition at a time
+        reference_files = [
+            os.path.join(path_to_input, f)
+            for f in os.listdir(path_to_input)
+            if f.endswith(".parquet")
+        ]
+        genes, partitions = _partition_genes(
+            reference_files, rows_per_partition, batch_size
+        )
+        os.makedirs(os.path.join(path_to_spill, "normal"))
+        partition_files = _spill_partitions(
+            reference_files,
+            _REFERENCE_RUN_COLUMNS,
+            genes,
+            partitions,
+            os.path.join(path_to_spill, "normal"),
+            batch_size,
+        )
+
+        ref_counts = []
+        writer = _ReferenceWriter(
+            os.path.join(path_to_output, "cnv_reference.parquet"),
+            gene_indexed,
+            row_group_size,
+        )
+        for partition_file in partition_files:
+            statistics = aggregate_exon_statistics(pd.read_parquet(partition_file))
+            ref_counts.append(statistics[["gene", "exon", "total"]])
+            writer.write(_format_reference(statistics))
+            os.remove(partition_file)
+        writer.close()
+        ref_counts_df = pd.concat(ref_counts, ignore_index=True)
+
+        # Count the bintest calls one partition at a time
+        bintest_files = [
+            os.path.join(path_to_bintest, f)
+            for f in os.listdir(path_to_bintest)
+            if f.endswith(".parquet")
+        ]
+        genes, partitions = _partition_genes(
+            bintest_files, rows_per_partition, batch_size
+        )
+        os.makedirs(os.path.join(path_to_spill, "bintest"))
+        partition_files = _spill_partitions(
+            bintest_files,
+            ["gene", "exon", "call"],
+            genes,
+            partitions,
+            os.path.join(path_to_spill, "bintest"),
+            batch_size,
+        )
+
+        writer = _ReferenceWriter(
+            os.path.join(path_to_output, "cnv_reference_bintest.parquet"),
+            gene_indexed,
+            row_group_size,
+        )
+        for partition_file in partition_files:
+            call_counts = aggregate_call_counts(pd.read_parquet(partition_file))
+            writer.write(_format_bintest(call_counts, ref_counts_df))
+            os.remove(partition_file)
+        writer.close()
 
 
 def merge_reference_files(
-    path_to_input: str, path_to_output: str, path_to_bintest: str
+    path_to_input: str,
+    path_to_output: str,
+    path_to_bintest: str,
+    gene_indexed: bool = False,
+    row_group_size: int = 2048,
+    memory_limit_mb: int = None,
 ):
     """
     Merge previously created individual reference files into a single reference file for plotting with CNVizard.
@@ -127,7 +469,23 @@ def merge_reference_files(
         path_to_input (str): Path to the input directory containing the individual reference files.
         path_to_output (str): Path to the output directory where the merged reference file will be saved.
         path_to_bintest (str): Path to the directory containing the bintest reference files.
+        gene_indexed (bool): Write the references sorted and row-grouped by gene, plus a gene index sidecar,
+            so single genes can be selected without scanning the whole reference.
+        row_group_size (int): Minimal number of rows per row group of a gene-indexed reference.
+        memory_limit_mb (int): If given, merge out-of-core: the individual reference files are streamed into gene
+            partitions of about this size (in MB of working memory), which are aggregated one at a time.
     """
+    if memory_limit_mb is not None:
+        _merge_reference_files_out_of_core(
+            path_to_input,
+            path_to_output,
+            path_to_bintest,
+            gene_indexed,
+            row_group_size,
+            memory_limit_mb,
+        )
+        return
+
     # Load individual reference files
     reference_files = [
         os.path.join(path_to_input, f)
@@ -156,65 +514,12 @@ def merge_reference_files(
         inplace=True,
     )
 
-    # Group by gene and exon, aggregate columns
-    reference_df = (
-        reference_df.groupby(["gene", "exon"])
-        .agg({"depth": list, "log2": list, "call": list})
-        .reset_index()
-    )
-
-    # Apply call count and frequency functions
-    reference_df["call_counts"] = reference_df["call"].apply(_get_call_counts)
-    reference_df["het_del_frequency"] = reference_df["call_counts"].apply(
-        lambda x: _get_frequency(x, 0, 4)
-    )
-    reference_df["hom_del_frequency"] = reference_df["call_counts"].apply(
-        lambda x: _get_frequency(x, 1, 4)
-    )
-    reference_df["dup_frequency"] = reference_df["call_counts"].apply(
-        lambda x: _get_frequency(x, 2, 4)
-    )
-
-    # Calculate additional statistics
-    reference_df["max_log2"] = reference_df["log2"].apply(max)
-    reference_df["min_log2"] = reference_df["log2"].apply(min)
-    reference_df["mean_depth"] = reference_df["depth"].apply(np.mean)
-    reference_df["mean_log2"] = reference_df["log2"].apply(np.mean)
-    reference_df["median_depth"] = reference_df["depth"].apply(
-        lambda x: np.quantile(x, 0.5)
-    )
-    reference_df["median_log2"] = reference_df["log2"].apply(
-        lambda x: np.quantile(x, 0.5)
-    )
-    reference_df["q1_depth"] = reference_df["depth"].apply(
-        lambda x: np.quantile(x, 0.25)
-    )
-    reference_df["q1_log2"] = reference_df["log2"].apply(lambda x: np.quantile(x, 0.25))
-    reference_df["q3_depth"] = reference_df["depth"].apply(
-        lambda x: np.quantile(x, 0.75)
-    )
-    reference_df["q3_log2"] = reference_df["log2"].apply(lambda x: np.quantile(x, 0.75))
-    reference_df["std_depth"] = reference_df["depth"].apply(np.std)
-    reference_df["std_log2"] = reference_df["log2"].apply(np.std)
-    reference_df["box_size"] = (reference_df["q3_log2"] - reference_df["q1_log2"]) * 1.5
-    reference_df["actual_minimum_log2"] = (
-        reference_df["q1_log2"] - reference_df["box_size"]
-    )
-    reference_df["actual_maximum_log2"] = (
-        reference_df["q3_log2"] + reference_df["box_size"]
-    )
-    reference_df["box_size_depth"] = (
-        reference_df["q3_depth"] - reference_df["q1_depth"]
-    ) * 1.5
-    reference_df["actual_minimum_depth"] = (
-        reference_df["q1_depth"] - reference_df["box_size_depth"]
-    )
-    reference_df["actual_maximum_depth"] = (
-        reference_df["q3_depth"] + reference_df["box_size_depth"]
-    )
+    # Aggregate call counts and statistics per exon in a single vectorized pass
+    statistics = aggregate_exon_statistics(reference_df)
+    reference_df = _format_reference(statistics)
 
-    # Create a new DataFrame with call counts from normal references
-    ref_counts_df = reference_df[["gene", "exon", "call_counts"]]
+    # Number of individuals per exon inside the normal references
+    ref_counts_df = statistics[["gene", "exon", "total"]]
 
     # Load bintest reference files
     bintest_files = [
@@ -242,60 +547,325 @@ def merge_reference_files(
         inplace=True,
     )
 
-    # Group by gene and exon, aggregate columns
-    bintest_df = (
-        bintest_df.groupby(["gene", "exon"])
-        .agg({"depth": list, "log2": list, "call": list})
-        .reset_index()
+    # Count the calls per exon and derive the frequencies columnwise
+    bintest_df = _format_bintest(aggregate_call_counts(bintest_df), ref_counts_df)
+
+    # Write bintest reference to parquet file
+    _write_reference(
+        bintest_df,
+        os.path.join(path_to_output, "cnv_reference_bintest.parquet"),
+        gene_indexed,
+        row_group_size,
     )
-    bintest_df["call_counts"] = bintest_df["call"].apply(_get_call_counts)
 
-    # Merge with bintest reference DataFrame
-    bintest_df = pd.merge(bintest_df, ref_counts_df, on=["gene", "exon"], how="left")
-    bintest_df["het_del_frequency"] = bintest_df.apply(
-        lambda x: _get_frequency_bintest(x["call_counts_x"], 0, 4, x["call_counts_y"]),
-        axis=1,
+    # Write merged and formatted reference to parquet file
+    _write_reference(
+        reference_df,
+        os.path.join(path_to_output, "cnv_reference.parquet"),
+        gene_indexed,
+        row_group_size,
     )
-    bintest_df["hom_del_frequency"] = bintest_df.apply(
-        lambda x: _get_frequency_bintest(x["call_counts_x"], 1, 4, x["call_counts_y"]),
-        axis=1,
+
+
+# Columns of the individual reference files used for the merged reference
+_REFERENCE_RUN_COLUMNS = ["gene", "exon", "log2", "call", "depth"]
+
+
+def _read_reference_state(path: str):
+    """
+    Read the mergeable per-exon statistics of an incremental reference.
+
+    Parameters:
+        path (str): Path to the statistics parquet file.
+
+    Returns:
+        pd.DataFrame: Scalar statistics per exon (None if the file does not exist).
+        dict: Bin counts per exon for log2 and depth (empty for bintest statistics).
+        dict: Identity (see _run_identity) of the individual reference files contained in the statistics,
+            keyed on their names. The identity is None for statistics written before identities were recorded.
+    """
+    if not os.path.exists(path):
+        return None, {}, {}
+    table = pq.read_table(path)
+    runs = json.loads(table.schema.metadata[b"cnvizard_runs"])
+    if isinstance(runs, list):
+        runs = dict.fromkeys(runs)
+    histograms = {}
+    for column, edges in HISTOGRAM_EDGES.items():
+        name = f"{column}_histogram"
+        if name in table.column_names:
+            values = table.column(name).combine_chunks().flatten().to_numpy()
+            histograms[column] = values.reshape(-1, len(edges) - 1)
+            table = table.drop([name])
+    return table.to_pandas(), histograms, runs
+
+
+def _write_reference_state(
+    path: str, statistics: pd.DataFrame, histograms: dict, runs: dict
+):
+    """
+    Write the mergeable per-exon statistics of an incremental reference.
+
+    Parameters:
+        path (str): Path to the statistics parquet file.
+        statistics (pd.DataFrame): Scalar statistics per exon.
+        histograms (dict): Bin counts per exon for log2 and depth.
+        runs (dict): Identity of the individual reference files contained in the statistics, keyed on their names.
+    """
+    table = pa.Table.from_pandas(statistics, preserve_index=False)
+    for column, histogram in histograms.items():
+        table = table.append_column(
+            f"{column}_histogram",
+            pa.FixedSizeListArray.from_arrays(
+                pa.array(histogram.ravel()), histogram.shape[1]
+            ),
+        )
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"cnvizard_runs"] = json.dumps(runs, sort_keys=True).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+def _run_identity(path: str) -> list:
+    """
+    Identify the content of an individual reference file by its size and modification time.
+
+    Parameters:
+        path (str): Path to the individual reference file.
+
+    Returns:
+        list: Size in bytes and modification time in nanoseconds.
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _update_reference_state(path: str, path_to_input: str, with_histograms: bool):
+    """
+    Fold the individual reference files, which are not yet contained in the statistics, into the statistics.
+    Statistics cannot be subtracted, so if a contained file was changed or removed (or its identity is unknown),
+    the statistics are rebuilt from all individual reference files.
+
+    Parameters:
+        path (str): Path to the statistics parquet file.
+        path_to_input (str): Path to the directory containing the individual reference files.
+        with_histograms (bool): Collect sums and bin counts of log2 and depth besides the call counts.
+
+    Returns:
+        pd.DataFrame: Updated scalar statistics per exon.
+        dict: Updated bin counts per exon.
+    """
+    statistics, histograms, runs = _read_reference_state(path)
+    current_runs = {
+        f: _run_identity(os.path.join(path_to_input, f))
+        for f in os.listdir(path_to_input)
+        if f.endswith(".parquet")
+    }
+    if any(current_runs.get(f) != identity for f, identity in runs.items()):
+        statistics, histograms, runs = None, {}, {}
+    new_runs = sorted(f for f in current_runs if f not in runs)
+    if not new_runs:
+        if statistics is None:
+            raise ValueError(f"No individual reference files found in {path_to_input}")
+        return statistics, histograms
+
+    new_df = pd.concat(
+        [
+            pd.read_parquet(os.path.join(path_to_input, f), columns=_REFERENCE_RUN_COLUMNS)
+            for f in new_runs
+        ],
+        ignore_index=True,
     )
-    bintest_df["dup_frequency"] = bintest_df.apply(
-        lambda x: _get_frequency_bintest(x["call_counts_x"], 2, 4, x["call_counts_y"]),
-        axis=1,
+    if with_histograms:
+        new_statistics, new_histograms = aggregate_sufficient_statistics(new_df)
+    else:
+        new_statistics = aggregate_call_counts(new_df)
+        new_histograms = {}
+
+    if statistics is not None:
+        new_statistics, new_histograms = merge_sufficient_statistics(
+            statistics, histograms, new_statistics, new_histograms
+        )
+    runs.update((f, current_runs[f]) for f in new_runs)
+    _write_reference_state(path, new_statistics, new_histograms, runs)
+    return new_statistics, new_histograms
+
+
+def update_reference_files(
+    path_to_input: str,
+    path_to_output: str,
+    path_to_bintest: str,
+    gene_indexed: bool = False,
+    row_group_size: int = 2048,
+):
+    """
+    Incrementally update the merged reference files with new individual reference files.
+    Mergeable per-exon statistics (call counts, sums, sums of squares and binned log2/depth values) are kept in
+    path_to_output/reference_state. Only individual reference files not yet contained in these statistics are read,
+    so adding a run costs time proportional to the new run instead of the whole cohort.
+    The first call builds the statistics from all files. Files are identified by name, size and modification
+    time; if a file contained in the statistics was changed or removed, the statistics are rebuilt from all files.
+
+    Frequencies, means and standard deviations are exact, while medians and quartiles are estimated from the binned values.
+    Use merge_reference_files to rebuild a reference with exact quartiles.
+
+    Parameters:
+        path_to_input (str): Path to the input directory containing the individual reference files.
+        path_to_output (str): Path to the output directory where the merged reference file will be saved.
+        path_to_bintest (str): Path to the directory containing the bintest reference files.
+        gene_indexed (bool): Write the references sorted and row-grouped by gene, plus a gene index sidecar.
+        row_group_size (int): Minimal number of rows per row group of a gene-indexed reference.
+    """
+    path_to_state = os.path.join(path_to_output, "reference_state")
+    os.makedirs(path_to_state, exist_ok=True)
+    statistics, histograms = _update_reference_state(
+        os.path.join(path_to_state, "cnv_reference_statistics.parquet"),
+        path_to_input,
+        True,
     )
-    bintest_df.drop(
-        columns=["depth", "log2", "call", "call_counts_x", "call_counts_y"],
-        inplace=True,
+    bintest_statistics, _ = _update_reference_state(
+        os.path.join(path_to_state, "cnv_reference_bintest_statistics.parquet"),
+        path_to_bintest,
+        False,
     )
 
-    # Write bintest reference to parquet file
-    bintest_df.to_parquet(os.path.join(path_to_output, "cnv_reference_bintest.parquet"))
+    # Derive means, standard deviations and quartiles from the mergeable statistics
+    for column, edges in HISTOGRAM_EDGES.items():
+        mean = statistics[f"sum_{column}"] / statistics["total"]
+        variance = statistics[f"sum_squares_{column}"] / statistics["total"] - mean**2
+        statistics[f"mean_{column}"] = mean
+        statistics[f"std_{column}"] = np.sqrt(variance.clip(lower=0))
+        q1, median, q3 = histogram_quantiles(
+            histograms[column],
+            edges,
+            statistics[f"min_{column}"].to_numpy(),
+            statistics[f"max_{column}"].to_numpy(),
+            [0.25, 0.5, 0.75],
+        )
+        statistics[f"q1_{column}"] = q1
+        statistics[f"median_{column}"] = median
+        statistics[f"q3_{column}"] = q3
+    reference_df = _format_reference(statistics)
+
+    # Bintest frequencies refer to the number of individuals inside the "normal" reference
+    bintest_df = _format_bintest(
+        bintest_statistics, statistics[["gene", "exon", "total"]]
+    )
 
-    # Drop unnecessary columns from reference DataFrame
-    reference_df.drop(
-        columns=[
-            "depth",
-            "log2",
-            "call",
-            "call_counts",
-            "max_log2",
-            "min_log2",
-            "box_size",
-            "box_size_depth",
-        ],
-        inplace=True,
+    _write_reference(
+        bintest_df,
+        os.path.join(path_to_output, "cnv_reference_bintest.parquet"),
+        gene_indexed,
+        row_group_size,
+    )
+    _write_reference(
+        reference_df,
+        os.path.join(path_to_output, "cnv_reference.parquet"),
+        gene_indexed,
+        row_group_size,
     )
 
-    # Write merged and formatted reference to parquet file
-    reference_df.to_parquet(os.path.join(path_to_output, "cnv_reference.parquet"))
+
+def _get_sample_file(path: str, ngs_type: str, reference_type: str) -> str:
+    """
+    Get the .cnr or bintest file of a sample directory.
+
+    Parameters:
+        path (str): Path to the sample directory.
+        ngs_type (str): Type of NGS (e.g., 'WES' or 'WGS').
+        reference_type (str): Type of reference ('normal' or 'bintest').
+
+    Returns:
+        str: Path to the .cnr or bintest file.
+    """
+    current_sample = os.path.basename(path)
+    subdirectory = "results/CNV" if ngs_type == "WES" else "exome_extract/CNV"
+    file_name = (
+        f"{current_sample}.cnr"
+        if reference_type == "normal"
+        else f"{current_sample}_bintest.tsv"
+    )
+    return os.path.join(path, subdirectory, file_name)
+
+
+def _ingest_sample(total_file: str) -> pd.DataFrame:
+    """
+    Read, explode and annotate the .cnr or bintest file of a single sample.
+    Runs inside the worker processes of create_reference_files.
+
+    Parameters:
+        total_file (str): Path to the .cnr or bintest file.
+
+    Returns:
+        pd.DataFrame: Annotated DataFrame of the sample (without OMIM annotation).
+    """
+    return annotate_cnv_table(
+        read_cnvkit_table(total_file, categorical=False), "squaredvalue"
+    )
+
+
+def _iter_ingested_samples(list_of_files: list, n_workers: int, max_pending: int = None):
+    """
+    Read, explode and annotate the samples, in the order of list_of_files.
+    With more than one worker the samples are ingested in worker processes; if max_pending is given,
+    at most that many samples are submitted ahead of the consumer, which bounds the memory of pending results.
+
+    Parameters:
+        list_of_files (list): Paths to the .cnr or bintest files.
+        n_workers (int): Number of worker processes.
+        max_pending (int): Maximal number of samples in flight (default: unbounded).
+
+    Yields:
+        pd.DataFrame: Annotated DataFrame of the next sample (without OMIM annotation).
+    """
+    if n_workers == 1 or len(list_of_files) <= 1:
+        for file in list_of_files:
+            yield _ingest_sample(file)
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        if max_pending is None:
+            yield from executor.map(_ingest_sample, list_of_files)
+            return
+        pending = deque()
+        files = iter(list_of_files)
+        for file in islice(files, max_pending):
+            pending.append(executor.submit(_ingest_sample, file))
+        while pending:
+            df = pending.popleft().result()
+            file = next(files, None)
+            if file is not None:
+                pending.append(executor.submit(_ingest_sample, file))
+            yield df
+
+
+def _finalize_reference(df: pd.DataFrame, omim_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the OMIM annotation to annotated samples and cast the OMIMG column to string.
+
+    Parameters:
+        df (pd.DataFrame): Annotated DataFrame of one or more samples.
+        omim_df (pd.DataFrame): OMIM DataFrame.
+
+    Returns:
+        pd.DataFrame: Annotated reference DataFrame.
+    """
+    df = _add_omim_annotation(df, omim_df)
+    df["OMIMG"] = df["OMIMG"].astype(str).str.split(".").str[0]
+    return df
 
 
 def create_reference_files(
-    path_to_input, ngs_type, path_to_output, omim_path, reference_type, starting_letter
+    path_to_input,
+    ngs_type,
+    path_to_output,
+    omim_path,
+    reference_type,
+    starting_letter,
+    n_workers=None,
+    out_of_core=False,
 ):
     """
     Create individual reference files for CNV visualization.
+    The samples are read, exploded and annotated in parallel worker processes.
 
     Parameters:
         path_to_input (str): Path to the input directory.
@@ -304,6 +874,9 @@ def create_reference_files(
         omim_path (str): Path to the OMIM reference file.
         reference_type (str): Type of reference ('normal' or 'bintest').
         starting_letter (str): Starting letter to filter subdirectories.
+        n_workers (int): Number of worker processes (default: number of CPUs, 1 processes the samples sequentially).
+        out_of_core (bool): Append the samples to the reference file one at a time instead of concatenating
+            the whole run in memory.
     """
     # Define run name
     run_name = os.path.basename(os.path.normpath(path_to_input))
@@ -313,44 +886,12 @@ def create_reference_files(
     omim_df = pd.read_csv(omim_all, delimiter="\t")
 
     # Collect all relevant subdirectories
-    list_of_dirs = [
-        os.path.join(path_to_input, d)
+    list_of_files = [
+        _get_sample_file(os.path.join(path_to_input, d), ngs_type, reference_type)
         for d in os.listdir(path_to_input)
         if d.startswith(starting_letter)
     ]
 
-    # Collect individual dataframes
-    list_of_dfs = []
-    for path in list_of_dirs:
-        current_sample = os.path.basename(path)
-        if reference_type == "normal":
-            total_file = (
-                os.path.join(path, "results/CNV", f"{current_sample}.cnr")
-                if ngs_type == "WES"
-                else os.path.join(path, "exome_extract/CNV", f"{current_sample}.cnr")
-            )
-        else:
-            total_file = (
-                os.path.join(path, "results/CNV", f"{current_sample}_bintest.tsv")
-                if ngs_type == "WES"
-                else os.path.join(
-                    path, "exome_extract/CNV", f"{current_sample}_bintest.tsv"
-                )
-            )
-
-        current_total_df = pd.read_csv(total_file, delimiter="\t")
-        list_of_dfs.append(current_total_df)
-
-    # Concatenate all individual dataframes to a reference dataframe
-    reference = pd.concat(list_of_dfs)
-    exploded_reference = explode_cnv_table(reference)
-    ordered_reference = prepare_cnv_table(exploded_reference, omim_df)
-
-    # Cast the OMIMG column to string
-    ordered_reference["OMIMG"] = (
-        ordered_reference["OMIMG"].astype(str).str.split(".").str[0]
-    )
-
     # Define export name
     export_name_parquet = os.path.join(
         path_to_output,
@@ -358,9 +899,40 @@ def create_reference_files(
             "bintest_" if reference_type != "normal" else ""}{run_name}.parquet',
     )
 
+    n_workers = n_workers or os.cpu_count() or 1
+    if out_of_core:
+        # Stream the annotated samples into the reference file, keeping at most
+        # two samples per worker in memory
+        writer = None
+        try:
+            for df in _iter_ingested_samples(list_of_files, n_workers, 2 * n_workers):
+                df = _finalize_reference(df, omim_df)
+                if writer is None:
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    writer = pq.ParquetWriter(export_name_parquet, table.schema)
+                else:
+                    table = pa.Table.from_pandas(
+                        df, schema=writer.schema, preserve_index=False
+                    )
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return
+
+    # Read and annotate the individual dataframes
+    list_of_dfs = list(_iter_ingested_samples(list_of_files, n_workers))
+
+    # Concatenate all individual dataframes to a reference dataframe and
+    # add the OMIM annotation once, so the annotation strings are shared by all samples
+    reference = pd.concat(list_of_dfs, ignore_index=True)
+    del list_of_dfs
+    ordered_reference = _finalize_reference(reference, omim_df)
+
     # Export reference to parquet file
     ordered_reference.to_parquet(export_name_parquet, index=False)
 
+
 def convert_genomics_england_panel_to_txt(
         path_to_input:str,path_to_output:str
     ):
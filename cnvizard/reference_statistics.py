@@ -0,0 +1,387 @@
+"""
+Vectorized statistics engine used to aggregate reference files in CNVizard
+Authors: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+Company: University Hospital Aachen
+Email: jerkrause@ukaachen.de
+"""
+
+import pandas as pd
+import numpy as np
+
+# Order of the call classes in the count columns (het. deletion, hom. deletion, duplication, wild type)
+CALL_COUNT_COLUMNS = ["del_het", "del_hom", "dup", "wt"]
+
+
+def group_rows(df: pd.DataFrame, keys: list):
+    """
+    Assign every row to its (sorted) group and compute the contiguous segment of each group
+    in the stably sorted row order.
+
+    Parameters:
+        df (pd.DataFrame): DataFrame to be grouped.
+        keys (list): Columns to group by.
+
+    Returns:
+        pd.DataFrame: Key columns, one row per group, in sorted group order.
+        np.ndarray: Group code of every row in the sorted row order.
+        np.ndarray: Positions of the rows in the sorted row order.
+        np.ndarray: Start of each group segment.
+        np.ndarray: Number of rows of each group.
+    """
+    codes = df.groupby(keys, sort=True).ngroup().to_numpy()
+    # Rows with missing keys are dropped, just like groupby does
+    order = np.flatnonzero(codes >= 0)
+    order = order[np.argsort(codes[order], kind="stable")]
+    codes = codes[order]
+    counts = np.bincount(codes)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    key_df = df[keys].iloc[order[starts]].reset_index(drop=True)
+    return key_df, codes, order, starts, counts
+
+
+def count_calls(calls: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Count the call classes of every group.
+    Calls other than 0, 1 and 2 are counted as duplications.
+
+    Parameters:
+        calls (np.ndarray): Call of every row in the sorted row order.
+        codes (np.ndarray): Group code of every row in the sorted row order.
+        n_groups (int): Number of groups.
+
+    Returns:
+        np.ndarray: Array of shape (n_groups, 4) with the counts in the order of CALL_COUNT_COLUMNS.
+    """
+    classes = np.full(len(calls), 2, dtype=np.int64)
+    classes[calls == 1] = 0
+    classes[calls == 0] = 1
+    classes[calls == 2] = 3
+    counts = np.bincount(codes * 4 + classes, minlength=n_groups * 4)
+    return counts.reshape(n_groups, 4)
+
+
+def segment_sums(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Sum up every group segment.
+    Segments of equal length are summed as rows of a 2D array, which uses the same (pairwise)
+    summation as np.sum on the individual groups, unlike np.add.reduceat.
+
+    Parameters:
+        values (np.ndarray): Values in the sorted row order.
+        starts (np.ndarray): Start of each group segment.
+        counts (np.ndarray): Number of rows of each group.
+
+    Returns:
+        np.ndarray: Sum of each group.
+    """
+    sums = np.empty(len(counts), dtype=values.dtype)
+    for size in np.unique(counts):
+        groups = np.flatnonzero(counts == size)
+        sums[groups] = values[starts[groups, None] + np.arange(size)].sum(axis=1)
+    return sums
+
+
+def segment_mean_std(values: np.ndarray, starts: np.ndarray, counts: np.ndarray):
+    """
+    Compute mean and (population) standard deviation of every group segment.
+    The segments keep the original row order, so the sums match np.mean and np.std of the group values.
+
+    Parameters:
+        values (np.ndarray): Values in the sorted row order.
+        starts (np.ndarray): Start of each group segment.
+        counts (np.ndarray): Number of rows of each group.
+
+    Returns:
+        np.ndarray: Mean of each group.
+        np.ndarray: Standard deviation of each group.
+    """
+    mean = segment_sums(values, starts, counts) / counts
+    deviation = values - np.repeat(mean, counts)
+    deviation *= deviation
+    std = np.sqrt(segment_sums(deviation, starts, counts) / counts)
+    return mean, std
+
+
+def segment_quantiles(
+    values: np.ndarray,
+    codes: np.ndarray,
+    starts: np.ndarray,
+    counts: np.ndarray,
+    quantiles: list,
+) -> list:
+    """
+    Compute quantiles of every group segment with the linear interpolation of np.quantile.
+    Groups containing NaN values yield NaN, like np.quantile does.
+
+    Parameters:
+        values (np.ndarray): Values in the sorted row order.
+        codes (np.ndarray): Group code of every row in the sorted row order.
+        starts (np.ndarray): Start of each group segment.
+        counts (np.ndarray): Number of rows of each group.
+        quantiles (list): Quantiles to be computed.
+
+    Returns:
+        list: One array per quantile containing the quantile of each group.
+    """
+    # Sort the values inside their segment (NaN values end up last)
+    sorted_values = values[np.lexsort((values, codes))]
+    has_nan = np.add.reduceat(np.isnan(values), starts) > 0
+    last = starts + counts - 1
+    results = []
+    for quantile in quantiles:
+        virtual_index = (counts - 1) * quantile
+        previous_index = np.floor(virtual_index).astype(np.intp)
+        next_index = previous_index + 1
+        above_bounds = virtual_index >= counts - 1
+        previous_index[above_bounds] = -1
+        next_index[above_bounds] = -1
+        gamma = virtual_index - previous_index
+        previous_value = np.where(
+            above_bounds, sorted_values[last], sorted_values[starts + previous_index]
+        )
+        next_value = np.where(
+            above_bounds,
+            sorted_values[last],
+            sorted_values[np.minimum(starts + next_index, last)],
+        )
+        # Same interpolation as numpy's _lerp
+        difference = next_value - previous_value
+        result = previous_value + difference * gamma
+        upper = gamma >= 0.5
+        result[upper] = next_value[upper] - difference[upper] * (1 - gamma[upper])
+        result[has_nan] = np.nan
+        results.append(result)
+    return results
+
+
+def aggregate_exon_statistics(
+    df: pd.DataFrame, keys: tuple = ("gene", "exon")
+) -> pd.DataFrame:
+    """
+    Aggregate the depth, log2 and call columns of a concatenated reference in a single vectorized pass.
+
+    Parameters:
+        df (pd.DataFrame): Concatenated reference DataFrame with depth, log2 and call columns.
+        keys (tuple): Columns identifying an exon.
+
+    Returns:
+        pd.DataFrame: One row per exon with the call counts (del_het, del_hom, dup, wt, total),
+            mean, median, quartiles and standard deviation of log2 and depth.
+    """
+    key_df, codes, order, starts, counts = group_rows(df, list(keys))
+    statistics = key_df
+
+    call_counts = count_calls(df["call"].to_numpy()[order], codes, len(counts))
+    for position, column in enumerate(CALL_COUNT_COLUMNS):
+        statistics[column] = call_counts[:, position]
+    statistics["total"] = counts
+
+    for column in ["depth", "log2"]:
+        values = df[column].to_numpy(dtype=np.float64)[order]
+        mean, std = segment_mean_std(values, starts, counts)
+        q1, median, q3 = segment_quantiles(
+            values, codes, starts, counts, [0.25, 0.5, 0.75]
+        )
+        statistics[f"mean_{column}"] = mean
+        statistics[f"median_{column}"] = median
+        statistics[f"q1_{column}"] = q1
+        statistics[f"q3_{column}"] = q3
+        statistics[f"std_{column}"] = std
+    return statistics
+
+
+def aggregate_call_counts(
+    df: pd.DataFrame, keys: tuple = ("gene", "exon")
+) -> pd.DataFrame:
+    """
+    Count the call classes of every exon of a concatenated reference.
+
+    Parameters:
+        df (pd.DataFrame): Concatenated reference DataFrame with a call column.
+        keys (tuple): Columns identifying an exon.
+
+    Returns:
+        pd.DataFrame: One row per exon with the integer count columns del_het, del_hom, dup, wt and total.
+    """
+    key_df, codes, order, starts, counts = group_rows(df, list(keys))
+    call_counts = count_calls(df["call"].to_numpy()[order], codes, len(counts))
+    for position, column in enumerate(CALL_COUNT_COLUMNS):
+        key_df[column] = call_counts[:, position]
+    key_df["total"] = counts
+    return key_df
+
+
+# Fixed histogram bins used for the mergeable quantile estimates of incremental references.
+# The log2 bins are sinh-spaced (finest around 0), the depth bins log-spaced.
+LOG2_HISTOGRAM_EDGES = np.sinh(np.linspace(np.arcsinh(-160), np.arcsinh(80), 129)) * 0.05
+DEPTH_HISTOGRAM_EDGES = np.expm1(np.linspace(0, np.log1p(10000), 129))
+HISTOGRAM_EDGES = {"log2": LOG2_HISTOGRAM_EDGES, "depth": DEPTH_HISTOGRAM_EDGES}
+
+
+def segment_histograms(
+    values: np.ndarray, codes: np.ndarray, n_groups: int, edges: np.ndarray
+) -> np.ndarray:
+    """
+    Count the values of every group in fixed histogram bins.
+    Values outside of the edges are counted in the first/last bin, NaN values are ignored.
+
+    Parameters:
+        values (np.ndarray): Values in the sorted row order.
+        codes (np.ndarray): Group code of every row in the sorted row order.
+        n_groups (int): Number of groups.
+        edges (np.ndarray): Bin edges.
+
+    Returns:
+        np.ndarray: Array of shape (n_groups, len(edges) - 1) with the bin counts.
+    """
+    n_bins = len(edges) - 1
+    valid = ~np.isnan(values)
+    bins = np.clip(np.searchsorted(edges, values[valid], side="right") - 1, 0, n_bins - 1)
+    histograms = np.bincount(codes[valid] * n_bins + bins, minlength=n_groups * n_bins)
+    return histograms.reshape(n_groups, n_bins).astype(np.uint32)
+
+
+def histogram_quantiles(
+    histograms: np.ndarray,
+    edges: np.ndarray,
+    minimum: np.ndarray,
+    maximum: np.ndarray,
+    quantiles: list,
+) -> list:
+    """
+    Estimate quantiles from binned counts.
+    The values of a bin are assumed to be spread evenly across the bin (the outermost bins are narrowed to the
+    observed minimum and maximum). The quantiles are interpolated between the estimated order statistics,
+    like the linear method of np.quantile.
+
+    Parameters:
+        histograms (np.ndarray): Bin counts of every group.
+        edges (np.ndarray): Bin edges.
+        minimum (np.ndarray): Minimum value of every group.
+        maximum (np.ndarray): Maximum value of every group.
+        quantiles (list): Quantiles to be estimated.
+
+    Returns:
+        list: One array per quantile containing the estimate of each group.
+    """
+    cumulative = np.cumsum(histograms, axis=1, dtype=np.float64)
+    total = cumulative[:, -1]
+    rows = np.arange(len(histograms))
+    lower_edges = np.clip(edges[:-1], minimum[:, None], maximum[:, None])
+    upper_edges = np.clip(edges[1:], minimum[:, None], maximum[:, None])
+
+    def order_statistic(rank):
+        bins = np.minimum((cumulative <= rank[:, None]).sum(axis=1), len(edges) - 2)
+        below = np.where(bins > 0, cumulative[rows, bins - 1], 0)
+        in_bin = histograms[rows, bins]
+        fraction = np.divide(
+            rank - below + 0.5, in_bin, out=np.zeros(len(rows)), where=in_bin > 0
+        )
+        lower = lower_edges[rows, bins]
+        return lower + fraction * (upper_edges[rows, bins] - lower)
+
+    results = []
+    for quantile in quantiles:
+        virtual_index = np.maximum(total - 1, 0) * quantile
+        previous_index = np.floor(virtual_index)
+        next_index = np.minimum(previous_index + 1, np.maximum(total - 1, 0))
+        gamma = virtual_index - previous_index
+        previous_value = order_statistic(previous_index)
+        result = previous_value + (order_statistic(next_index) - previous_value) * gamma
+        result[total == 0] = np.nan
+        results.append(result)
+    return results
+
+
+def aggregate_sufficient_statistics(df: pd.DataFrame, keys: tuple = ("gene", "exon")):
+    """
+    Aggregate the mergeable per-exon statistics of a concatenated reference:
+    call counts, sums, sums of squares, minimum, maximum and binned counts of log2 and depth.
+
+    Parameters:
+        df (pd.DataFrame): Concatenated reference DataFrame with depth, log2 and call columns.
+        keys (tuple): Columns identifying an exon.
+
+    Returns:
+        pd.DataFrame: One row per exon with the scalar statistics.
+        dict: Bin counts of every exon for log2 and depth (see HISTOGRAM_EDGES).
+    """
+    key_df, codes, order, starts, counts = group_rows(df, list(keys))
+    statistics = key_df
+
+    call_counts = count_calls(df["call"].to_numpy()[order], codes, len(counts))
+    for position, column in enumerate(CALL_COUNT_COLUMNS):
+        statistics[column] = call_counts[:, position]
+    statistics["total"] = counts
+
+    histograms = {}
+    for column, edges in HISTOGRAM_EDGES.items():
+        values = df[column].to_numpy(dtype=np.float64)[order]
+        statistics[f"sum_{column}"] = np.add.reduceat(values, starts)
+        statistics[f"sum_squares_{column}"] = np.add.reduceat(values * values, starts)
+        statistics[f"min_{column}"] = np.fmin.reduceat(values, starts)
+        statistics[f"max_{column}"] = np.fmax.reduceat(values, starts)
+        histograms[column] = segment_histograms(values, codes, len(counts), edges)
+    return statistics, histograms
+
+
+def merge_sufficient_statistics(
+    statistics: pd.DataFrame,
+    histograms: dict,
+    other_statistics: pd.DataFrame,
+    other_histograms: dict,
+    keys: tuple = ("gene", "exon"),
+):
+    """
+    Merge two sets of mergeable per-exon statistics (see aggregate_sufficient_statistics).
+    Exons only present in one of both sets are kept as they are.
+
+    Parameters:
+        statistics (pd.DataFrame): Scalar statistics of the first set.
+        histograms (dict): Bin counts of the first set (may be empty for call counts only).
+        other_statistics (pd.DataFrame): Scalar statistics of the second set.
+        other_histograms (dict): Bin counts of the second set.
+        keys (tuple): Columns identifying an exon.
+
+    Returns:
+        pd.DataFrame: Merged scalar statistics, sorted by the keys.
+        dict: Merged bin counts.
+    """
+    keys = list(keys)
+    both = pd.concat([statistics[keys], other_statistics[keys]], ignore_index=True)
+    codes = both.groupby(keys, sort=True).ngroup().to_numpy()
+    n_groups = codes.max() + 1 if len(codes) else 0
+    first, second = codes[: len(statistics)], codes[len(statistics) :]
+
+    merged = pd.DataFrame(index=np.arange(n_groups))
+    positions = np.empty(n_groups, dtype=np.intp)
+    positions[second] = len(statistics) + np.arange(len(second))
+    positions[first] = np.arange(len(first))
+    for key in keys:
+        merged[key] = both[key].to_numpy()[positions]
+
+    for column in statistics.columns.difference(keys, sort=False):
+        values = statistics[column].to_numpy()
+        other_values = other_statistics[column].to_numpy()
+        if column.startswith("min_"):
+            result = np.full(n_groups, np.nan)
+            result[first] = values
+            result[second] = np.fmin(result[second], other_values)
+        elif column.startswith("max_"):
+            result = np.full(n_groups, np.nan)
+            result[first] = values
+            result[second] = np.fmax(result[second], other_values)
+        else:
+            result = np.zeros(n_groups, dtype=np.result_type(values, other_values))
+            result[first] += values
+            result[second] += other_values
+        merged[column] = result
+
+    merged_histograms = {}
+    for column, other_histogram in other_histograms.items():
+        result = np.zeros((n_groups, other_histogram.shape[1]), dtype=np.uint32)
+        if column in histograms:
+            result[first] += histograms[column]
+        result[second] += other_histogram
+        merged_histograms[column] = result
+    return merged, merged_histograms
@@ -0,0 +1,425 @@
+"""
+File which contains the process-wide reference store of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import os
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from .schema import apply_schema, REFERENCE_DTYPES
+
+# Streamlit serves every browser session from the same server process, so a
+# module level cache is shared by all sessions and survives script reruns.
+_reference_cache = {}
+_reference_lock = threading.Lock()
+
+
+def _reference_key(path: Path) -> tuple:
+    """
+    Function which builds the cache key of a reference file.
+
+    Args:
+        path (Path): Path to the reference file.
+
+    Returns:
+        tuple: Resolved path, modification time and size of the file.
+    """
+    stat = path.stat()
+    return str(path.resolve()), stat.st_mtime_ns, stat.st_size
+
+
+def _read_reference_table(path: Path) -> pa.Table:
+    """
+    Function which reads a reference parquet file into a read-only Arrow table.
+    The file is memory-mapped, so the column buffers are backed by the page cache,
+    and the gene column is dictionary-encoded.
+
+    Args:
+        path (Path): Path to the reference parquet file.
+
+    Returns:
+        pa.Table: Arrow table containing the reference.
+    """
+    return pq.read_table(path, memory_map=True, read_dictionary=["gene"])
+
+
+def load_reference_table(path) -> pa.Table:
+    """
+    Function which returns the Arrow table of a reference file.
+    The file is only read once per server process and reloaded if its modification time or size changes.
+
+    Args:
+        path (str | Path): Path to the reference parquet file.
+
+    Returns:
+        pa.Table: Arrow table containing the reference.
+    """
+    return _get_reference_entry(Path(path))["table"]
+
+
+def load_reference_df(path) -> pd.DataFrame:
+    """
+    Function which returns the reference file as a pandas DataFrame (using the compact reference schema)
+    shared by all sessions.
+    The returned DataFrame must be treated as read-only, filter or copy it before altering it.
+
+    Args:
+        path (str | Path): Path to the reference parquet file.
+
+    Returns:
+        pd.DataFrame: DataFrame containing the reference.
+    """
+    entry = _get_reference_entry(Path(path))
+    if entry["df"] is None:
+        with _reference_lock:
+            if entry["df"] is None:
+                entry["df"] = apply_schema(
+                    entry["table"].to_pandas(split_blocks=True), REFERENCE_DTYPES
+                )
+    return entry["df"]
+
+
+def _get_reference_entry(path: Path) -> dict:
+    """
+    Function which looks up or (re)loads the cache entry of a reference file.
+
+    Args:
+        path (Path): Path to the reference parquet file.
+
+    Returns:
+        dict: Cache entry containing the key, the Arrow table and the lazily converted DataFrame.
+    """
+    key = _reference_key(path)
+    entry = _reference_cache.get(key[0])
+    if entry is not None and entry["key"] == key:
+        return entry
+    with _reference_lock:
+        entry = _reference_cache.get(key[0])
+        if entry is None or entry["key"] != key:
+            # Replacing the entry drops the outdated version of the file
+            entry = {"key": key, "table": _read_reference_table(path), "df": None}
+            _reference_cache[key[0]] = entry
+    return entry
+
+
+def clear_reference_cache():
+    """
+    Function which drops all cached references.
+    """
+    with _reference_lock:
+        _reference_cache.clear()
+
+
+def gene_index_path(path) -> Path:
+    """
+    Function which returns the path of the gene index sidecar belonging to a reference file.
+
+    Args:
+        path (str | Path): Path to the reference parquet file.
+
+    Returns:
+        Path: Path to the gene index sidecar (e.g. cnv_reference.gene_index.parquet).
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}.gene_index.parquet")
+
+
+def build_gene_index(genes) -> dict:
+    """
+    Function which builds a gene -> row range index from a gene column.
+    This only works if the rows of every gene are stored contiguously (e.g. sorted by gene).
+
+    Args:
+        genes (array-like): Gene column of the reference.
+
+    Returns:
+        dict: Dictionary mapping each gene to a (start, stop) row range, or None if the genes are not contiguous.
+    """
+    genes = np.asarray(genes, dtype=object)
+    if len(genes) == 0:
+        return {}
+    boundaries = np.flatnonzero(genes[1:] != genes[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(genes)]))
+    keys = genes[starts]
+    if len(set(keys)) != len(keys):
+        return None
+    return dict(zip(keys.tolist(), zip(starts.tolist(), stops.tolist())))
+
+
+def _read_gene_index(path: Path, num_rows: int) -> dict:
+    """
+    Function which reads the gene index sidecar of a reference file.
+    The sidecar is ignored if it is older than the reference or does not cover all of its rows.
+
+    Args:
+        path (Path): Path to the reference parquet file.
+        num_rows (int): Number of rows of the reference.
+
+    Returns:
+        dict: Dictionary mapping each gene to a (start, stop) row range, or None if no valid sidecar exists.
+    """
+    sidecar = gene_index_path(path)
+    if not sidecar.exists() or sidecar.stat().st_mtime_ns < path.stat().st_mtime_ns:
+        return None
+    index_df = pd.read_parquet(sidecar)
+    if index_df.empty or index_df["stop"].max() != num_rows:
+        return None
+    return dict(
+        zip(
+            index_df["gene"].tolist(),
+            zip(index_df["start"].tolist(), index_df["stop"].tolist()),
+        )
+    )
+
+
+def load_gene_index(path) -> dict:
+    """
+    Function which returns the gene -> row range index of a reference file.
+    The index is read from the sidecar written by merge_reference_files or, if there is none,
+    derived once from the gene column. It is cached together with the reference.
+
+    Args:
+        path (str | Path): Path to the reference parquet file.
+
+    Returns:
+        dict: Dictionary mapping each gene to a (start, stop) row range, or None if the rows are not grouped by gene.
+    """
+    path = Path(path)
+    entry = _get_reference_entry(path)
+    if "gene_index" not in entry:
+        gene_index = _read_gene_index(path, entry["table"].num_rows)
+        if gene_index is None:
+            gene_index = build_gene_index(load_reference_df(path)["gene"].to_numpy())
+        entry["gene_index"] = gene_index
+    return entry["gene_index"]
+
+
+def select_reference_gene(
+    reference_df: pd.DataFrame, gene: str, gene_index: dict = None
+) -> pd.DataFrame:
+    """
+    Function which selects the rows of a single gene from the reference DataFrame.
+    With a gene index the rows are sliced directly, otherwise the gene column is scanned.
+
+    Args:
+        reference_df (pd.DataFrame): Reference DataFrame.
+        gene (str): Selected gene.
+        gene_index (dict): Gene -> row range index of the reference (optional).
+
+    Returns:
+        pd.DataFrame: Reference rows of the selected gene.
+    """
+    if gene_index is None:
+        return reference_df[reference_df["gene"] == gene]
+    start, stop = gene_index.get(gene, (0, 0))
+    return reference_df.iloc[start:stop]
+
+
+def read_reference_gene(path, gene: str) -> pd.DataFrame:
+    """
+    Function which reads the rows of a single gene directly from a reference parquet file.
+    For gene-indexed references only the row groups containing the gene are read.
+
+    Args:
+        path (str | Path): Path to the reference parquet file.
+        gene (str): Selected gene.
+
+    Returns:
+        pd.DataFrame: Reference rows of the selected gene.
+    """
+    return pq.read_table(
+        path, filters=[("gene", "==", gene)], memory_map=True
+    ).to_pandas()
+
+
+# Published references opened by this process, keyed on the path of the Arrow IPC file
+_shared_references = {}
+
+
+def _exon_keys(gene_codes: np.ndarray, exons: np.ndarray) -> np.ndarray:
+    """
+    Function which combines gene codes and exon numbers into int64 keys ordered like (gene, exon).
+
+    Args:
+        gene_codes (np.ndarray): Codes of the genes in the sorted gene dictionary of the published reference.
+        exons (np.ndarray): Exon numbers (int16 range).
+
+    Returns:
+        np.ndarray: Keys of the exons.
+    """
+    return gene_codes.astype(np.int64) * 65536 + (exons.astype(np.int64) + 32768)
+
+
+def publish_reference(path, directory=None) -> Path:
+    """
+    Function which publishes a reference parquet file as an uncompressed Arrow IPC file sorted by gene and exon,
+    which worker processes memory-map instead of loading their own copy (see SharedReference).
+    The file is written once per version of the reference (path, modification time and size) and named after
+    the resolved path of the reference, so references with the same file name in different directories do not
+    replace each other; outdated versions of the same reference are removed.
+
+    Args:
+        path (str | Path): Path to the reference parquet file.
+        directory (str | Path): Directory of the published files (default: <tmp>/cnvizard).
+
+    Returns:
+        Path: Path to the published Arrow IPC file.
+    """
+    path = Path(path)
+    directory = Path(directory or Path(tempfile.gettempdir()) / "cnvizard")
+    key = _reference_key(path)
+    source = hashlib.sha1(key[0].encode()).hexdigest()[:8]
+    version = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    target = directory / f"{path.stem}.{source}.{version}.arrow"
+    if target.exists():
+        return target
+
+    df = load_reference_df(path)
+    # Sorted gene dictionary, computed on the categories instead of every row
+    gene_column = df["gene"].astype("category").cat
+    categories = gene_column.categories.astype(str).to_numpy()
+    gene_order = np.argsort(categories, kind="stable")
+    ranks = np.empty(len(categories) + 1, dtype=np.int32)
+    ranks[gene_order] = np.arange(len(categories))
+    ranks[-1] = -1
+    gene_codes = ranks[gene_column.codes.to_numpy()]
+    keys = _exon_keys(gene_codes, df["exon"].to_numpy())
+    order = np.argsort(keys, kind="stable")
+    gene_codes = gene_codes[order]
+    columns = {
+        "key": pa.array(keys[order]),
+        "gene": pa.DictionaryArray.from_arrays(
+            pa.array(gene_codes, mask=gene_codes < 0), categories[gene_order]
+        ),
+    }
+    for column in df.columns.drop(["gene", "exon"]):
+        columns[column] = pa.array(df[column].to_numpy()[order])
+    # One record batch, so every column is a single buffer which can be viewed zero-copy
+    batch = pa.RecordBatch.from_pydict(columns)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as tmp:
+        with pa.ipc.new_file(tmp, batch.schema) as writer:
+            writer.write_batch(batch)
+    os.chmod(tmp.name, 0o644)
+    os.replace(tmp.name, target)
+    for outdated in directory.glob(f"{path.stem}.{source}.*.arrow"):
+        if outdated != target:
+            outdated.unlink(missing_ok=True)
+    return target
+
+
+class SharedReference:
+    """
+    Class used to look up the per-exon values of a reference published by publish_reference.
+    The Arrow IPC file is memory-mapped and its columns are used as NumPy views, so all processes attached to it
+    share the same pages of the page cache instead of holding a copy of the reference each.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor of the class SharedReference.
+
+        Args:
+            path (str | Path): Path to the published Arrow IPC file.
+        """
+        self.path = Path(path)
+        table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        self.table = table
+        self.genes = pd.Index(
+            table.column("gene").combine_chunks().dictionary.to_numpy(
+                zero_copy_only=False
+            )
+        )
+        self.keys = self._values("key")
+        self.columns = table.column_names[2:]
+
+    def _values(self, column: str) -> np.ndarray:
+        """
+        Function which returns a column as a (read-only) NumPy view on the mapped file.
+
+        Args:
+            column (str): Column name.
+
+        Returns:
+            np.ndarray: Values of the column.
+        """
+        values = self.table.column(column)
+        if values.num_chunks == 1:
+            return values.chunk(0).to_numpy(zero_copy_only=True)
+        return values.to_numpy()
+
+    def lookup(self, genes: pd.Series, exons) -> np.ndarray:
+        """
+        Function which finds the reference rows of exons.
+
+        Args:
+            genes (pd.Series): Genes of the exons.
+            exons (array-like): Exon numbers.
+
+        Returns:
+            np.ndarray: Row of every exon in the reference, -1 if the exon is not part of it.
+        """
+        if isinstance(genes.dtype, pd.CategoricalDtype):
+            # Translate the (few) categories instead of every row
+            codes = self.genes.get_indexer(genes.cat.categories.astype(str))
+            codes = np.append(codes, -1)[genes.cat.codes.to_numpy()]
+        else:
+            codes = self.genes.get_indexer(genes.astype(str))
+        keys = _exon_keys(codes, np.asarray(exons))
+        rows = np.searchsorted(self.keys, keys)
+        rows[rows == len(self.keys)] = 0
+        found = (codes >= 0) & (len(self.keys) > 0)
+        found[found] = self.keys[rows[found]] == keys[found]
+        rows[~found] = -1
+        return rows
+
+    def merge(self, df: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+        """
+        Function which adds reference columns to a DataFrame by gene and exon, like a left merge which keeps
+        the rows and the order of df (the reference has one row per gene and exon).
+
+        Args:
+            df (pd.DataFrame): DataFrame with gene and exon columns (not altered).
+            columns (list): Reference columns to add (default: all).
+
+        Returns:
+            pd.DataFrame: DataFrame with the reference columns appended, NaN for exons missing from the reference.
+        """
+        rows = self.lookup(df["gene"], df["exon"].to_numpy())
+        missing = rows < 0
+        merged = {}
+        for column in columns or self.columns:
+            values = self._values(column)[rows]
+            if missing.any():
+                if values.dtype.kind not in "fc":
+                    values = values.astype(np.float64)
+                values[missing] = np.nan
+            merged[column] = values
+        return df.assign(**merged)
+
+
+def load_shared_reference(path) -> SharedReference:
+    """
+    Function which attaches to a published reference, once per process.
+
+    Args:
+        path (str | Path): Path to the published Arrow IPC file.
+
+    Returns:
+        SharedReference: Shared reference.
+    """
+    path = str(path)
+    with _reference_lock:
+        if path not in _shared_references:
+            _shared_references[path] = SharedReference(path)
+        return _shared_references[path]
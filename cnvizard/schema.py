@@ -0,0 +1,127 @@
+"""
+File which contains the compact column schema of the CNVizard sample and reference DataFrames
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import numpy as np
+import pandas as pd
+
+# Columns with few distinct values, stored as pandas categoricals (Arrow dictionaries)
+CATEGORICAL_COLUMNS = ["chromosome", "gene"]
+
+FREQUENCY_DTYPES = {
+    "het_del_frequency": "float32",
+    "hom_del_frequency": "float32",
+    "dup_frequency": "float32",
+}
+
+# .cnr/bintest DataFrames of the index patient (and its parents)
+SAMPLE_DTYPES = {
+    "start": "int32",
+    "end": "int32",
+    "exon": "int16",
+    "log2": "float32",
+    "depth": "float32",
+    "weight": "float32",
+    "call": "int8",
+    "CN": "float32",
+    "squaredvalue": "float32",
+    "gene_size": "int32",
+    **FREQUENCY_DTYPES,
+}
+
+# Merged references (cnv_reference.parquet and cnv_reference_bintest.parquet)
+REFERENCE_DTYPES = {
+    "exon": "int16",
+    **FREQUENCY_DTYPES,
+    **{
+        f"{statistic}_{column}": "float32"
+        for statistic in ["mean", "median", "q1", "q3", "std"]
+        for column in ["depth", "log2"]
+    },
+    "actual_minimum_log2": "float32",
+    "actual_maximum_log2": "float32",
+    "actual_minimum_depth": "float32",
+    "actual_maximum_depth": "float32",
+}
+
+
+def _can_cast(series: pd.Series, dtype: str) -> bool:
+    """
+    Function which checks whether a column can be cast to a compact dtype without changing its values.
+    Integer columns are only narrowed if all values fit into the smaller type.
+
+    Args:
+        series (pd.Series): Column to be cast.
+        dtype (str): Target dtype.
+
+    Returns:
+        bool: True if the column can (and has to) be cast.
+    """
+    if series.dtype == dtype:
+        return False
+    if np.dtype(dtype).kind == "f":
+        return pd.api.types.is_numeric_dtype(series)
+    if not pd.api.types.is_integer_dtype(series):
+        return False
+    limits = np.iinfo(dtype)
+    return series.empty or (
+        limits.min <= series.min() and series.max() <= limits.max
+    )
+
+
+def apply_schema(
+    df: pd.DataFrame, dtypes: dict, categorical: bool = True
+) -> pd.DataFrame:
+    """
+    Function which casts the columns of a DataFrame to the compact schema.
+    Columns which are missing or whose values do not fit into the compact dtype are left untouched.
+
+    Args:
+        df (pd.DataFrame): DataFrame to be cast.
+        dtypes (dict): Compact dtype of each column (SAMPLE_DTYPES or REFERENCE_DTYPES).
+        categorical (bool): Also convert the gene and chromosome columns to categoricals.
+
+    Returns:
+        pd.DataFrame: DataFrame using the compact schema.
+    """
+    casts = {
+        column: dtype
+        for column, dtype in dtypes.items()
+        if column in df.columns and _can_cast(df[column], dtype)
+    }
+    if categorical:
+        casts.update(
+            {
+                column: "category"
+                for column in CATEGORICAL_COLUMNS
+                if column in df.columns and df[column].dtype != "category"
+            }
+        )
+    return df.astype(casts) if casts else df
+
+
+def widen_floats(df: pd.DataFrame, decimals: int = None) -> pd.DataFrame:
+    """
+    Function which converts the float32 columns of a DataFrame to float64 for display and export,
+    so values such as 0.12 are not shown as 0.11999999731779099.
+
+    Args:
+        df (pd.DataFrame): DataFrame using the compact schema.
+        decimals (int): Round the float columns to this number of decimals. If None, every float32 value is
+            converted to the float64 value of its shortest decimal representation (slower, but exact).
+
+    Returns:
+        pd.DataFrame: DataFrame with float64 columns.
+    """
+    columns = [column for column in df.columns if df[column].dtype == np.float32]
+    if decimals is not None:
+        return df.astype(dict.fromkeys(columns, "float64")).round(decimals)
+    if not columns:
+        return df
+    df = df.copy()
+    for column in columns:
+        df[column] = df[column].to_numpy().astype(str).astype(np.float64)
+    return df
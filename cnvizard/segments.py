@@ -0,0 +1,128 @@
+"""
+File which contains the run-length segmentation of consecutive deletions and duplications of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import numpy as np
+import pandas as pd
+
+# Calls forming the runs of deletions and duplications
+SEGMENT_CALLS = {"del": (0, 1), "dup": (3,)}
+
+
+def find_segments(df: pd.DataFrame, del_or_dup: str, across_genes: bool = False):
+    """
+    Function which finds the contiguous runs of deleted or duplicated exons/bins in one sorted pass.
+    The rows are ordered by chromosome, gene (unless across_genes is set) and start. A run ends at a row with
+    another call, at a chromosome boundary and, unless across_genes is set, at a gene boundary or a gap in the
+    exon numbers (e.g. exons missing from the table).
+
+    Args:
+        df (pd.DataFrame): .cnr DataFrame (chromosome, start, end, gene, exon, log2, call and optionally gene_size).
+        del_or_dup (str): Find runs of deletions (del) or duplications (dup).
+        across_genes (bool): Let runs continue across gene boundaries along the chromosome.
+
+    Returns:
+        pd.Series: Segment number of each row (-1 for rows outside of a run), indexed like df.
+        pd.DataFrame: Segment table with chromosome, start, end, start_gene, start_exon, end_gene, end_exon,
+            length (number of exons/bins), mean_log2 and gene_size (of the start gene, if df has a gene_size column).
+    """
+    chromosome_codes = pd.factorize(df["chromosome"])[0]
+    gene_codes = pd.factorize(df["gene"])[0]
+    # Bins shared by overlapping genes appear once per gene, so per gene runs are found on rows ordered by gene first
+    keys = (df["start"].to_numpy(), chromosome_codes)
+    if not across_genes:
+        keys = (df["start"].to_numpy(), gene_codes, chromosome_codes)
+    order = np.lexsort(keys)
+    in_call = np.isin(df["call"].to_numpy()[order], SEGMENT_CALLS[del_or_dup])
+
+    # Boundaries between two neighbouring rows which a run must not cross
+    boundary = np.ones(len(order), dtype=bool)
+    chromosome_codes = chromosome_codes[order]
+    boundary[1:] = chromosome_codes[1:] != chromosome_codes[:-1]
+    if not across_genes:
+        gene_codes = gene_codes[order]
+        exons = df["exon"].to_numpy().astype(np.int64)[order]
+        boundary[1:] |= (gene_codes[1:] != gene_codes[:-1]) | (
+            np.abs(np.diff(exons)) != 1
+        )
+    run_start = in_call.copy()
+    run_start[1:] &= boundary[1:] | ~in_call[:-1]
+
+    run_ids = np.cumsum(run_start) - 1
+    run_ids[~in_call] = -1
+    segment_ids = np.empty(len(order), dtype=np.int64)
+    segment_ids[order] = run_ids
+
+    first = order[run_start]
+    lengths = np.bincount(run_ids[in_call], minlength=len(first))
+    last = order[np.flatnonzero(run_start) + lengths - 1]
+    log2 = df["log2"].to_numpy().astype(np.float64)[order]
+    segments = pd.DataFrame(
+        {
+            "chromosome": df["chromosome"].to_numpy()[first],
+            "start": df["start"].to_numpy()[first],
+            "end": df["end"].to_numpy()[last],
+            "start_gene": df["gene"].to_numpy()[first],
+            "start_exon": df["exon"].to_numpy()[first],
+            "end_gene": df["gene"].to_numpy()[last],
+            "end_exon": df["exon"].to_numpy()[last],
+            "length": lengths,
+            "mean_log2": np.bincount(
+                run_ids[in_call], weights=log2[in_call], minlength=len(first)
+            )
+            / np.maximum(lengths, 1),
+        }
+    )
+    if "gene_size" in df.columns:
+        segments["gene_size"] = df["gene_size"].to_numpy()[first]
+    return pd.Series(segment_ids, index=df.index), segments
+
+
+def select_segments(segments: pd.DataFrame, size) -> np.ndarray:
+    """
+    Function which selects the segments spanning at least size exons/bins.
+    Segments of at least two exons covering a whole gene are selected as well, even if the gene is smaller than size.
+
+    Args:
+        segments (pd.DataFrame): Segment table created by find_segments.
+        size (int | str): Minimal number of consecutive exons/bins (2 if empty).
+
+    Returns:
+        np.ndarray: Boolean mask of the selected segments.
+    """
+    size = 2 if size is None or size == "" else int(size)
+    selected = segments["length"].to_numpy() >= size
+    if "gene_size" in segments.columns:
+        selected |= (
+            (segments["start_gene"].to_numpy() == segments["end_gene"].to_numpy())
+            & (segments["length"].to_numpy() == segments["gene_size"].to_numpy())
+            & (segments["length"].to_numpy() > 1)
+        )
+    return selected
+
+
+def segment_rows(
+    df: pd.DataFrame, segment_ids: pd.Series, segments: pd.DataFrame, selected
+) -> pd.DataFrame:
+    """
+    Function which returns the rows of a DataFrame belonging to the selected segments.
+
+    Args:
+        df (pd.DataFrame): .cnr DataFrame, whose index is a subset of the index of segment_ids.
+        segment_ids (pd.Series): Segment number of each row created by find_segments.
+        segments (pd.DataFrame): Segment table created by find_segments.
+        selected (np.ndarray): Boolean mask of the selected segments.
+
+    Returns:
+        pd.DataFrame: Selected rows (in the order of df) with the columns segment and segment_length appended.
+    """
+    ids = segment_ids.reindex(df.index).to_numpy()
+    keep = ids >= 0
+    keep[keep] = selected[ids[keep]]
+    return df[keep].assign(
+        segment=ids[keep],
+        segment_length=segments["length"].to_numpy()[ids[keep]],
+    )
@@ -0,0 +1,77 @@
+"""
+File which contains the server-side sorting and paging of the displayed tables of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import numpy as np
+import pandas as pd
+
+# Selectable numbers of rows per page of the displayed tables
+PAGE_SIZES = [50, 100, 500, 1000]
+
+
+def sort_order(
+    df: pd.DataFrame, column: str = None, ascending: bool = True
+) -> np.ndarray:
+    """
+    Function which computes the row order of a table sorted by one column.
+    Categorical columns (e.g. gene) are sorted by the names of their categories.
+    Missing values come last in ascending order.
+
+    Args:
+        df (pd.DataFrame): Displayed table.
+        column (str): Column to sort by, None keeps the order of the table.
+        ascending (bool): Sort in ascending order.
+
+    Returns:
+        np.ndarray: Row positions in sorted order.
+    """
+    if column is None:
+        return np.arange(len(df))
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Rank of every category name, missing values (code -1) get the largest rank
+        names = values.cat.categories.astype(str)
+        ranks = np.argsort(np.argsort(names, kind="stable"))
+        keys = np.append(ranks, len(ranks))[values.cat.codes.to_numpy()]
+    elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        keys = values.to_numpy(dtype=np.float64, na_value=np.inf)
+    else:
+        keys = values.astype(str).to_numpy()
+    order = np.argsort(keys, kind="stable")
+    return order if ascending else order[::-1]
+
+
+def page_count(number_of_rows: int, page_size: int) -> int:
+    """
+    Function which computes the number of pages of a table (at least one).
+
+    Args:
+        number_of_rows (int): Number of rows of the table.
+        page_size (int): Number of rows per page.
+
+    Returns:
+        int: Number of pages.
+    """
+    return max((number_of_rows + page_size - 1) // page_size, 1)
+
+
+def get_page(
+    df: pd.DataFrame, order: np.ndarray, page: int, page_size: int
+) -> pd.DataFrame:
+    """
+    Function which returns the rows of one page of the sorted table.
+
+    Args:
+        df (pd.DataFrame): Displayed table.
+        order (np.ndarray): Row order created by sort_order.
+        page (int): Page number (starting at 1).
+        page_size (int): Number of rows per page.
+
+    Returns:
+        pd.DataFrame: Rows of the page.
+    """
+    start = (page - 1) * page_size
+    return df.iloc[order[start : start + page_size]]
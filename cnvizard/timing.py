@@ -0,0 +1,180 @@
+"""
+File which contains the stage timing instrumentation of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import os
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Setting this environment variable (or .env key) to 1/true/yes/on enables the instrumentation
+TIMING_VARIABLE = "CNVIZARD_TIMING"
+
+_enabled = os.getenv(TIMING_VARIABLE, "").lower() in ("1", "true", "yes", "on")
+
+
+class _SpanState(threading.local):
+    """
+    Per thread state of the spans: nesting depth and the records of the active recording.
+    Every Streamlit session runs its script in its own thread, so the sessions do not see each other's spans.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.records = None
+
+
+_state = _SpanState()
+
+
+def set_timing(enabled: bool = None):
+    """
+    Function which enables or disables the instrumentation.
+
+    Args:
+        enabled (bool): New state (default: read from the CNVIZARD_TIMING environment variable).
+    """
+    global _enabled
+    if enabled is None:
+        enabled = os.getenv(TIMING_VARIABLE, "").lower() in ("1", "true", "yes", "on")
+    _enabled = bool(enabled)
+
+
+def timing_enabled() -> bool:
+    """
+    Function which returns whether the instrumentation is enabled.
+
+    Returns:
+        bool: True if spans are measured.
+    """
+    return _enabled
+
+
+class _Span:
+    """
+    Context manager which measures the wall time of a block, logs it and adds it to the active recording.
+    """
+
+    __slots__ = ("name", "fields", "record", "start")
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        # The record is added on entry, so the recording lists the spans in the order they start
+        self.record = {"name": self.name, "depth": _state.depth, "duration_ms": None}
+        if _state.records is not None:
+            _state.records.append(self.record)
+        _state.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        _state.depth -= 1
+        self.record["duration_ms"] = duration_ms
+        if exc_type is not None:
+            self.record["error"] = exc_type.__name__
+        logger.info(
+            "%s took %.1f ms",
+            self.name,
+            duration_ms,
+            extra={
+                "span": self.name,
+                "duration_ms": duration_ms,
+                "depth": self.record["depth"],
+                "error": self.record.get("error"),
+                "fields": self.fields,
+            },
+        )
+        return False
+
+
+class _NullSpan:
+    """
+    Context manager returned by span while the instrumentation is disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, **fields):
+    """
+    Function which returns a context manager measuring the wall time of a stage.
+    Spans nest; every span is emitted as a log record of the logger cnvizard.timing (with the attributes span,
+    duration_ms, depth, error and fields) and added to the active recording (see record_spans).
+    While the instrumentation is disabled, a shared no-op context manager is returned.
+
+    Args:
+        name (str): Name of the stage.
+        **fields: Additional attributes of the log record (e.g. the number of rows).
+
+    Returns:
+        Context manager.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, fields)
+
+
+def timed(function=None, name: str = None):
+    """
+    Decorator which measures every call of a function as a span (see span), named after the qualified name
+    of the function unless a name is given. While the instrumentation is disabled, the function is called
+    directly.
+
+    Args:
+        function (callable): Decorated function (when used without arguments).
+        name (str): Name of the span.
+
+    Returns:
+        callable: Decorated function or decorator.
+    """
+    if function is None:
+        return functools.partial(timed, name=name)
+    span_name = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        with _Span(span_name, {}):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def record_spans():
+    """
+    Context manager which records the spans of the current thread, e.g. of one script run of the app.
+    Recordings nest, the inner one receives the spans while it is active.
+
+    Yields:
+        list: Records of the spans (dicts with the keys name, depth, duration_ms and error if the stage
+            raised), in the order the spans started.
+    """
+    previous = _state.records
+    records = []
+    _state.records = records
+    try:
+        yield records
+    finally:
+        _state.records = previous
@@ -0,0 +1,240 @@
+"""
+File which contains the lazily computed and memoized dataframe views of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import hashlib
+import numpy as np
+import pandas as pd
+from .segments import find_segments, select_segments, segment_rows
+
+# Views offered by the app (and exported as excel sheets, in this order)
+VIEW_NAMES = [
+    "total",
+    "bintest",
+    "hom_del",
+    "total_candidate",
+    "bintest_candidate",
+    "consecutive_del",
+    "consecutive_dup",
+    "del_segments",
+    "dup_segments",
+]
+
+
+def make_key(*parts) -> str:
+    """
+    Function which hashes the given parts (bytes of uploaded files, paths, filter values, ...) into a cache key.
+
+    Args:
+        *parts: Parts of the key.
+
+    Returns:
+        str: Hex digest of the parts.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def memoize(cache: dict, key, compute, max_entries: int = 32):
+    """
+    Function which returns the cached value of key or computes and caches it.
+    The cache keeps the max_entries most recently used values.
+
+    Args:
+        cache (dict): Cache dictionary (e.g. stored in st.session_state).
+        key: Cache key.
+        compute (callable): Function without arguments computing the value.
+        max_entries (int): Maximal number of cached values.
+
+    Returns:
+        Cached or computed value.
+    """
+    if key in cache:
+        value = cache.pop(key)
+    else:
+        value = compute()
+        while cache and len(cache) >= max_entries:
+            cache.pop(next(iter(cache)))
+    # (Re)inserting the key marks it as most recently used
+    cache[key] = value
+    return value
+
+
+class CNVViews:
+    """
+    Class used to compute the dataframe views of a sample lazily.
+    A view is only computed when it is requested and is memoized, keyed on the sample,
+    the base frame it is derived from and the parameters it depends on.
+    Cached frames are shared between reruns and must not be altered.
+    """
+
+    # View name -> (base frame, parameters the view depends on)
+    VIEWS = {
+        "total": ("total", ()),
+        "bintest": ("bintest", ()),
+        "hom_del": ("total", ()),
+        "total_candidate": ("total", ("candidate",)),
+        "bintest_candidate": ("bintest", ("candidate",)),
+        "consecutive_del": ("total", ("del_size", "across_genes")),
+        "consecutive_dup": ("total", ("dup_size", "across_genes")),
+        "del_segments": ("total", ("del_size", "across_genes")),
+        "dup_segments": ("total", ("dup_size", "across_genes")),
+    }
+
+    def __init__(
+        self,
+        visualizer,
+        cache: dict,
+        sample_key: str,
+        candidate_df: pd.DataFrame,
+        parameters: dict,
+    ):
+        """
+        Constructor of the class CNVViews.
+
+        Args:
+            visualizer (CNVVisualizer): Visualizer providing the filter functions.
+            cache (dict): Cache dictionary shared between reruns (e.g. stored in st.session_state).
+            sample_key (str): Key identifying the uploaded sample files and the reference.
+            candidate_df (pd.DataFrame): candigene DataFrame.
+            parameters (dict): Keys of the view parameters (candidate, del_size, dup_size, across_genes).
+        """
+        self.visualizer = visualizer
+        self.cache = cache
+        self.sample_key = sample_key
+        self.candidate_df = candidate_df
+        self.parameters = parameters
+        self.bases = {}
+
+    def add_base(self, name: str, key: str, compute):
+        """
+        Function which registers a base frame, which is computed lazily as well.
+
+        Args:
+            name (str): Name of the base frame (total, total_all or bintest).
+            key (str): Key of the inputs of the base frame (e.g. the filter selection).
+            compute (callable): Function without arguments computing the base frame.
+        """
+        self.bases[name] = (key, compute)
+
+    def get_base(self, name: str) -> pd.DataFrame:
+        """
+        Function which returns a (memoized) base frame.
+
+        Args:
+            name (str): Name of the base frame.
+
+        Returns:
+            pd.DataFrame: Base frame.
+        """
+        key, compute = self.bases[name]
+        return memoize(self.cache, (self.sample_key, "base", name, key), compute)
+
+    def get_segments(self, del_or_dup: str):
+        """
+        Function which returns the (memoized) segmentation of the unfiltered .cnr DataFrame.
+        Runs are found on the unfiltered frame, so filtered out exons do not join or split them.
+
+        Args:
+            del_or_dup (str): Segmentation of deletions (del) or duplications (dup).
+
+        Returns:
+            pd.Series: Segment number of each row.
+            pd.DataFrame: Segment table.
+        """
+        across_genes = self.parameters["across_genes"]
+        return memoize(
+            self.cache,
+            (self.sample_key, "segments", del_or_dup, across_genes),
+            lambda: find_segments(
+                self.get_base("total_all"), del_or_dup, across_genes
+            ),
+        )
+
+    def _base_name(self, name: str, unfiltered: bool) -> str:
+        """
+        Function which returns the name of the base frame of a view.
+
+        Args:
+            name (str): Name of the view.
+            unfiltered (bool): Derive the view from the unfiltered .cnr DataFrame.
+
+        Returns:
+            str: Name of the base frame.
+        """
+        base = self.VIEWS[name][0]
+        return "total_all" if base == "total" and unfiltered else base
+
+    def key(self, name: str, unfiltered: bool = False) -> tuple:
+        """
+        Function which returns the cache key of a view, identifying the sample, the base frame and the parameters.
+
+        Args:
+            name (str): Name of the view (see VIEW_NAMES).
+            unfiltered (bool): Derive the view from the unfiltered .cnr DataFrame (total_all) instead of the filtered one.
+
+        Returns:
+            tuple: Key of the view.
+        """
+        base = self._base_name(name, unfiltered)
+        return (
+            self.sample_key,
+            "view",
+            name,
+            base,
+            self.bases[base][0],
+            tuple(self.parameters[parameter] for parameter in self.VIEWS[name][1]),
+        )
+
+    def get(self, name: str, unfiltered: bool = False) -> pd.DataFrame:
+        """
+        Function which returns a (memoized) view.
+
+        Args:
+            name (str): Name of the view (see VIEW_NAMES).
+            unfiltered (bool): Derive the view from the unfiltered .cnr DataFrame (total_all) instead of the filtered one.
+
+        Returns:
+            pd.DataFrame: View.
+        """
+        base = self._base_name(name, unfiltered)
+        return memoize(
+            self.cache,
+            self.key(name, unfiltered),
+            lambda: self._compute(name, self.get_base(base)),
+        )
+
+    def _compute(self, name: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Function which computes a view from its base frame.
+
+        Args:
+            name (str): Name of the view.
+            df (pd.DataFrame): Base frame of the view.
+
+        Returns:
+            pd.DataFrame: View.
+        """
+        visualizer = self.visualizer
+        if name in ("total", "bintest"):
+            return df
+        if name == "hom_del":
+            return visualizer.filter_for_deletions_hom(df)
+        if name in ("total_candidate", "bintest_candidate"):
+            return visualizer.filter_for_candi_cnvs(df, self.candidate_df)
+        del_or_dup = "del" if name in ("consecutive_del", "del_segments") else "dup"
+        segment_ids, segments = self.get_segments(del_or_dup)
+        selected = select_segments(segments, self.parameters[f"{del_or_dup}_size"])
+        if name.startswith("consecutive"):
+            return segment_rows(df, segment_ids, segments, selected)
+        # Segments with at least one exon in the base frame
+        ids = segment_ids.reindex(df.index).to_numpy()
+        present = np.zeros(len(segments), dtype=bool)
+        present[ids[ids >= 0]] = True
+        return segments[selected & present].reset_index(drop=True)
@@ -24,7 +24,7 @@ setup(
     include_package_data=True,
     entry_points={
         "console_scripts": [
-            "cnvizard=cnvizard.app:main",
+            "cnvizard=cnvizard.cli:main",
         ],
     },
     classifiers=[
@@ -0,0 +1,43 @@
+"""
+File which contains the tests of the CNV annotation kernel of the CNVizard
+@author: Jeremias Krause, Carlos Classen, Matthias Begemann, Florian Kraft
+@company: UKA Aachen (RWTH)
+@mail: jerkrause@ukaachen.de
+"""
+
+import numpy as np
+import pandas as pd
+from cnvizard.annotation import NO_CALL, annotate_cnv_table, classify_calls
+
+
+def test_classify_calls_thresholds():
+    log2 = [-2.0, -1.1, -1.0, -0.4, 0.0, 0.3, 0.31]
+    assert classify_calls(log2).tolist() == [0, 0, 1, 1, 2, 2, 3]
+
+
+def test_classify_calls_nan():
+    calls = classify_calls(np.array([np.nan, -2.0, np.nan, 1.0]))
+    assert calls.dtype == np.int8
+    assert calls.tolist() == [NO_CALL, 0, NO_CALL, 3]
+
+
+def test_classify_calls_nullable_nan():
+    log2 = pd.Series([pd.NA, 0.0], dtype="Float64")
+    assert classify_calls(log2).tolist() == [NO_CALL, 2]
+
+
+def test_annotate_cnv_table_nan_is_no_duplication():
+    df = pd.DataFrame(
+        {
+            "chromosome": ["chr1", "chr1"],
+            "start": [100, 200],
+            "end": [150, 250],
+            "gene": ["GENE1", "GENE1"],
+            "exon": ["1", "2"],
+            "log2": [np.nan, 0.5],
+            "depth": [0.0, 100.0],
+            "weight": [0.0, 1.0],
+        }
+    )
+    annotated = annotate_cnv_table(df)
+    assert annotated["call"].tolist() == [NO_CALL, 3]